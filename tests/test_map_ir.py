@@ -0,0 +1,78 @@
+# MapIR checks. The addon imports bpy, so run these with Blender's Python, e.g.
+#     blender --background --factory-startup --python-expr "import pytest; pytest.main(['tests'])"
+import os, sys
+import pytest
+
+pytest.importorskip("bpy")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import trenchcoat_2_5 as trenchcoat
+
+def add_box(ir, name, lo, hi):
+    (x0, y0, z0), (x1, y1, z1) = lo, hi
+    ir.add_brush(name)
+    for corners in (
+        [(x0, y0, z0), (x0, y1, z0), (x1, y1, z0), (x1, y0, z0)],
+        [(x0, y0, z1), (x1, y0, z1), (x1, y1, z1), (x0, y1, z1)],
+        [(x0, y0, z0), (x1, y0, z0), (x1, y0, z1), (x0, y0, z1)],
+        [(x0, y1, z0), (x0, y1, z1), (x1, y1, z1), (x1, y1, z0)],
+        [(x1, y0, z0), (x1, y1, z0), (x1, y1, z1), (x1, y0, z1)],
+        [(x0, y0, z0), (x0, y0, z1), (x0, y1, z1), (x0, y1, z0)]):
+        ir.add_face(corners, "common/caulk", [0, 0, 0, 0.5, 0.5])
+
+def door_map(classname="func_door", origin="0 0 0", health="25", target="0 0 256"):
+    ir = trenchcoat.MapIR()
+    ir.add_entity("0")
+    ir.add_kv("classname", "worldspawn")
+    add_box(ir, "floor", (0, 0, -16), (256, 256, 0))
+    ir.add_entity("door")
+    ir.add_kv("classname", classname)
+    ir.add_kv("origin", origin)
+    add_box(ir, "door", (64, 64, 0), (128, 72, 128))
+    ir.add_entity("push")
+    ir.add_kv("classname", "trigger_push")
+    ir.add_kv("target", "up")
+    add_box(ir, "push", (192, 192, 0), (224, 224, 16))
+    ir.add_entity("apex")
+    ir.add_kv("classname", "target_position")
+    ir.add_kv("targetname", "up")
+    ir.add_kv("origin", target)
+    ir.add_entity("item")
+    ir.add_kv("classname", "item_health")
+    ir.add_kv("count", health)
+    return ir.finish()
+
+def test_section_hashes_stable():
+    assert door_map().section_hashes() == door_map().section_hashes()
+
+def test_point_entity_keys_are_entities_only():
+    geometry, entities = door_map().section_hashes()
+    changed = door_map(health="50").section_hashes()
+    assert changed[0] == geometry
+    assert changed[1] != entities
+
+def test_brush_entity_keys_are_compile_input():
+    geometry = door_map().section_hashes()[0]
+    assert door_map(classname="func_plat").section_hashes()[0] != geometry
+    assert door_map(origin="8 0 0").section_hashes()[0] != geometry
+
+def test_brush_entity_targets_are_compile_input():
+    geometry = door_map().section_hashes()[0]
+    assert door_map(target="0 0 512").section_hashes()[0] != geometry
+
+def test_sealed_room_stays_structural():
+    ir = trenchcoat.MapIR()
+    ir.add_entity("0")
+    ir.add_kv("classname", "worldspawn")
+    add_box(ir, "floor", (-16, -16, -16), (272, 272, 0))
+    add_box(ir, "ceiling", (-16, -16, 256), (272, 272, 272))
+    add_box(ir, "west", (-16, 0, 0), (0, 256, 256))
+    add_box(ir, "east", (256, 0, 0), (272, 256, 256))
+    add_box(ir, "south", (0, -16, 0), (256, 0, 256))
+    add_box(ir, "north", (0, 256, 0), (256, 272, 256))
+    add_box(ir, "crate", (64, 64, 0), (128, 128, 64))
+    ir.add_entity("player")
+    ir.add_kv("classname", "info_player_start")
+    ir.add_kv("origin", "192 192 32")
+    ir = ir.finish()
+    assert trenchcoat.classify_detail(ir).tolist() == [0, 0, 0, 0, 0, 0, 3]
+    assert not trenchcoat.find_leaks(ir)
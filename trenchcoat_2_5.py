@@ -27,31 +27,758 @@ bl_info = {
     "category": "Import-Export"
 }
 
-global_list_of_things = []
-
-import bpy, bmesh, math, time
+import bpy, bmesh, math, time, os, io, hashlib, subprocess, shlex, threading, queue, json, shutil
+import numpy as np
 from mathutils import Vector, Matrix
 from numpy.linalg import solve
 from numpy import format_float_positional as fformat
 from bpy_extras.io_utils import ExportHelper
 from bpy.props import *
+from bpy.app.handlers import persistent
+
+def next_loops(face_sizes):
+    """Index of the following corner of every polygon corner, wrapping per polygon"""
+    starts = np.cumsum(face_sizes) - face_sizes
+    nxt = np.arange(int(face_sizes.sum())) + 1
+    nxt[starts + face_sizes - 1] = starts
+    return nxt
+
+def face_planes(co, loop_verts, face_sizes):
+    """Unit normals, plane distances and areas of polygons given as flat corner indices.
+    Uses Newell's method, so n-gons and slightly bent faces get a sensible plane"""
+    starts = np.cumsum(face_sizes) - face_sizes
+    a = co[loop_verts]
+    b = co[loop_verts[next_loops(face_sizes)]]
+    cross = np.stack(((a[:, 1] - b[:, 1]) * (a[:, 2] + b[:, 2]),
+                      (a[:, 2] - b[:, 2]) * (a[:, 0] + b[:, 0]),
+                      (a[:, 0] - b[:, 0]) * (a[:, 1] + b[:, 1])), axis=1)
+    normals = np.add.reduceat(cross, starts, axis=0)
+    length = np.linalg.norm(normals, axis=1)
+    normals /= np.where(length > 0, length, 1.0)[:, None]
+    centers = np.add.reduceat(a, starts, axis=0) / face_sizes[:, None]
+    dists = np.einsum('ij,ij->i', normals, centers)
+    return normals, dists, length / 2
+
+def bmesh_arrays(bm):
+    """Vertex coordinates, flat polygon corner indices and polygon sizes of a bmesh"""
+    bm.verts.index_update()
+    co = np.array([vert.co for vert in bm.verts], dtype=np.float64).reshape(-1, 3)
+    loop_verts = np.array([vert.index for face in bm.faces for vert in face.verts], dtype=np.int64)
+    face_sizes = np.array([len(face.verts) for face in bm.faces], dtype=np.int64)
+    return co, loop_verts, face_sizes
+
+def is_clean_brush(co, loop_verts, face_sizes, eps=0.001):
+    """True if the polygons already are a valid brush: closed, planar, outward facing,
+    every vertex on or behind every plane, no plane used twice and the first three
+    corners of each face (the ones written to the map) spanning its plane"""
+    if len(face_sizes) < 4 or face_sizes.min() < 3:
+        return False
+    normals, dists, areas = face_planes(co, loop_verts, face_sizes)
+    if areas.min() <= eps:
+        return False
+    face_of_loop = np.repeat(np.arange(len(face_sizes)), face_sizes)
+    off_plane = np.einsum('ij,ij->i', co[loop_verts], normals[face_of_loop]) - dists[face_of_loop]
+    if np.abs(off_plane).max() > eps:
+        return False
+    if (co @ normals.T - dists).max() > eps:
+        return False
+    starts = np.cumsum(face_sizes) - face_sizes
+    p0, p1, p2 = co[loop_verts[starts]], co[loop_verts[starts + 1]], co[loop_verts[starts + 2]]
+    if np.einsum('ij,ij->i', np.cross(p1 - p0, p2 - p0), normals).min() <= eps:
+        return False
+    # closed: every edge is walked once in each direction
+    ends = loop_verts[next_loops(face_sizes)]
+    forward = loop_verts * len(co) + ends
+    backward = ends * len(co) + loop_verts
+    if np.unique(forward).size != forward.size or not np.array_equal(np.sort(forward), np.sort(backward)):
+        return False
+    planes = np.round(np.hstack((normals, dists[:, None] * 0.01)), 4)
+    return len(np.unique(planes, axis=0)) == len(face_sizes)
+
+def brush_issues(co, loop_verts, face_sizes, grid=0, eps=0.01):
+    """What a compiler would reject or mangle in a brush, coordinates and grid in map units"""
+    if len(co) < 4 or len(face_sizes) < 4 or face_sizes.min() < 3:
+        return ['degenerate']
+    issues = []
+    normals, dists, areas = face_planes(co, loop_verts, face_sizes)
+    if areas.min() <= eps:
+        issues.append('degenerate')
+    face_of_loop = np.repeat(np.arange(len(face_sizes)), face_sizes)
+    off_plane = np.einsum('ij,ij->i', co[loop_verts], normals[face_of_loop]) - dists[face_of_loop]
+    if np.abs(off_plane).max() > eps:
+        issues.append('non-planar')
+    if (co @ normals.T - dists).max() > eps:
+        issues.append('non-convex')
+    if (co.max(axis=0) - co.min(axis=0)).min() < 1.0:
+        issues.append('microscopic')
+    if grid and grid_misaligned(co, grid).any():
+        issues.append('off-grid')
+    return issues
+
+class MapIR:
+    """Columnar form of an exported map, independent of Blender.
+
+    Entities own runs of key/values and brushes, brushes own runs of faces, faces own
+    runs of polygon corners (in map units). Runs are stored as start offsets with one
+    extra end entry. Every string is interned once in strings, the columns only hold
+    indices into it. Filled by MapWriter through the add_* methods, frozen into arrays
+    by finish(), written out by iter_text() and kept on disk with save()/load().
+    """
+    columns = ('ent_name', 'ent_kvs', 'ent_brushes', 'kv_key', 'kv_value',
+               'brush_name', 'brush_faces', 'face_tex', 'face_align', 'face_contents',
+               'face_index', 'face_corners', 'corners')
+
+    def __init__(self):
+        self.strings = []
+        self.string_ids = {}
+        self.ent_name, self.ent_kvs, self.ent_brushes = [], [0], [0]
+        self.kv_key, self.kv_value = [], []
+        self.brush_name, self.brush_faces = [], [0]
+        self.face_tex, self.face_align, self.face_contents, self.face_index = [], [], [], []
+        self.face_corners, self.corners = [0], []
+
+    def intern(self, text):
+        index = self.string_ids.get(text)
+        if index is None:
+            index = self.string_ids[text] = len(self.strings)
+            self.strings.append(text)
+        return index
+
+    def add_entity(self, name):
+        self.ent_name.append(self.intern(name))
+        self.ent_kvs.append(self.ent_kvs[-1])
+        self.ent_brushes.append(self.ent_brushes[-1])
+
+    def add_kv(self, key, value):
+        self.kv_key.append(self.intern(key))
+        self.kv_value.append(self.intern(str(value)))
+        self.ent_kvs[-1] += 1
+
+    def add_brush(self, name):
+        self.brush_name.append(self.intern(name))
+        self.brush_faces.append(self.brush_faces[-1])
+        self.ent_brushes[-1] += 1
+
+    def add_face(self, corners, texture, align, contents=0, index=-1):
+        """corners: polygon points in map units, texture: shader name,
+        align: offset x, offset y, rotation, scale x, scale y"""
+        self.corners.extend(corners)
+        self.face_corners.append(self.face_corners[-1] + len(corners))
+        self.face_tex.append(self.intern(texture))
+        self.face_align.append(align)
+        self.face_contents.append(contents)
+        self.face_index.append(index)
+        self.brush_faces[-1] += 1
+
+    def finish(self):
+        """Turn the filled lists into arrays"""
+        for name in self.columns:
+            dtype = np.float64 if name in ('face_align', 'corners') else np.int64
+            setattr(self, name, np.asarray(getattr(self, name), dtype=dtype))
+        self.face_align = self.face_align.reshape(-1, 5)
+        self.corners = self.corners.reshape(-1, 3)
+        return self
+
+    @property
+    def brush_ent(self):
+        """Entity index of every brush"""
+        return np.repeat(np.arange(len(self.ent_name)), np.diff(self.ent_brushes))
+
+    @property
+    def face_brush(self):
+        """Brush index of every face"""
+        return np.repeat(np.arange(len(self.brush_name)), np.diff(self.brush_faces))
+
+    def iter_text(self, precision=5):
+        """Yield the .map text, one chunk per brush and per entity"""
+        strings = self.strings
+        def vec(values):
+            return ' '.join(fformat(co, precision=precision, trim='-') for co in values)
+        for ent in range(len(self.ent_name)):
+            chunk = [f'// entity {strings[self.ent_name[ent]]}\n{{\n']
+            for kv in range(self.ent_kvs[ent], self.ent_kvs[ent + 1]):
+                chunk.append(f'"{strings[self.kv_key[kv]]}" "{strings[self.kv_value[kv]]}"\n')
+            for brush in range(self.ent_brushes[ent], self.ent_brushes[ent + 1]):
+                chunk.append(f'// {strings[self.brush_name[brush]]}\n{{\n')
+                for face in range(self.brush_faces[brush], self.brush_faces[brush + 1]):
+                    start = self.face_corners[face]
+                    for point in self.corners[start:start + 3][::-1]:
+                        chunk.append(f'( {vec(point)} ) ')
+                    chunk.append(f'{strings[self.face_tex[face]]} {vec(self.face_align[face])}')
+                    contents = self.face_contents[face]
+                    # content flags before the comment: the compiler stops reading the line at
+                    # '//'. Older exports wrote them after it, so their .detail tags did nothing
+                    if contents:
+                        chunk.append(f' {contents} 0 0')
+                    chunk.append(f' // face index: {self.face_index[face]}\n')
+                chunk.append('}\n')
+                yield ''.join(chunk)
+                chunk = []
+            chunk.append('}\n')
+            yield ''.join(chunk)
+
+    def drop_brushes(self, drop):
+        """Remove the brushes where drop is True, in place"""
+        keep = ~np.asarray(drop, dtype=bool)
+        if keep.all():
+            return self
+        face_keep = keep[self.face_brush]
+        ent_counts = np.bincount(self.brush_ent[keep], minlength=len(self.ent_name))
+        face_sizes = np.diff(self.face_corners)
+        self.corners = self.corners[np.repeat(face_keep, face_sizes)]
+        self.face_corners = np.concatenate(([0], np.cumsum(face_sizes[face_keep])))
+        for name in ('face_tex', 'face_align', 'face_contents', 'face_index'):
+            setattr(self, name, getattr(self, name)[face_keep])
+        self.brush_faces = np.concatenate(([0], np.cumsum(np.diff(self.brush_faces)[keep])))
+        self.brush_name = self.brush_name[keep]
+        self.ent_brushes = np.concatenate(([0], np.cumsum(ent_counts)))
+        return self
+
+    def replace_brushes(self, replaced):
+        """Swap in new faces for some brushes, replaced maps a brush to a list of
+        (corners, texture id, align, contents, index). Returns self"""
+        if not replaced:
+            return self
+        columns = {name: [] for name in ('face_tex', 'face_align', 'face_contents', 'face_index')}
+        sizes, corners, brush_sizes = [], [], []
+        face_sizes = np.diff(self.face_corners)
+        for brush in range(len(self.brush_name)):
+            faces = slice(self.brush_faces[brush], self.brush_faces[brush + 1])
+            if brush in replaced:
+                new = replaced[brush]
+                columns['face_tex'].append(np.array([face[1] for face in new], dtype=np.int64))
+                columns['face_align'].append(np.array([face[2] for face in new], dtype=np.float64).reshape(-1, 5))
+                columns['face_contents'].append(np.array([face[3] for face in new], dtype=np.int64))
+                columns['face_index'].append(np.array([face[4] for face in new], dtype=np.int64))
+                sizes.append(np.array([len(face[0]) for face in new], dtype=np.int64))
+                corners.extend(np.asarray(face[0], dtype=np.float64).reshape(-1, 3) for face in new)
+                brush_sizes.append(len(new))
+            else:
+                for name, column in columns.items():
+                    column.append(getattr(self, name)[faces])
+                sizes.append(face_sizes[faces])
+                corners.append(self.corners[self.face_corners[faces.start]:self.face_corners[faces.stop]])
+                brush_sizes.append(faces.stop - faces.start)
+        for name, column in columns.items():
+            setattr(self, name, np.concatenate(column))
+        self.face_corners = np.concatenate(([0], np.cumsum(np.concatenate(sizes))))
+        self.corners = np.concatenate(corners)
+        self.brush_faces = np.concatenate(([0], np.cumsum(brush_sizes)))
+        return self
+
+    def section_hashes(self):
+        """sha1 hex digests of the compile input (brushes and their grouping, worldspawn and
+        brush entities, lights, models and whatever lights or brush entities target, compiler
+        keys starting with _)
+        and of the rest of the point entity keys, which an entities-only compile can update"""
+        strings = self.strings
+        geometry, entities = hashlib.sha1(), hashlib.sha1()
+        owners = np.unique(self.brush_ent, return_inverse=True)[1]
+        for array, dtype in ((self.brush_faces, np.int64), (self.face_corners, np.int64), (self.corners, np.float64),
+                             (self.face_align, np.float64), (self.face_contents, np.int64), (owners, np.int64)):
+            geometry.update(np.ascontiguousarray(array, dtype=dtype).tobytes())
+        geometry.update('\n'.join(strings[tex] for tex in self.face_tex.tolist()).encode())
+        keys = [[(strings[self.kv_key[kv]], strings[self.kv_value[kv]]) for kv in range(self.ent_kvs[ent], self.ent_kvs[ent + 1])]
+                for ent in range(len(self.ent_name))]
+        lit = {value for kvs in keys if dict(kvs).get("classname", "").startswith("light") for key, value in kvs if key == "target"}
+        # -onlyents can't rebuild brush models, so their class, origin etc. are compile input
+        owns_brushes = (np.diff(self.ent_brushes) > 0).tolist()
+        # and bspc follows trigger_teleport and trigger_push to their targets for the .aas
+        pushed = {value for ent, kvs in enumerate(keys) if owns_brushes[ent] for key, value in kvs if key == "target"}
+        for ent, kvs in enumerate(keys):
+            found = dict(kvs)
+            compiled = (ent == 0 or owns_brushes[ent] or found.get("classname", "").startswith(("light", "misc_model"))
+                        or found.get("targetname") in lit or found.get("targetname") in pushed)
+            for key, value in kvs:
+                section = geometry if compiled or key.startswith("_") else entities
+                section.update(f"{ent}\0{key}\0{value}\n".encode())
+        return geometry.hexdigest(), entities.hexdigest()
+
+    def save(self, path):
+        """Store as a compressed .npz, strings packed as NUL terminated UTF-8"""
+        packed = np.frombuffer(''.join(text + '\0' for text in self.strings).encode('utf-8'), dtype=np.uint8)
+        np.savez_compressed(path, strings=packed, **{name: getattr(self, name) for name in self.columns})
+
+    @classmethod
+    def load(cls, path):
+        ir = cls()
+        with np.load(path) as data:
+            for name in cls.columns:
+                setattr(ir, name, data[name])
+            packed = data['strings'].tobytes().decode('utf-8')
+        ir.strings = packed.split('\0')[:-1]
+        ir.string_ids = {text: index for index, text in enumerate(ir.strings)}
+        return ir
+
+class BrushGeometry:
+    """Per face planes and per brush bounds of a finished MapIR, for the export passes.
+    Normals point out of the brush, distances are in map units."""
+    def __init__(self, ir):
+        self.ir = ir
+        self.face_sizes = np.diff(ir.face_corners)
+        self.normals, self.dists, self.areas = face_planes(ir.corners, np.arange(len(ir.corners)), self.face_sizes)
+        self.face_brush = ir.face_brush
+        self.brush_ent = ir.brush_ent
+        self.corner_start = ir.face_corners[ir.brush_faces]
+        self.contents = np.zeros(len(ir.brush_name), dtype=np.int64)
+        self.lo = np.zeros((len(ir.brush_name), 3))
+        self.hi = np.zeros((len(ir.brush_name), 3))
+        filled = np.diff(ir.brush_faces) > 0
+        if filled.any():
+            starts = self.corner_start[:-1][filled]
+            self.lo[filled] = np.minimum.reduceat(ir.corners, starts)
+            self.hi[filled] = np.maximum.reduceat(ir.corners, starts)
+            self.contents[filled] = ir.face_contents[ir.brush_faces[:-1][filled]]
+
+    def points(self, brush):
+        return self.ir.corners[self.corner_start[brush]:self.corner_start[brush + 1]]
+
+    def planes(self, brush):
+        faces = slice(self.ir.brush_faces[brush], self.ir.brush_faces[brush + 1])
+        return self.normals[faces], self.dists[faces]
+
+    def contains(self, outer, inner, eps=0.01):
+        """True if every corner of brush inner is inside (or on) brush outer"""
+        normals, dists = self.planes(outer)
+        return bool(np.all(self.points(inner) @ normals.T - dists <= eps))
+
+    def spatial_hash(self, brushes, cell=None):
+        """Grid cell -> brushes overlapping it, and the brushes too large to hash"""
+        if cell is None:
+            extent = np.median((self.hi - self.lo)[brushes].max(axis=1)) if len(brushes) else 1.0
+            cell = max(float(extent) * 2, 1.0)
+        a = np.floor(self.lo / cell).astype(np.int64)
+        b = np.floor(self.hi / cell).astype(np.int64)
+        cells, large = {}, []
+        for brush in brushes:
+            lo, hi = a[brush].tolist(), b[brush].tolist()
+            if (hi[0] - lo[0] + 1) * (hi[1] - lo[1] + 1) * (hi[2] - lo[2] + 1) > 64:
+                large.append(brush)
+                continue
+            for x in range(lo[0], hi[0] + 1):
+                for y in range(lo[1], hi[1] + 1):
+                    for z in range(lo[2], hi[2] + 1):
+                        cells.setdefault((x, y, z), []).append(brush)
+        return cell, cells, large
+
+# shaders that don't hide what is behind them or don't block, by part of their name
+NONSOLID_SHADERS = "common/, water, lava, slime, fog, glass, trans"
+
+def solid_faces(ir, nonsolid=NONSOLID_SHADERS):
+    """Faces of a MapIR whose shader is taken as opaque and solid: its name contains none of
+    the comma separated nonsolid parts. Caulk always is."""
+    parts = [part.strip().lower() for part in nonsolid.split(',') if part.strip()]
+    solid = np.array([not any(part in name.lower() for part in parts) or "caulk" in name.lower()
+                      for name in ir.strings] or [True], dtype=bool)
+    return solid[ir.face_tex]
+
+def cull_brushes(ir, eps=0.01, nonsolid=NONSOLID_SHADERS):
+    """Brushes to drop from a finished MapIR: exact duplicates (same planes with the same
+    shaders, contents and entity) and brushes inside another brush of the same entity and
+    contents, which is solid (see solid_faces) or has the same shaders as the inner one.
+    Returns a boolean mask over the brushes."""
+    geometry = BrushGeometry(ir)
+    count = len(ir.brush_name)
+    drop = np.zeros(count, dtype=bool)
+    shaders = [frozenset(ir.face_tex[ir.brush_faces[brush]:ir.brush_faces[brush + 1]].tolist()) for brush in range(count)]
+    opaque = dict(zip(ir.face_tex.tolist(), solid_faces(ir, nonsolid).tolist()))
+    solid = [all(opaque[tex] for tex in found) for found in shaders]
+    seen = {}
+    for brush in range(count):
+        normals, dists = geometry.planes(brush)
+        if not len(dists):
+            continue
+        faces = slice(ir.brush_faces[brush], ir.brush_faces[brush + 1])
+        planes = np.round(np.column_stack((normals * 1e4, dists * 1e2))).astype(np.int64)
+        planes = np.column_stack((planes, ir.face_tex[faces]))
+        planes = planes[np.lexsort(planes.T[::-1])]
+        key = (geometry.brush_ent[brush], geometry.contents[brush], hashlib.sha1(planes.tobytes()).digest())
+        if key in seen:
+            drop[brush] = True
+        else:
+            seen[key] = brush
+    # a brush containing another covers the cell of the inner one's lowest corner
+    alive = np.flatnonzero(~drop & (np.diff(ir.brush_faces) > 0))
+    cell, cells, large = geometry.spatial_hash(alive)
+    for inner in alive:
+        key = tuple(np.floor(geometry.lo[inner] / cell).astype(np.int64).tolist())
+        for outer in cells.get(key, []) + large:
+            if (outer == inner or drop[outer] or geometry.brush_ent[outer] != geometry.brush_ent[inner]
+                    or geometry.contents[outer] != geometry.contents[inner]
+                    or not (solid[outer] or shaders[outer] == shaders[inner])):
+                continue
+            if (np.all(geometry.lo[outer] <= geometry.lo[inner] + eps) and np.all(geometry.hi[outer] >= geometry.hi[inner] - eps)
+                    and geometry.contains(outer, inner, eps)):
+                drop[inner] = True
+                break
+    return drop
+
+CONTENTS_DETAIL = 1 << 27
+DETAIL_FLAGS = (".detail", "-detail", "_detail", "/detail")
+STRUCTURAL_FLAGS = (".structural", "-structural", "_structural", "/structural")
+DETAIL_REASONS = {1: "brush entity", 2: "small", 3: "free-standing"}
+
+def has_tag(obj, flags, word):
+    """Object or its collection named with one of flags, or the collection called word"""
+    name, col = obj.name.lower(), obj.users_collection[0].name.lower()
+    return any(flag in name or flag in col for flag in flags) or col == word
+
+def contact_sides(geometry, brushes, eps=0.01):
+    """Bitmask per brush of the bounding box sides (-x +x -y +y -z +z) touching the bounds of
+    another of the given brushes over a face or an edge, corners alone don't count"""
+    sides = np.zeros(len(geometry.lo), dtype=np.int64)
+    if len(brushes) < 2:
+        return sides
+    lo, hi = geometry.lo - eps, geometry.hi + eps
+    cell = max(float(np.median((hi - lo)[brushes].max(axis=1))) * 2, 1.0)
+    a, b = np.floor(lo / cell).astype(np.int64), np.floor(hi / cell).astype(np.int64)
+    cells, large = {}, []
+    for brush in brushes.tolist():
+        x0, y0, z0 = a[brush].tolist()
+        x1, y1, z1 = b[brush].tolist()
+        if (x1 - x0 + 1) * (y1 - y0 + 1) * (z1 - z0 + 1) > 64:
+            large.append(brush)
+            continue
+        for x in range(x0, x1 + 1):
+            for y in range(y0, y1 + 1):
+                for z in range(z0, z1 + 1):
+                    cells.setdefault((x, y, z), []).append(brush)
+    pairs = {(p, q) for members in cells.values() for i, p in enumerate(members) for q in members[i + 1:]}
+    pairs.update((min(p, q), max(p, q)) for p in large for q in brushes.tolist() if p != q)
+    if not pairs:
+        return sides
+    p, q = np.array(sorted(pairs)).T
+    overlap = np.minimum(geometry.hi[p], geometry.hi[q]) - np.maximum(geometry.lo[p], geometry.lo[q])
+    touch = np.all(overlap >= -eps, axis=1) & (overlap.max(axis=1) > eps)
+    p, q, overlap = p[touch], q[touch], overlap[touch]
+    # the sides are the axes the bounds meet on, the one they overlap least when they intersect
+    meet = overlap <= eps
+    meet[np.arange(len(p)), np.argmin(overlap, axis=1)] = True
+    above = (geometry.lo[q] + geometry.hi[q]) > (geometry.lo[p] + geometry.hi[p])
+    bits = 1 << (np.arange(3) * 2 + above)
+    np.bitwise_or.at(sides, p, np.bitwise_or.reduce(np.where(meet, bits, 0), axis=1))
+    bits = 1 << (np.arange(3) * 2 + ~above)
+    np.bitwise_or.at(sides, q, np.bitwise_or.reduce(np.where(meet, bits, 0), axis=1))
+    return sides
+
+def classify_detail(ir, size=32.0, structural=None, geometry=None, resolution=16.0):
+    """Structural brushes of a finished MapIR that can be detail, for faster vis. Returns the
+    reason per brush (a DETAIL_REASONS key, 0 to leave the brush alone): part of a brush
+    entity, bounds smaller than a cube of size map units, or free-standing, touching other
+    worldspawn brushes on at most one side. Worldspawn brushes next to the void (void_fill
+    at resolution map units) seal the map and are never made detail.
+    structural is an optional mask of brushes to always keep."""
+    geometry = geometry or BrushGeometry(ir)
+    filled = np.diff(ir.brush_faces) > 0
+    candidates = filled & (geometry.contents == 0)
+    if structural is not None:
+        candidates &= ~np.asarray(structural, dtype=bool)
+    reasons = np.zeros(len(ir.brush_name), dtype=np.int8)
+    world = filled & (geometry.brush_ent == 0) & (geometry.contents & CONTENTS_DETAIL == 0)
+    inside = world.copy()
+    fill = void_fill(ir, resolution, geometry)
+    if fill is not None:
+        origin, shape, reached, step, offsets = fill
+        reached = reached.reshape(shape)
+        for brush in np.flatnonzero(candidates & world).tolist():
+            a = np.maximum(np.floor((geometry.lo[brush] - origin) / resolution).astype(np.int64) - 1, 0)
+            b = np.ceil((geometry.hi[brush] - origin) / resolution).astype(np.int64) + 1
+            inside[brush] = not reached[a[0]:b[0], a[1]:b[1], a[2]:b[2]].any()
+    sides = contact_sides(geometry, np.flatnonzero(world))
+    touched = np.array([bin(side).count('1') for side in sides.tolist()], dtype=np.int64)
+    reasons[candidates & inside & (touched <= 1)] = 3
+    reasons[candidates & inside & (np.prod(geometry.hi - geometry.lo, axis=1) < size ** 3)] = 2
+    reasons[candidates & (geometry.brush_ent != 0)] = 1
+    return reasons
+
+def point_entities(ir):
+    """(entity, classname, origin) of the entities with an origin and no brushes"""
+    strings = ir.strings
+    found = []
+    for ent in np.flatnonzero(np.diff(ir.ent_brushes) == 0).tolist():
+        keys = {strings[ir.kv_key[kv]]: strings[ir.kv_value[kv]] for kv in range(ir.ent_kvs[ent], ir.ent_kvs[ent + 1])}
+        try:
+            origin = np.array([float(co) for co in keys.get("origin", "").split()])
+        except ValueError:
+            continue
+        if len(origin) == 3:
+            found.append((ent, keys.get("classname", ""), origin))
+    return found
+
+def void_fill(ir, resolution=16.0, geometry=None, eps=0.01):
+    """The void outside a finished MapIR, as voxels of resolution map units.
+
+    Structural worldspawn brushes are rasterized (a voxel is solid if it overlaps a brush),
+    then the empty voxels are flood filled from around the map bounds, a breadth-first step
+    for the whole front at a time. Gaps narrower than a voxel are not found. Returns origin,
+    shape, the flat reached mask, the flat step array (index into offsets of the move that
+    reached a voxel, -1 at the start) and the flat offsets, or None without such brushes."""
+    geometry = geometry or BrushGeometry(ir)
+    world = (np.diff(ir.brush_faces) > 0) & (geometry.brush_ent == 0) & (geometry.contents == 0)
+    if not world.any():
+        return None
+    brushes = np.flatnonzero(world)
+    # two layers around the brushes: the void the fill starts from, and a visited border
+    origin = np.floor(geometry.lo[brushes].min(axis=0) / resolution) * resolution - 2 * resolution
+    shape = np.ceil((geometry.hi[brushes].max(axis=0) - origin) / resolution).astype(np.int64) + 2
+    solid = np.zeros(shape, dtype=bool)
+    half = resolution / 2
+    for brush in brushes.tolist():
+        a = np.floor((geometry.lo[brush] - origin) / resolution).astype(np.int64)
+        b = np.ceil((geometry.hi[brush] - origin) / resolution).astype(np.int64)
+        axes = [origin[i] + (np.arange(a[i], b[i]) + 0.5) * resolution for i in range(3)]
+        centers = np.stack(np.meshgrid(*axes, indexing='ij'), axis=-1).reshape(-1, 3)
+        normals, dists = geometry.planes(brush)
+        reach = half * np.abs(normals).sum(axis=1)
+        inside = np.all(centers @ normals.T - reach < dists - eps, axis=1)
+        solid[a[0]:b[0], a[1]:b[1], a[2]:b[2]] |= inside.reshape(b - a)
+
+    visited = solid.copy()
+    border = np.ones(shape, dtype=bool)
+    border[1:-1, 1:-1, 1:-1] = False
+    visited |= border
+    shell = np.zeros(shape, dtype=bool)
+    shell[1:-1, 1:-1, 1:-1] = True
+    shell[2:-2, 2:-2, 2:-2] = False
+    visited = visited.ravel()
+    step = np.full(visited.shape, -1, dtype=np.int8)
+    strides = np.array([shape[1] * shape[2], shape[2], 1])
+    offsets = [int(stride * sign) for stride in strides for sign in (1, -1)]
+    front = np.flatnonzero(shell.ravel() & ~solid.ravel())
+    visited[front] = True
+    while len(front):
+        grown = []
+        for k, offset in enumerate(offsets):
+            cells = front + offset
+            cells = cells[~visited[cells]]
+            visited[cells] = True
+            step[cells] = k
+            grown.append(cells)
+        front = np.concatenate(grown)
+    return origin, shape, visited & ~solid.ravel(), step, offsets
+
+def find_leaks(ir, resolution=16.0, geometry=None, eps=0.01):
+    """Point entities of a finished MapIR that the void outside the map can reach (see
+    void_fill). Returns (entity, classname, path) per leaking entity, path being the points
+    in map units from the entity out to the void, shortest first."""
+    entities = point_entities(ir)
+    fill = void_fill(ir, resolution, geometry, eps) if entities else None
+    if fill is None:
+        return []
+    origin, shape, reached, step, offsets = fill
+    strides = np.array([shape[1] * shape[2], shape[2], 1])
+    leaks = []
+    for ent, classname, position in entities:
+        cell = np.floor((position - origin) / resolution).astype(np.int64)
+        if np.any(cell < 1) or np.any(cell >= shape - 1):
+            leaks.append((ent, classname, position[None, :].copy()))
+            continue
+        cell = int(cell @ strides)
+        if not reached[cell]:
+            continue
+        cells = [cell]
+        while step[cell] >= 0:
+            cell -= offsets[step[cell]]
+            cells.append(cell)
+        centers = origin + (np.stack(np.unravel_index(cells, shape), axis=-1) + 0.5) * resolution
+        # corners of the voxel walk only, straight runs in between
+        turns = np.ones(len(centers), dtype=bool)
+        if len(centers) > 2:
+            turns[1:-1] = np.any(centers[2:] - centers[1:-1] != centers[1:-1] - centers[:-2], axis=1)
+        leaks.append((ent, classname, np.vstack((position, centers[turns]))))
+    leaks.sort(key=lambda leak: len(leak[2]))
+    return leaks
+
+def polygon_area(points):
+    return 0.5 * sum(a[0] * b[1] - b[0] * a[1] for a, b in zip(points, points[1:] + points[:1]))
+
+def clip_polygon(points, a, b, keep_left):
+    """Sutherland-Hodgman clip of a convex 2D polygon by the line a-b"""
+    def side(p):
+        return (b[0] - a[0]) * (p[1] - a[1]) - (b[1] - a[1]) * (p[0] - a[0])
+    result = []
+    for p, q in zip(points, points[1:] + points[:1]):
+        sp, sq = side(p), side(q)
+        if (sp >= 0) == keep_left:
+            result.append(p)
+        if (sp >= 0) != (sq >= 0):
+            t = sp / (sp - sq)
+            result.append((p[0] + t * (q[0] - p[0]), p[1] + t * (q[1] - p[1])))
+    return result
+
+def polygon_minus(polygon, cutter, eps):
+    """Convex pieces of convex polygon outside convex counter-clockwise cutter"""
+    pieces = []
+    rest = polygon
+    for a, b in zip(cutter, cutter[1:] + cutter[:1]):
+        outside = clip_polygon(rest, a, b, False)
+        if len(outside) > 2 and abs(polygon_area(outside)) > eps:
+            pieces.append(outside)
+        rest = clip_polygon(rest, a, b, True)
+        if len(rest) < 3 or abs(polygon_area(rest)) <= eps:
+            break
+    return pieces
+
+def covered_faces(ir, geometry=None, eps=0.01, nonsolid=NONSOLID_SHADERS):
+    """Worldspawn faces fully covered by coplanar, opposite facing faces of structural
+    worldspawn brushes, as face indices. Only solid faces (see solid_faces) cover. Opposite
+    faces are found through a plane hash, coverage is the face minus every cover polygon,
+    in the plane's 2D projection."""
+    geometry = geometry or BrushGeometry(ir)
+    world = geometry.brush_ent[geometry.face_brush] == 0
+    structural = world & (ir.face_contents == 0) & solid_faces(ir, nonsolid)
+    keys = [tuple(key) for key in np.round(np.column_stack((geometry.normals * 1e3, geometry.dists * 1e1))).astype(np.int64).tolist()]
+    planes = {}
+    for face in np.flatnonzero(structural & (geometry.areas > eps)):
+        planes.setdefault(keys[face], []).append(face)
+    covered = []
+    for face in np.flatnonzero(world & (geometry.areas > eps)):
+        opposite = tuple(-value for value in keys[face])
+        covers = [other for other in planes.get(opposite, ()) if geometry.face_brush[other] != geometry.face_brush[face]]
+        if not covers:
+            continue
+        axes = [axis for axis in range(3) if axis != int(np.argmax(np.abs(geometry.normals[face])))]
+        def flat(index):
+            points = ir.corners[ir.face_corners[index]:ir.face_corners[index + 1]][:, axes]
+            points = [tuple(point) for point in points.tolist()]
+            return points if polygon_area(points) > 0 else points[::-1]
+        pieces = [flat(face)]
+        lo, hi = np.min(pieces[0], axis=0), np.max(pieces[0], axis=0)
+        for other in covers:
+            cover = flat(other)
+            if np.any(np.min(cover, axis=0) > hi + eps) or np.any(np.max(cover, axis=0) < lo - eps):
+                continue
+            pieces = [piece for polygon in pieces for piece in polygon_minus(polygon, cover, eps)]
+            if not pieces:
+                covered.append(face)
+                break
+    return np.array(covered, dtype=np.int64)
+
+def convex_polygon_on_plane(points, normal, eps=0.01):
+    """Convex hull of points lying on a plane, counter-clockwise around normal, collinear points dropped"""
+    x, y, z = normal
+    u = np.array((0.0, z, -y) if abs(x) < 0.9 else (-z, 0.0, x))
+    u /= np.linalg.norm(u)
+    v = (y * u[2] - z * u[1], z * u[0] - x * u[2], x * u[1] - y * u[0])
+    flat = sorted(zip(np.round(points @ u, 4).tolist(), np.round(points @ np.array(v), 4).tolist(), range(len(points))))
+    def cross(o, a, b):
+        return (a[0] - o[0]) * (b[1] - o[1]) - (a[1] - o[1]) * (b[0] - o[0])
+    hull = []
+    for sweep in (flat, flat[::-1]):
+        chain = []
+        for point in sweep:
+            while len(chain) >= 2 and cross(chain[-2], chain[-1], point) <= eps * eps:
+                chain.pop()
+            chain.append(point)
+        hull.extend(chain[:-1])
+    return points[[point[2] for point in hull]]
+
+class BrushMerger:
+    """Greedy merging of brushes that touch through an identical face and whose union is
+    convex, with matching texture and alignment wherever two faces become one.
+
+    Brushes are records of faces (plane key, normal, dist, polygon, texture, align, contents,
+    index). Contact faces are found through a dict on (opposite plane, polygon), so every
+    merge attempt is a lookup and a merge costs the faces of the two brushes."""
+    def __init__(self, ir, geometry=None, eps=0.01):
+        self.ir = ir
+        self.eps = eps
+        geometry = geometry or BrushGeometry(ir)
+        keys = [tuple(key) for key in np.round(np.column_stack((geometry.normals * 1e3, geometry.dists * 1e1))).astype(np.int64).tolist()]
+        self.brushes = {}
+        self.members = {}
+        self.contacts = {}
+        candidates = np.flatnonzero(geometry.contents == 0)
+        for brush in candidates.tolist():
+            faces = []
+            for face in range(ir.brush_faces[brush], ir.brush_faces[brush + 1]):
+                polygon = ir.corners[ir.face_corners[face]:ir.face_corners[face + 1]]
+                faces.append((keys[face], geometry.normals[face], geometry.dists[face], polygon,
+                              ir.face_tex[face], ir.face_align[face], ir.face_contents[face], ir.face_index[face]))
+            self.add(brush, faces, geometry.brush_ent[brush])
+            self.members[brush] = [brush]
+
+    def polygon_key(self, polygon):
+        return tuple(sorted(tuple(point) for point in np.round(polygon, 2).tolist()))
+
+    def add(self, brush, faces, ent):
+        self.brushes[brush] = (faces, ent)
+        for face in faces:
+            self.contacts[(face[0], self.polygon_key(face[3]))] = brush
+
+    def remove(self, brush):
+        faces, ent = self.brushes.pop(brush)
+        for face in faces:
+            key = (face[0], self.polygon_key(face[3]))
+            if self.contacts.get(key) == brush:
+                del self.contacts[key]
+
+    def merged_faces(self, a, b, contact_a, contact_b):
+        """Faces of the union of brushes a and b, None if it isn't convex or textures clash"""
+        faces_a, faces_b = self.brushes[a][0], self.brushes[b][0]
+        points = np.unique(np.round(np.concatenate([face[3] for face in faces_a + faces_b]), 4), axis=0)
+        planes = {}
+        for face in faces_a + faces_b:
+            if face is contact_a or face is contact_b:
+                continue
+            other = planes.get(face[0])
+            if other is None:
+                planes[face[0]] = face
+            elif other[4] != face[4] or other[6] != face[6] or not np.allclose(other[5], face[5], atol=1e-3):
+                return None
+        normals = np.array([face[1] for face in planes.values()])
+        dists = np.array([face[2] for face in planes.values()])
+        distance = points @ normals.T - dists
+        if np.any(distance > self.eps):
+            return None
+        faces = []
+        on_plane = np.abs(distance) <= self.eps
+        for i, face in enumerate(planes.values()):
+            polygon = face[3]
+            # only faces the other brush reaches grow, the rest keep their corners
+            if np.count_nonzero(on_plane[:, i]) > len(polygon):
+                polygon = convex_polygon_on_plane(points[on_plane[:, i]], face[1], self.eps)
+                if len(polygon) < 3:
+                    return None
+            faces.append((face[0], face[1], face[2], polygon) + face[4:])
+        return faces
+
+    def run(self):
+        """Merge until nothing more merges, return {kept brush: [merged brushes]}"""
+        queue = list(self.brushes)
+        while queue:
+            a = queue.pop()
+            if a not in self.brushes:
+                continue
+            faces, ent = self.brushes[a]
+            for face in faces:
+                opposite = (tuple(-value for value in face[0]), self.polygon_key(face[3]))
+                b = self.contacts.get(opposite)
+                if b is None or b == a or self.brushes[b][1] != ent:
+                    continue
+                contact_b = next(other for other in self.brushes[b][0] if (other[0], self.polygon_key(other[3])) == opposite)
+                merged = self.merged_faces(a, b, face, contact_b)
+                if merged is None:
+                    continue
+                self.remove(a)
+                self.remove(b)
+                self.add(a, merged, ent)
+                self.members[a] += self.members.pop(b)
+                queue.append(a)
+                break
+        return {brush: members for brush, members in self.members.items() if len(members) > 1}
 
-class ExportQuakeMap(bpy.types.Operator, ExportHelper):
-    bl_idname = 'export.map'
-    bl_label = bl_info['name']
-    bl_description = bl_info['description']
-    bl_options = {'UNDO', 'PRESET'}
-    filename_ext = ".map"
-    filter_glob: StringProperty(default="*.map", options={'HIDDEN'})
+    def faces(self, brush):
+        """The merged brush as MapIR faces: (corners, texture id, align, contents, index)"""
+        return [(face[3], face[4], face[5], face[6], face[7]) for face in self.brushes[brush][0]]
 
-    option_sel: BoolProperty(name="Selection Only",
-        default=False, description="Only export selected objects, otherwise the full scene")
-    option_depth: FloatProperty(name="Depth",
-        default=2.0, description="Offset for extrusion, pyramid apex and terrain bottom. When using a larger grid, make sure to increase this as well")
-    option_fp: IntProperty(name="Precision", min=0, soft_max=17,
-        default=5, description="Number of decimal places")
-    option_skip: StringProperty(name="Material",
-        default="common/caulk", description="Generic Material")
+class MapExportError(Exception):
+    pass
+
+class MapWriter:
+    """Map writing shared by the export operator and export_map()"""
+    progress = None
+    timing = None
 
     angle_keywords = {
     'left': '0 270 0',
@@ -77,29 +804,6 @@ class ExportQuakeMap(bpy.types.Operator, ExportHelper):
     '-x': '0 180 0',
     }
 
-    def draw(self, context):
-        o = "option_"
-        #self.layout.separator()
-        spl = self.layout.row().split(factor=0.5)
-        col = spl.column()
-        for p in [o+"sel"]: col.prop(self, p)
-        #self.layout.separator()
-        spl = self.layout.row().split(factor=0.5)
-        col = spl.column()
-        col = spl.column()
-        #self.layout.separator()
-        self.layout.label(text="Coordinates:", icon='MESH_DATA')
-        spl = self.layout.row().split(factor=0.5)
-        col = spl.column()
-        for p in [o+"depth"]: col.prop(self, p)
-        col = spl.column()
-        #self.layout.separator()
-        spl = self.layout.row().split(factor=0.5)
-        col = spl.column()
-        #self.layout.separator()
-        col = self.layout.column()
-        col.prop(self, o+"skip", text="Material")
-
     def process_angle_value(self, angle_value):
         """Process angle value, converting keywords to actual angle strings"""
         if isinstance(angle_value, str):
@@ -111,8 +815,7 @@ class ExportQuakeMap(bpy.types.Operator, ExportHelper):
     def entname(self, ent):
         tname = ent.name.rstrip('0123456789')
         tname = tname[:-1] if tname[-1] in ('.',' ') else ent.name
-        name = '}\n// entity '+ ent.name + '\n{\n"classname" "' + tname + '"\n'        
-        return name
+        return tname
 
     def gridsnap(self, vector):
         grid = 0
@@ -149,20 +852,11 @@ class ExportQuakeMap(bpy.types.Operator, ExportHelper):
 
         return f"{y_deg} {z_deg} {x_deg}"
 
-    def brushplane(self, face):
-        planestring = ""
-        for vert in reversed(face.verts[0:3]):
-            planestring += f'( {self.printvec(vert.co, 0)} ) '
-        return planestring
-
     def faceflags(self, obj):
-        col = obj.users_collection[0]
-        detail_flags = [".detail", "-detail", "_detail", "/detail"]
-        if any(prefix in obj.name.lower() for prefix in detail_flags) or any(prefix in col.name.lower() for prefix in detail_flags) or col.name.lower() == "detail":
-        #if ('_detail' in obj.name) or ('_detail' in col.name):
-            return f" {1<<27} 0 0\n"
+        if has_tag(obj, DETAIL_FLAGS, "detail"):
+            return CONTENTS_DETAIL
         else:
-            return "\n"
+            return 0
 
     def texdata(self, face, mesh, obj, orig_obj):
         col = orig_obj.users_collection[0]
@@ -232,10 +926,9 @@ class ExportQuakeMap(bpy.types.Operator, ExportHelper):
         scale_y = scale_y * (64.0 / height)
 
         finvals = [offset_x, offset_y, rotation, scale_x, scale_y]
-        texstring += f" {self.printvec(finvals, 0)} // face index: {face.index}"
-        return texstring
+        return texstring, finvals
 
-    def process_mesh(self, obj, fw, template):
+    def process_mesh(self, obj, ir):
         flags = self.faceflags(obj)
         #origin = self.gridsnap(obj.matrix_world.translation)
         obj.data.materials.append(None) # empty slot for new faces
@@ -246,32 +939,32 @@ class ExportQuakeMap(bpy.types.Operator, ExportHelper):
         bm.faces.ensure_lookup_table()
         bmesh.ops.transform(bm, matrix=obj.matrix_world,
                                             verts=bm.verts)
+        if obj.matrix_world.determinant() < 0: # mirrored instance, faces turned inside out
+            bmesh.ops.reverse_faces(bm, faces=bm.faces)
         for vert in bm.verts:
             vert.co = self.gridsnap(vert.co * 10)
 
-        hull = bmesh.ops.convex_hull(bm, input=bm.verts)
-        interior = [face for face in bm.faces if face not in hull['geom']]
-        bmesh.ops.delete(bm, geom=interior, context='FACES')
-        bmesh.ops.recalc_face_normals(bm, faces=bm.faces)
-        bmesh.ops.join_triangles(bm, faces=bm.faces,
-            angle_face_threshold=0.01, angle_shape_threshold=0.7)
-        bmesh.ops.connect_verts_nonplanar(bm, faces=bm.faces,
-                                            angle_limit=0.0)
-        fw("// " + str(obj.name) + "\n")
-        fw(template[0])
+        # brushes made with "Make Brush" usually are clean already
+        if not is_clean_brush(*bmesh_arrays(bm)):
+            hull = bmesh.ops.convex_hull(bm, input=bm.verts)
+            interior = [face for face in bm.faces if face not in hull['geom']]
+            bmesh.ops.delete(bm, geom=interior, context='FACES')
+            bmesh.ops.recalc_face_normals(bm, faces=bm.faces)
+            bmesh.ops.join_triangles(bm, faces=bm.faces,
+                angle_face_threshold=0.01, angle_shape_threshold=0.7)
+            bmesh.ops.connect_verts_nonplanar(bm, faces=bm.faces,
+                                                angle_limit=0.0)
+        ir.add_brush(str(obj.name))
         for face in bm.faces:
-            fw(self.brushplane(face))
-            fw(self.texdata(face, bm, obj, orig_obj) + flags)
-        fw(template[1])
+            texstring, finvals = self.texdata(face, bm, obj, orig_obj)
+            ir.add_face([vert.co[:] for vert in face.verts], texstring, finvals, flags, face.index)
 
         bm.free()
         orig_obj.data.materials.pop() # remove the empty slot
 
-    def process_empty(self, obj, fw):
-        name = obj.name.rstrip('0123456789')
-        name = name[:-1] if name[-1] in ('.',' ') else obj.name
-        fw("// entity " + str(obj.name) + "\n")
-        fw('{\n"classname" "' + name + '"\n')
+    def process_empty(self, obj, ir):
+        ir.add_entity(str(obj.name))
+        ir.add_kv("classname", self.entname(obj))
         origin = obj.matrix_world.to_translation() * 10
         zoffset = 0
 
@@ -290,61 +983,183 @@ class ExportQuakeMap(bpy.types.Operator, ExportHelper):
             else:
                 zoffset = 0.0  # Default value for empty string
             
-        fw(f'"origin" "{self.printvec(origin, zoffset)}"\n')
+        ir.add_kv("origin", self.printvec(origin, zoffset))
                     
         if 'modelscale' in obj and (obj['modelscale'] == "blender" or obj['modelscale'] == "bl"):
             # Check if all scale axes are the same
             if obj.scale.x == obj.scale.y == obj.scale.z:
                 # All axes are equal, use modelscale with a single value
                 scale_value = obj.scale.x * 10
-                fw(f'"modelscale" "{scale_value:.4f}"\n')
+                ir.add_kv("modelscale", f"{scale_value:.4f}")
             else:
                 # Axes are different, use modelscale_vec
                 scale_str = f"{obj.scale.x * 10:.4f} {obj.scale.y * 10:.4f} {obj.scale.z * 10:.4f}"       
-                fw(f'"modelscale_vec" "{scale_str}"\n')
+                ir.add_kv("modelscale_vec", scale_str)
             
             # Remove the key so it won't be processed again
             del obj['modelscale']
         elif obj.scale.x != 1 and obj.scale.y != 1 and obj.scale.z != 1:
             scale_str = f"{obj.scale.x:.4f} {obj.scale.y:.4f} {obj.scale.z:.4f}"
-            fw(f'"modelscale_vec" "{scale_str}"\n')
+            ir.add_kv("modelscale_vec", scale_str)
                 
         # Handle angles with keyword support
         if 'angles' not in obj:
             angles_str = self.get_object_angles_string(obj)
-            fw(f'"angles" "{angles_str}"\n')
+            ir.add_kv("angles", angles_str)
         else:
             # Process angles value through the keyword conversion
             angles_value = obj['angles']
             processed_value = self.process_angle_value(angles_value)
-            fw(f'"angles" "{processed_value}"\n')
+            ir.add_kv("angles", processed_value)
         
         for prop in obj.keys():
             if prop != 'angles' and prop != 'origin':
 
                 if isinstance(obj[prop], (int, float, str)):
                     prop_value = obj[prop] # no arrays
-                    fw(f'"{prop}" "{prop_value}"\n')
-        fw('}\n')
+                    ir.add_kv(prop, prop_value)
+
+    def model_dir(self):
+        if self.option_gamedir:
+            return bpy.path.abspath(self.option_gamedir)
+        if not self.filepath:
+            raise MapExportError("Models need a game folder or a map file path to be written to!")
+        return os.path.dirname(os.path.dirname(os.path.abspath(self.filepath)))
+
+    def model_texture(self, mat):
+        if not mat:
+            return self.option_skip
+        texstring = mat.name.replace(" ", "_")
+        if '.' in texstring and texstring.split('.')[-1].isdigit():
+            texstring = texstring.rsplit('.', 1)[0]
+        return texstring
 
-    def execute(self, context):
-        self.report({'INFO'}, f"New Map Export Process Started:")
-        timer = time.time()
-        map_text = []
-        fw = map_text.append
+    def model_source(self, obj):
+        """Key and name of the geometry a model instance points to, instances sharing it share the file"""
+        if obj.type == 'EMPTY':
+            col = obj.instance_collection
+            return ('COLLECTION', col.name), col.name
+        if any(mod.show_viewport for mod in obj.modifiers):
+            # modifier settings can differ between users of the mesh, write_model still
+            # shares the file when the generated text (and so its hash) is the same
+            return ('OBJECT', obj.name), obj.data.name
+        return ('MESH', obj.data.name), obj.data.name
+
+    def model_parts(self, obj):
+        """Mesh objects making up the model, with their matrix into model space"""
+        if obj.type == 'EMPTY':
+            col = obj.instance_collection
+            offset = Matrix.Translation(-col.instance_offset)
+            for part in col.all_objects:
+                if part.type == 'MESH':
+                    yield part, offset @ part.matrix_world
+        else:
+            yield obj, Matrix.Identity(4)
+
+    def model_text(self, obj, depsgraph):
+        """Wavefront OBJ text of the model in map units"""
+        lines = []
+        vbase = tbase = 1
+        for part, matrix in self.model_parts(obj):
+            matrix = Matrix.Scale(10, 4) @ matrix
+            flip = matrix.determinant() < 0
+            ev = part.evaluated_get(depsgraph)
+            mesh = ev.to_mesh()
+            uv = mesh.uv_layers.active
+            for vert in mesh.vertices:
+                lines.append(f"v {self.printvec(matrix @ vert.co, 0)}\n")
+            if uv:
+                for loop_uv in uv.data:
+                    lines.append(f"vt {self.printvec(loop_uv.uv, 0)}\n")
+            by_material = {}
+            for poly in mesh.polygons:
+                by_material.setdefault(poly.material_index, []).append(poly)
+            for index, polys in sorted(by_material.items()):
+                mat = part.material_slots[index].material if index < len(part.material_slots) else None
+                lines.append(f"usemtl {self.model_texture(mat)}\n")
+                for poly in polys:
+                    loops = reversed(poly.loop_indices) if flip else poly.loop_indices
+                    if uv:
+                        corners = [f"{vbase + mesh.loops[i].vertex_index}/{tbase + i}" for i in loops]
+                    else:
+                        corners = [str(vbase + mesh.loops[i].vertex_index) for i in loops]
+                    lines.append("f " + " ".join(corners) + "\n")
+            vbase += len(mesh.vertices)
+            if uv:
+                tbase += len(uv.data)
+            ev.to_mesh_clear()
+        return ''.join(lines)
+
+    def write_model(self, obj, depsgraph, written):
+        """Write the model file once per source, named by content hash so unchanged models are left alone"""
+        key, name = self.model_source(obj)
+        if key not in written:
+            text = self.model_text(obj, depsgraph)
+            digest = hashlib.sha1(text.encode()).hexdigest()[:12]
+            safe_name = "".join(c if c.isalnum() else '_' for c in name.lower())
+            relpath = f"models/trenchcoat/{safe_name}_{digest}.obj"
+            path = os.path.join(self.model_dir(), *relpath.split('/'))
+            if not os.path.exists(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path, 'w') as file:
+                    file.write(text)
+                self.models_written += 1
+            written[key] = relpath
+        return written[key]
+
+    def process_model(self, obj, ir, relpath):
+        ir.add_entity(str(obj.name))
+        ir.add_kv("classname", "misc_model")
+        ir.add_kv("model", relpath)
+        origin = obj.matrix_world.to_translation() * 10
+        ir.add_kv("origin", self.printvec(origin, 0))
+        if 'angles' in obj:
+            ir.add_kv("angles", self.process_angle_value(obj['angles']))
+        else:
+            ir.add_kv("angles", self.get_object_angles_string(obj))
+        # geometry is already in map units, so scale is relative to 1
+        scale = [round(co, 4) for co in obj.matrix_world.to_scale()]
+        if scale[0] == scale[1] == scale[2]:
+            if scale[0] != 1:
+                ir.add_kv("modelscale", f"{scale[0]:.4f}")
+        else:
+            ir.add_kv("modelscale_vec", f"{scale[0]:.4f} {scale[1]:.4f} {scale[2]:.4f}")
+        for prop in obj.keys():
+            if prop not in ('model', 'origin', 'angles', 'modelscale', 'modelscale_vec'):
+                if isinstance(obj[prop], (int, float, str)):
+                    ir.add_kv(prop, obj[prop])
+
+    def lap(self, stage):
+        """Hand the time spent since the last lap to the timing hook"""
+        now = time.perf_counter()
+        if self.timing:
+            self.timing(stage, now - self.lap_start)
+        self.lap_start = now
+
+    def tick(self, total):
+        self.done += 1
+        if self.progress:
+            self.progress(self.done, total)
+
+    def build_ir(self, context):
+        """Collect the scene into a MapIR"""
+        self.lap_start = time.perf_counter()
+        self.done = 0
+        ir = MapIR()
         wspwn_objs, bmodel_objs = [],[]
         empty_objs = []
+        model_objs = []
         func_cols = []
 
-        template = ['{\n', '}\n']
-        fw('// entity 0\n{\n"classname" "worldspawn"\n')
+        ir.add_entity("0")
+        ir.add_kv("classname", "worldspawn")
         scene = bpy.context.scene
         custom_props = []
         for prop in scene.keys():
             if not scene.bl_rna.properties.get(prop):
                 custom_props.append(prop)
         for prop in custom_props:
-            fw(f'"{prop}" "{scene[prop]}"\n')
+            ir.add_kv(prop, scene[prop])
 
         # sort objects
         objects = context.scene.objects       
@@ -358,6 +1173,12 @@ class ExportQuakeMap(bpy.types.Operator, ExportHelper):
             if type == 'point_ent':
                 empty_objs.append(obj)
                 continue
+            elif type == 'model':
+                if self.option_models:
+                    model_objs.append(obj)
+                else:
+                    empty_objs.append(obj)
+                continue
             elif type == 'None':
                 continue
             elif type == 'excluded':
@@ -373,28 +1194,34 @@ class ExportQuakeMap(bpy.types.Operator, ExportHelper):
                 bmodel_objs.append(obj)
 
         if not wspwn_objs:
-            self.report({'ERROR'}, "No brushes found! Mesh object name must start with 'brush' and there must be at least one!")
-            return  {'CANCELLED'}        
+            raise MapExportError("No brushes found! Mesh object name must start with 'brush' and there must be at least one!")
+        total = len(wspwn_objs) + len(bmodel_objs) + len(func_cols) + len(empty_objs) + len(model_objs)
+        self.lap('sort')
         
         # process objects
         for obj in wspwn_objs:
-            self.process_mesh(obj, fw, template)
+            self.process_mesh(obj, ir)
+            self.tick(total)
+        self.lap('worldspawn')
             
         for obj in bmodel_objs:
-                fw(self.entname(obj))
+                ir.add_entity(obj.name)
+                ir.add_kv("classname", self.entname(obj))
                 for prop in obj.keys():
                     if isinstance(obj[prop], (int, float, str)):
                         # Special handling for angles property
                         if prop == 'angles':
                             processed_value = self.process_angle_value(obj[prop])
-                            fw(f'"{prop}" "{processed_value}"\n')
+                            ir.add_kv(prop, processed_value)
                         else:
-                            fw(f'"{prop}" "{obj[prop]}"\n')
+                            ir.add_kv(prop, obj[prop])
 
-                self.process_mesh(obj, fw, template)
+                self.process_mesh(obj, ir)
+                self.tick(total)
 
         for col in func_cols:
-            fw(self.entname(col))
+            ir.add_entity(col.name)
+            ir.add_kv("classname", self.entname(col))
             # Write collection properties first (if any)
             if hasattr(col, 'keys'):
                 col_keys = col.keys()
@@ -403,39 +1230,675 @@ class ExportQuakeMap(bpy.types.Operator, ExportHelper):
                         # Special handling for angles property
                         if prop == 'angles':
                             processed_value = self.process_angle_value(col[prop])
-                            fw(f'"{prop}" "{processed_value}"\n')
+                            ir.add_kv(prop, processed_value)
                         else:
-                            fw(f'"{prop}" "{col[prop]}"\n')
+                            ir.add_kv(prop, col[prop])
        
             # Then process all mesh objects in collection
             for obj in col.objects:
                 _, type = get_class(obj, True, context)      
                 if type == 'brush':           
                 #if obj.type == 'MESH' and (obj.data and len(obj.data.vertices) > 0) and not any(prefix in obj.name.lower() for prefix in exclude_tags):
-                    self.process_mesh(obj, fw, template)
-        
-        fw('}\n')
+                    self.process_mesh(obj, ir)
+            self.tick(total)
+        self.lap('brush entities')
+
         for obj in empty_objs:
-                self.process_empty(obj, fw)
+                self.process_empty(obj, ir)
+                self.tick(total)
+        self.lap('point entities')
+
+        self.models_written = 0
+        self.model_sources = {}
+        depsgraph = context.evaluated_depsgraph_get()
+        for obj in model_objs:
+            self.process_model(obj, ir, self.write_model(obj, depsgraph, self.model_sources))
+            self.tick(total)
+        self.lap('models')
+        if model_objs:
+            self.report({'INFO'}, f"{len(model_objs)} models from {len(self.model_sources)} sources, {self.models_written} files written")
+        return self.optimize(ir.finish())
+
+    def report_brushes(self, text, names):
+        shown = ", ".join(names[:20]) + (f" and {len(names) - 20} more" if len(names) > 20 else "")
+        self.report({'INFO'}, f"{text} {len(names)} brushes: {shown}")
+
+    def optimize(self, ir):
+        """The optional passes over the finished IR, in order"""
+        if self.option_cull:
+            drop = cull_brushes(ir, nonsolid=self.option_nonsolid)
+            if drop.any():
+                self.report_brushes("Culled", [ir.strings[i] for i in ir.brush_name[drop]])
+                ir.drop_brushes(drop)
+            self.lap('cull')
+        if self.option_detail:
+            structural = [(obj := bpy.data.objects.get(ir.strings[name])) is not None and has_tag(obj, STRUCTURAL_FLAGS, "structural")
+                          for name in ir.brush_name.tolist()]
+            reasons = classify_detail(ir, self.option_detail_size, structural, resolution=self.option_leak_size)
+            for reason, text in DETAIL_REASONS.items():
+                brushes = np.flatnonzero(reasons == reason)
+                if len(brushes):
+                    self.report_brushes(f"Detail ({text}):", [ir.strings[i] for i in ir.brush_name[brushes]])
+            ir.face_contents[reasons[ir.face_brush] > 0] |= CONTENTS_DETAIL
+            self.lap('detail')
+        if self.option_merge:
+            merger = BrushMerger(ir)
+            groups = merger.run()
+            drop = np.zeros(len(ir.brush_name), dtype=bool)
+            for members in groups.values():
+                drop[members[1:]] = True
+            before = len(ir.brush_name)
+            ir.replace_brushes({brush: merger.faces(brush) for brush in groups}).drop_brushes(drop)
+            self.report({'INFO'}, f"Merged {before} brushes into {len(ir.brush_name)}, {len(groups)} merged brushes")
+            self.lap('merge')
+        if self.option_caulk:
+            skip = ir.intern(self.option_skip)
+            faces = covered_faces(ir, nonsolid=self.option_nonsolid)
+            faces = faces[ir.face_tex[faces] != skip]
+            ir.face_tex[faces] = skip
+            self.report({'INFO'}, f"Caulked {len(faces)} hidden faces")
+            self.lap('caulk')
+        if self.option_leaks:
+            leaks = find_leaks(ir, self.option_leak_size)
+            if leaks:
+                names = [ir.strings[ir.ent_name[ent]] for ent, classname, points in leaks]
+                self.report({'WARNING'}, f"Leak: {len(names)} entities reach the void: " + ", ".join(names[:20]) + (" ..." if len(names) > 20 else ""))
+            self.lap('leaks')
+        return ir
+
+    def iter_map(self, context):
+        """Yield the map text in chunks, one brush or entity at a time"""
+        yield from self.iter_ir(self.build_ir(context))
+
+    def iter_ir(self, ir):
+        yield from ir.iter_text(self.option_fp)
+        self.lap('write')
+
+class ExportQuakeMap(bpy.types.Operator, ExportHelper, MapWriter):
+    bl_idname = 'export.map'
+    bl_label = bl_info['name']
+    bl_description = bl_info['description']
+    bl_options = {'UNDO', 'PRESET'}
+    filename_ext = ".map"
+    filter_glob: StringProperty(default="*.map", options={'HIDDEN'})
+
+    option_sel: BoolProperty(name="Selection Only",
+        default=False, description="Only export selected objects, otherwise the full scene")
+    option_depth: FloatProperty(name="Depth",
+        default=2.0, description="Offset for extrusion, pyramid apex and terrain bottom. When using a larger grid, make sure to increase this as well")
+    option_fp: IntProperty(name="Precision", min=0, soft_max=17,
+        default=5, description="Number of decimal places")
+    option_skip: StringProperty(name="Material",
+        default="common/caulk", description="Generic Material")
+    option_models: BoolProperty(name="Export Models",
+        default=True, description="Write misc_model meshes and collection instances as model files, each unique source only once")
+    option_gamedir: StringProperty(name="Game Folder", subtype='DIR_PATH',
+        default="", description="Folder the model files are written to (e.g. baseq3). Leave empty to use the parent of the map's folder")
+    option_cull: BoolProperty(name="Cull Brushes",
+        default=False, description="Leave out brushes that duplicate another or are fully inside a solid one of the same entity and contents")
+    option_nonsolid: StringProperty(name="Non-Solid",
+        default=NONSOLID_SHADERS, description="Comma separated parts of shader names that are see-through or not solid (caulk always is solid). Such brushes don't swallow others when culling, and their faces don't hide others when caulking")
+    option_detail: BoolProperty(name="Auto Detail",
+        default=False, description="Make brush entity, small and free-standing structural brushes detail, never those facing the void outside the map. Name a brush or collection .structural to keep it structural")
+    option_detail_size: FloatProperty(name="Size",
+        default=32.0, min=0.0, description="Brushes with bounds smaller than a cube this size (map units) become detail")
+    option_merge: BoolProperty(name="Merge Brushes",
+        default=False, description="Write touching structural brushes as one when their union is convex and the merged faces share texture and alignment. The scene is left as it is")
+    option_caulk: BoolProperty(name="Caulk Hidden Faces",
+        default=False, description="Give worldspawn faces pressed flat against solid structural brushes the generic material")
+    option_leaks: BoolProperty(name="Check Leaks",
+        default=False, description="Flood fill the map from outside before writing it and warn about point entities the void reaches")
+    option_leak_size: FloatProperty(name="Resolution",
+        default=16.0, min=1.0, description="Leak check voxel size in map units, gaps narrower than this are not found. Auto Detail uses it to find the brushes sealing the map")
+    option_compile: BoolProperty(name="Compile",
+        default=False, description="Run the pipeline's compile stages in the background once the map is written. A new export cancels them")
+    option_pipeline: StringProperty(name="Pipeline",
+        default="trenchcoat_compile", description="Text block with the compile stages, created with q3map2 and bspc stages if missing")
+    option_cache: BoolProperty(name="Build Cache",
+        default=False, description="Reuse the compiled files of an identical earlier export, and only update the entities when nothing else changed")
+    option_cache_size: IntProperty(name="Size (MB)",
+        default=2048, min=1, description="Least recently used builds are dropped beyond this")
+    option_cache_dir: StringProperty(name="Cache Folder", subtype='DIR_PATH',
+        default="", description="Where compiled files are kept. Leave empty for a trenchcoat_cache folder next to the map")
+    option_ir: BoolProperty(name="Save IR",
+        default=False, description="Also save the brush intermediate representation next to the map (.tcir.npz) for reloading and diffing without Blender")
+
+    def draw(self, context):
+        o = "option_"
+        #self.layout.separator()
+        spl = self.layout.row().split(factor=0.5)
+        col = spl.column()
+        for p in [o+"sel"]: col.prop(self, p)
+        #self.layout.separator()
+        spl = self.layout.row().split(factor=0.5)
+        col = spl.column()
+        col = spl.column()
+        #self.layout.separator()
+        self.layout.label(text="Coordinates:", icon='MESH_DATA')
+        spl = self.layout.row().split(factor=0.5)
+        col = spl.column()
+        for p in [o+"depth"]: col.prop(self, p)
+        col = spl.column()
+        #self.layout.separator()
+        spl = self.layout.row().split(factor=0.5)
+        col = spl.column()
+        #self.layout.separator()
+        col = self.layout.column()
+        col.prop(self, o+"skip", text="Material")
+        self.layout.label(text="Models:", icon='OUTLINER_OB_GROUP_INSTANCE')
+        col = self.layout.column()
+        col.prop(self, o+"models")
+        col.prop(self, o+"gamedir", text="")
+        self.layout.label(text="Compile:", icon='CONSOLE')
+        row = self.layout.row()
+        row.prop(self, o+"compile")
+        row.prop(self, o+"pipeline", text="")
+        row = self.layout.row()
+        row.prop(self, o+"cache")
+        row.prop(self, o+"cache_size")
+        self.layout.prop(self, o+"cache_dir", text="")
+        self.layout.label(text="Optimize:", icon='MODIFIER')
+        col = self.layout.column()
+        col.prop(self, o+"cull")
+        col.prop(self, o+"nonsolid")
+        row = col.row()
+        row.prop(self, o+"detail")
+        row.prop(self, o+"detail_size")
+        col.prop(self, o+"merge")
+        col.prop(self, o+"caulk")
+        row = col.row()
+        row.prop(self, o+"leaks")
+        row.prop(self, o+"leak_size")
+        col = self.layout.column()
+        col.prop(self, o+"ir")
+
+    def execute(self, context):
+        self.report({'INFO'}, f"New Map Export Process Started:")
+        timer = time.time()
+        # the running compile is for the map about to be replaced
+        compile_pipeline.cancel()
+        # collect everything first, a failed export leaves the old file alone
+        sink = BufferSink()
+        try:
+            ir = self.build_ir(context)
+            for chunk in ir.iter_text(self.option_fp):
+                sink.write(chunk)
+        except MapExportError as error:
+            self.report({'ERROR'}, str(error))
+            return {'CANCELLED'}
 
         # handle output
-        scene_str = ''.join(map_text)
         with open(self.filepath, 'w') as file:
-            file.write(scene_str)
+            file.write(sink.getvalue())
+        if self.option_ir:
+            ir.save(os.path.splitext(self.filepath)[0] + ".tcir.npz")
 
         timer = time.time() - timer
         self.report({'INFO'},f"Finished exporting map, took {timer:g} sec")
+        if self.option_compile:
+            self.compile(ir)
+        return {'FINISHED'}
+
+    def compile(self, ir):
+        try:
+            stages = parse_pipeline(pipeline_text(self.option_pipeline).as_string())
+        except ValueError as error:
+            self.report({'WARNING'}, f"Not compiling, pipeline '{self.option_pipeline}' {error}")
+            return
+        ents = [(name, [], command) for name, after, command in stages if name == ENTS_STAGE]
+        stages = [stage for stage in stages if stage[0] != ENTS_STAGE]
+        if not stages:
+            self.report({'WARNING'}, f"Not compiling, pipeline '{self.option_pipeline}' has no stages")
+            return
+        values = pipeline_values(self.filepath, bpy.path.abspath(self.option_gamedir) if self.option_gamedir else "")
+        on_done = None
+        if self.option_cache:
+            cache = BuildCache(bpy.path.abspath(self.option_cache_dir) if self.option_cache_dir
+                               else os.path.join(values['dir'], "trenchcoat_cache"), self.option_cache_size << 20)
+            geometry, entities = ir.section_hashes()
+            pipeline = hashlib.sha1(repr((stages, ents)).encode()).hexdigest()
+            paths = {'bsp': values['bsp'], 'aas': values['aas']}
+            kind, build = cache.lookup(geometry, entities, pipeline, ents=bool(ents))
+            if kind:
+                cache.restore(build, paths)
+            if kind == 'hit':
+                self.report({'INFO'}, f"Build cache hit, compiled files restored. Cache: {cache.stats()}")
+                return
+            self.report({'INFO'}, f"Build cache {'entities only' if kind else 'miss'}. Cache: {cache.stats()}")
+            if kind == 'ents':
+                stages = ents
+            def on_done():
+                stored = cache.store(geometry, entities, pipeline, paths)
+                compile_pipeline.log(f"Cached {stored} files. Cache: {cache.stats()}\n")
+        compile_pipeline.start(stages, values, cwd=values['dir'], on_done=on_done)
+        self.report({'INFO'}, f"Compiling in the background, output in the '{compile_pipeline.log_name}' text")
+
+class MapSink:
+    """Base for export_map() targets, usable as a context manager"""
+    def write(self, chunk):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class BufferSink(MapSink):
+    """Keeps the map in memory, read it back with getvalue()"""
+    def __init__(self):
+        self.buffer = io.StringIO()
+
+    def write(self, chunk):
+        self.buffer.write(chunk)
+
+    def getvalue(self):
+        return self.buffer.getvalue()
+
+class FileSink(MapSink):
+    """Writes the map to a file as it is generated"""
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'w')
+
+    def write(self, chunk):
+        self.file.write(chunk)
+
+    def close(self):
+        self.file.close()
+
+class PipeSink(MapSink):
+    """Feeds the map to the stdin of a process, e.g. a compiler reading from a pipe.
+    close() waits for the process and keeps its exit code in returncode. If the process
+    stops reading early the rest of the map is dropped and broken is set"""
+    def __init__(self, args, **popen_args):
+        self.process = subprocess.Popen(args, stdin=subprocess.PIPE, text=True, **popen_args)
+        self.returncode = None
+        self.broken = False
+
+    def write(self, chunk):
+        if self.broken:
+            return
+        try:
+            self.process.stdin.write(chunk)
+        except BrokenPipeError:
+            self.broken = True
+
+    def close(self):
+        try:
+            self.process.stdin.close()
+        except BrokenPipeError:
+            self.broken = True
+        self.returncode = self.process.wait()
+
+COMPILE_PIPELINE = """# Compile stages run in the background after "Export .map", one per line:
+#     name [<- stages it waits for]: command
+# Stages that don't wait for each other run at the same time. {map} {bsp} {aas} {name} {dir}
+# and {game} are filled in from the exported map. Quote paths with spaces or backslashes.
+# With the build cache on, a stage called "ents" runs alone, on the cached .bsp, when only
+# entity keys changed. It is left out of full compiles.
+bsp: q3map2 -meta "{map}"
+vis <- bsp: q3map2 -vis -saveprt "{map}"
+light <- vis: q3map2 -light -fast -patchshadows "{map}"
+aas <- light: bspc -forcesidesvisible -optimize -bsp2aas "{bsp}"
+ents: q3map2 -onlyents "{map}"
+"""
+ENTS_STAGE = "ents"
+
+def pipeline_text(name):
+    """The pipeline text block, created with the default stages if there is none"""
+    text = bpy.data.texts.get(name)
+    if text is None:
+        text = bpy.data.texts.new(name)
+        text.write(COMPILE_PIPELINE)
+    return text
+
+def parse_pipeline(text):
+    """[(stage, [stages it waits for], command)] from pipeline text, ValueError for a bad line.
+    A stage can only wait for stages above it, so there are no cycles."""
+    stages = []
+    for number, line in enumerate(text.splitlines(), 1):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        head, colon, command = line.partition(':')
+        name, arrow, after = head.partition('<-')
+        name = name.strip()
+        after = [stage.strip() for stage in after.split(',') if stage.strip()]
+        if not colon or not command.strip() or not name.isidentifier():
+            raise ValueError(f"line {number}: expected 'name [<- stages]: command'")
+        known = [stage[0] for stage in stages]
+        if name in known:
+            raise ValueError(f"line {number}: stage '{name}' is defined twice")
+        for stage in after:
+            if stage not in known:
+                raise ValueError(f"line {number}: '{name}' waits for '{stage}', which isn't defined above it")
+        stages.append((name, after, command.strip()))
+    return stages
+
+def pipeline_values(map_path, game=""):
+    map_path = os.path.abspath(map_path)
+    base = os.path.splitext(map_path)[0]
+    folder = os.path.dirname(map_path)
+    return {'map': map_path, 'bsp': base + ".bsp", 'aas': base + ".aas", 'name': os.path.basename(base),
+            'dir': folder, 'game': game or os.path.dirname(folder)}
+
+def read_process_output(name, process, lines):
+    """Worker thread: a process's output into the queue line by line, then its exit code"""
+    for line in process.stdout:
+        lines.put((name, line))
+    lines.put((name, process.wait()))
+
+class CompilePipeline:
+    """Compile stages as background processes. The worker threads only move process output
+    into a queue, the log text block and the status bar are updated from poll(), on the main
+    thread from a timer. Starting again or cancel() terminates whatever still runs."""
+    log_name = "trenchcoat_compile.log"
+    interval = 0.1 # seconds between polls
+
+    def __init__(self):
+        self.stages = []
+        self.state = {} # stage -> waiting, running, done, failed, skipped or cancelled
+        self.processes = {}
+        self.queue = queue.Queue()
+        self.values = {}
+        self.cwd = None
+        self.started = 0.0
+        self.on_done = None
+
+    @property
+    def running(self):
+        return any(state in ('waiting', 'running') for state in self.state.values())
+
+    def start(self, stages, values, cwd=None, on_done=None):
+        """Run stages with values filled in, on_done() is called once all of them succeeded"""
+        self.cancel()
+        self.on_done = on_done
+        self.stages = stages
+        self.values = values
+        self.cwd = cwd
+        self.state = {name: 'waiting' for name, after, command in stages}
+        # a fresh queue, output of cancelled processes goes to the old one
+        self.queue = queue.Queue()
+        self.started = time.perf_counter()
+        self.log(f"Compiling {values.get('map', '')}: {', '.join(self.state)}\n", clear=True)
+        self.launch()
+        self.status()
+        if not bpy.app.timers.is_registered(compile_pipeline_tick):
+            bpy.app.timers.register(compile_pipeline_tick, first_interval=self.interval)
+
+    def launch(self):
+        """Start every waiting stage whose stages are done, skip those where one failed"""
+        changed = True
+        while changed:
+            changed = False
+            for name, after, command in self.stages:
+                if self.state[name] != 'waiting':
+                    continue
+                if any(self.state[stage] in ('failed', 'skipped', 'cancelled') for stage in after):
+                    self.state[name] = 'skipped'
+                    self.log(f"[{name}] skipped\n")
+                    changed = True
+                elif all(self.state[stage] == 'done' for stage in after):
+                    args = [arg.format(**self.values) for arg in shlex.split(command)]
+                    self.log(f"[{name}] {subprocess.list2cmdline(args)}\n")
+                    try:
+                        process = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                            stdin=subprocess.DEVNULL, text=True, errors='replace', bufsize=1, cwd=self.cwd)
+                    except (OSError, KeyError, IndexError, ValueError) as error:
+                        self.state[name] = 'failed'
+                        self.log(f"[{name}] can't start: {error!r}\n")
+                        changed = True
+                        continue
+                    self.state[name] = 'running'
+                    self.processes[name] = process
+                    threading.Thread(target=read_process_output, args=(name, process, self.queue), daemon=True).start()
+
+    def poll(self):
+        """Move queued output to the log and start the stages that can go. True while running"""
+        active = self.running
+        chunk = []
+        while True:
+            try:
+                name, item = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if isinstance(item, str):
+                chunk.append(f"[{name}] {item.rstrip()}\n")
+            elif self.state.get(name) == 'running':
+                self.processes.pop(name, None)
+                self.state[name] = 'done' if item == 0 else 'failed'
+                elapsed = time.perf_counter() - self.started
+                chunk.append(f"[{name}] {'finished' if item == 0 else f'failed with exit code {item}'} at {elapsed:.1f} s\n")
+        if chunk:
+            self.log(''.join(chunk))
+        self.launch()
+        if active and not self.running:
+            self.log(f"{self.summary()}\n")
+            if self.on_done and all(state == 'done' for state in self.state.values()):
+                self.on_done()
+        self.status()
+        return self.running
+
+    def cancel(self):
+        if not self.running:
+            return
+        for process in self.processes.values():
+            if process.poll() is None:
+                process.terminate()
+        self.processes.clear()
+        for name, state in self.state.items():
+            if state in ('waiting', 'running'):
+                self.state[name] = 'cancelled'
+        self.log("Cancelled\n")
+        self.status()
+
+    def summary(self):
+        if not self.state:
+            return ""
+        elapsed = time.perf_counter() - self.started
+        stages = ", ".join(f"{name} {state}" for name, state in self.state.items())
+        return f"Compile: {stages} ({elapsed:.0f} s)"
+
+    def log(self, chunk, clear=False):
+        text = bpy.data.texts.get(self.log_name) or bpy.data.texts.new(self.log_name)
+        if clear:
+            text.clear()
+        line = len(text.lines) - 1
+        text.cursor_set(line, character=len(text.lines[line].body))
+        text.write(chunk)
+
+    def status(self):
+        """Status bar while running, and a redraw for the sidebar and the open log"""
+        context = bpy.context
+        if context.workspace is not None:
+            context.workspace.status_text_set(self.summary() if self.running else None)
+        wm = context.window_manager
+        for window in wm.windows if wm else ():
+            for area in window.screen.areas:
+                if area.type in ('VIEW_3D', 'TEXT_EDITOR'):
+                    area.tag_redraw()
+
+compile_pipeline = CompilePipeline()
+
+def file_digest(path):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+class BuildCache:
+    """Compiled artifacts by content. Files are stored once under their sha1 in blobs/, index.json
+    maps builds (geometry hash, entity hash, pipeline hash) to them and keeps when each build
+    was last used, along with the hit and miss counts. Over the size cap the least recently used
+    builds go, then the blobs no build refers to anymore."""
+    def __init__(self, folder, cap=2 << 30):
+        self.folder = folder
+        self.cap = cap
+        self.index_path = os.path.join(folder, "index.json")
+        try:
+            with open(self.index_path) as file:
+                self.index = json.load(file)
+        except (OSError, ValueError):
+            self.index = {"builds": {}, "hits": 0, "ents": 0, "misses": 0}
+
+    def save(self):
+        os.makedirs(self.folder, exist_ok=True)
+        with open(self.index_path + ".tmp", 'w') as file:
+            json.dump(self.index, file, indent=1)
+        os.replace(self.index_path + ".tmp", self.index_path)
+
+    def blob(self, digest):
+        return os.path.join(self.folder, "blobs", digest)
+
+    def complete(self, build):
+        return all(os.path.isfile(self.blob(digest)) for digest in build["files"].values())
+
+    def lookup(self, geometry, entities, pipeline, ents=True):
+        """('hit', build) for the same build, ('ents', build) for the same geometry and pipeline
+        when ents is set, (None, None) otherwise. Counted in the stats."""
+        builds = self.index["builds"]
+        key = f"{geometry}-{entities}-{pipeline}"
+        kind = None
+        if key in builds and self.complete(builds[key]):
+            kind = 'hit'
+        elif ents:
+            same = [other for other, build in builds.items()
+                    if build["geometry"] == geometry and build["pipeline"] == pipeline and self.complete(build)]
+            if same:
+                kind, key = 'ents', max(same, key=lambda other: builds[other]["used"])
+        self.index[{'hit': "hits", 'ents': "ents", None: "misses"}[kind]] += 1
+        if kind:
+            builds[key]["used"] = time.time()
+        self.save()
+        return kind, builds[key] if kind else None
+
+    def restore(self, build, paths):
+        """Copy the build's files to paths (extension -> path)"""
+        for ext, digest in build["files"].items():
+            if ext in paths:
+                shutil.copyfile(self.blob(digest), paths[ext])
+
+    def store(self, geometry, entities, pipeline, paths):
+        """Keep the files at paths (extension -> path) that exist as this build. Returns their count"""
+        files = {}
+        for ext, path in paths.items():
+            if not os.path.isfile(path):
+                continue
+            digest = file_digest(path)
+            blob = self.blob(digest)
+            if not os.path.isfile(blob):
+                os.makedirs(os.path.dirname(blob), exist_ok=True)
+                shutil.copyfile(path, blob + ".tmp")
+                os.replace(blob + ".tmp", blob)
+            files[ext] = digest
+        if files:
+            self.index["builds"][f"{geometry}-{entities}-{pipeline}"] = {
+                "geometry": geometry, "entities": entities, "pipeline": pipeline, "files": files, "used": time.time()}
+            self.evict()
+            self.save()
+        return len(files)
+
+    def sizes(self):
+        digests = {digest for build in self.index["builds"].values() for digest in build["files"].values()}
+        return {digest: os.path.getsize(self.blob(digest)) for digest in digests if os.path.isfile(self.blob(digest))}
+
+    def evict(self):
+        builds = self.index["builds"]
+        sizes = self.sizes()
+        # the newest build stays even on its own over the cap
+        for key in sorted(builds, key=lambda key: builds[key]["used"])[:-1]:
+            if sum(sizes.values()) <= self.cap:
+                break
+            del builds[key]
+            sizes = self.sizes()
+        blobs = os.path.join(self.folder, "blobs")
+        for name in os.listdir(blobs) if os.path.isdir(blobs) else ():
+            if name not in sizes:
+                os.remove(os.path.join(blobs, name))
+
+    def stats(self):
+        index = self.index
+        return (f"{index['hits']} hits, {index['ents']} entities only, {index['misses']} misses, "
+                f"{len(index['builds'])} builds in {sum(self.sizes().values()) / (1 << 20):.1f} MB")
+
+def compile_pipeline_tick():
+    return compile_pipeline.interval if compile_pipeline.poll() else None
+
+class WM_OT_cancel_compile(bpy.types.Operator):
+    """Stop the compile stages that are still running"""
+    bl_idname = "wm.trenchcoat_cancel_compile"
+    bl_label = "Cancel Compile"
+
+    def execute(self, context):
+        compile_pipeline.cancel()
         return {'FINISHED'}
 
+def export_options():
+    """Option names and defaults of the export operator"""
+    return {key: prop.keywords.get('default') for key, prop in ExportQuakeMap.__annotations__.items()
+            if key.startswith('option_')}
+
+class MapExportJob(MapWriter):
+    """Export settings outside of an operator, reports are kept in messages"""
+    def __init__(self, filepath="", progress=None, timing=None, **options):
+        defaults = export_options()
+        for key, value in defaults.items():
+            setattr(self, key, value)
+        for key, value in options.items():
+            name = key if key.startswith('option_') else 'option_' + key
+            if name not in defaults:
+                raise TypeError(f"Unknown export option '{key}'")
+            setattr(self, name, value)
+        self.filepath = filepath
+        self.progress = progress
+        self.timing = timing
+        self.messages = []
+
+    def report(self, level, message):
+        self.messages.append((next(iter(level)), message))
+
+def export_ir(context=None, filepath="", **options):
+    """Collect the scene into a MapIR with the export operator's options"""
+    return MapExportJob(filepath, **options).build_ir(context or bpy.context)
+
+def export_map(sink=None, context=None, filepath="", progress=None, timing=None, **options):
+    """Export the scene from a script.
+
+    Options are those of the export operator, with or without the option_ prefix
+    (export_map(sink, sel=True)). Without a sink the map is returned as a generator
+    of text chunks, otherwise every chunk goes to sink.write() and the job is
+    returned for its messages. Closing the sink is left to the caller.
+    progress(done, total) is called per brush or entity, timing(stage, seconds)
+    once per export stage. MapExportError is raised if there is nothing to export,
+    before any chunk is produced: the scene is collected up front, only the text is
+    generated as the chunks are consumed.
+    """
+    job = MapExportJob(filepath, progress, timing, **options)
+    chunks = job.iter_ir(job.build_ir(context or bpy.context))
+    if sink is None:
+        return chunks
+    for chunk in chunks:
+        sink.write(chunk)
+    return job
+
 ############################ Trenchcoat ############################
 ############################ by uzugijin ###########################
 
+def has_brush_geometry(obj):
+    """Mesh object with geometry of its own, not an entity dummy's empty or proxy mesh"""
+    return obj.type == 'MESH' and obj.data is not None and len(obj.data.vertices) > 0 and not obj.data.get("tc_proxy")
+
 def get_class(obj, brush_only, context):    
     exclude_tags = [".exclude", "-exclude", "_exclude", "/exclude", ".ignore", "-ignore", "_ignore", "/ignore",
             ".editor", "-editor", "_editor", "/editor",
             ] # Stuff named with these get ignored on export!
     prefixes = ["scene collection", "collection", ".col", "-col", "_col", "/col",
-                    ".detail", "-detail", "_detail", "/detail", ".common/", "-common/", "_common/", "/common/"] # These will get included to worldspawn class. Normally, if you name your brush or collection, they will become entities!
+                    ".detail", "-detail", "_detail", "/detail", ".structural", "-structural", "_structural", "/structural", ".common/", "-common/", "_common/", "/common/"] # These will get included to worldspawn class. Normally, if you name your brush or collection, they will become entities!
     
     collection_name = obj.users_collection[0].name.lower()
 
@@ -444,12 +1907,16 @@ def get_class(obj, brush_only, context):
     else:
         if obj.type != 'MESH':
             
-            if obj.type in ('EMPTY') and obj.empty_display_type != 'PLAIN_AXES':
+            if obj.type == 'EMPTY' and obj.instance_type == 'COLLECTION' and obj.instance_collection:
+                return obj, 'model'
+            elif obj.type in ('EMPTY') and obj.empty_display_type != 'PLAIN_AXES':
                 return obj, 'point_ent'
             else:
                 return obj, 'None'
         else:
-            if "misc_model" in obj.name or ".entity" in obj.name or (obj.type == 'MESH' and obj.data and len(obj.data.vertices) == 0):
+            if "misc_model" in obj.name and 'model' not in obj and has_brush_geometry(obj):
+                return obj, 'model'
+            elif "misc_model" in obj.name or ".entity" in obj.name or not has_brush_geometry(obj):
                 return obj, 'point_ent'
             else:
                 if not brush_only:
@@ -478,283 +1945,441 @@ def get_class(obj, brush_only, context):
                     return obj, 'brush'
 
 def add_player_node(node_group):
+    nodes, links = node_group.nodes, node_group.links
     #upper_lane
-    cube_node = node_group.nodes.new('GeometryNodeMeshCube')
-    node_group.nodes["Cube"].inputs[0].default_value[0] = 3.2
-    node_group.nodes["Cube"].inputs[0].default_value[1] = 3.2
-    node_group.nodes["Cube"].inputs[0].default_value[2] = 3.2
+    cube_node = nodes.new('GeometryNodeMeshCube')
+    cube_node.inputs[0].default_value = (3.2, 3.2, 3.2)
     
-    set_pos_node = node_group.nodes.new('GeometryNodeSetPosition')
-    node_group.nodes["Set Position"].inputs[3].default_value[2] = 4
+    set_pos_node = nodes.new('GeometryNodeSetPosition')
+    set_pos_node.inputs[3].default_value[2] = 4
     
-    scale_elm_node = node_group.nodes.new('GeometryNodeScaleElements')
-    node_group.nodes["Scale Elements"].domain = 'FACE'
-    node_group.nodes["Scale Elements"].scale_mode = 'UNIFORM'
-    node_group.nodes["Scale Elements"].inputs[2].default_value = 0.38
+    scale_elm_node = nodes.new('GeometryNodeScaleElements')
+    scale_elm_node.domain = 'FACE'
+    scale_elm_node.scale_mode = 'UNIFORM'
+    scale_elm_node.inputs[2].default_value = 0.38
     
-    equal_node = node_group.nodes.new('FunctionNodeCompare')
-    node_group.nodes["Compare"].data_type = 'VECTOR'
-    node_group.nodes["Compare"].operation = 'EQUAL'
-    node_group.nodes["Compare"].inputs[12].default_value = 2.4
+    equal_node = nodes.new('FunctionNodeCompare')
+    equal_node.data_type = 'VECTOR'
+    equal_node.operation = 'EQUAL'
+    equal_node.inputs[12].default_value = 2.4
     
-    read_pos_node = node_group.nodes.new('GeometryNodeInputPosition')
+    read_pos_node = nodes.new('GeometryNodeInputPosition')
     
     #downtown
-    cube_node2 = node_group.nodes.new('GeometryNodeMeshCube')
-    node_group.nodes["Cube.001"].inputs[0].default_value[0] = 3.2
-    node_group.nodes["Cube.001"].inputs[0].default_value[1] = 3.2
-    node_group.nodes["Cube.001"].inputs[0].default_value[2] = 1.75
+    cube_node2 = nodes.new('GeometryNodeMeshCube')
+    cube_node2.inputs[0].default_value = (3.2, 3.2, 1.75)
     
-    set_pos_node2 = node_group.nodes.new('GeometryNodeSetPosition')
-    node_group.nodes["Set Position.001"].inputs[3].default_value[2] = 0.875
+    set_pos_node2 = nodes.new('GeometryNodeSetPosition')
+    set_pos_node2.inputs[3].default_value[2] = 0.875
     
-    scale_elm_node2 = node_group.nodes.new('GeometryNodeScaleElements')
-    node_group.nodes["Scale Elements.001"].domain = 'FACE'
-    node_group.nodes["Scale Elements.001"].scale_mode = 'UNIFORM'
-    node_group.nodes["Scale Elements.001"].inputs[2].default_value = 0.38    
-
-    extrude_node = node_group.nodes.new('GeometryNodeExtrudeMesh')
-    node_group.nodes["Extrude Mesh"].mode = 'FACES'
-    node_group.nodes["Extrude Mesh"].inputs[3].default_value = 0.66
-    node_group.nodes["Extrude Mesh"].inputs[4].default_value = True
-
-    equal_node2 = node_group.nodes.new('FunctionNodeCompare')
-    node_group.nodes["Compare.001"].data_type = 'VECTOR'
-    node_group.nodes["Compare.001"].operation = 'EQUAL'
-    node_group.nodes["Compare.001"].inputs[12].default_value = 0.8
-    node_group.nodes["Compare.001"].inputs[5].default_value[2] = 1
+    scale_elm_node2 = nodes.new('GeometryNodeScaleElements')
+    scale_elm_node2.domain = 'FACE'
+    scale_elm_node2.scale_mode = 'UNIFORM'
+    scale_elm_node2.inputs[2].default_value = 0.38    
+
+    extrude_node = nodes.new('GeometryNodeExtrudeMesh')
+    extrude_node.mode = 'FACES'
+    extrude_node.inputs[3].default_value = 0.66
+    extrude_node.inputs[4].default_value = True
+
+    equal_node2 = nodes.new('FunctionNodeCompare')
+    equal_node2.data_type = 'VECTOR'
+    equal_node2.operation = 'EQUAL'
+    equal_node2.inputs[12].default_value = 0.8
+    equal_node2.inputs[5].default_value[2] = 1
     
     #center
-    cyl_node = node_group.nodes.new('GeometryNodeMeshCylinder')
-    node_group.nodes["Cylinder"].inputs[0].default_value = 4
-    node_group.nodes["Cylinder"].inputs[3].default_value = 0.34
-    node_group.nodes["Cylinder"].inputs[4].default_value = 2.41
+    cyl_node = nodes.new('GeometryNodeMeshCylinder')
+    cyl_node.inputs[0].default_value = 4
+    cyl_node.inputs[3].default_value = 0.34
+    cyl_node.inputs[4].default_value = 2.41
 
-    combine_node = node_group.nodes.new('ShaderNodeCombineXYZ')
-    set_pos_node3 = node_group.nodes.new('GeometryNodeSetPosition')
+    combine_node = nodes.new('ShaderNodeCombineXYZ')
+    set_pos_node3 = nodes.new('GeometryNodeSetPosition')
 
-    trans_node = node_group.nodes.new('GeometryNodeTransform')
-    node_group.nodes["Transform Geometry"].inputs[1].default_value[0] = 1.6
-    node_group.nodes["Transform Geometry"].inputs[1].default_value[2] = 2.08
-    node_group.nodes["Transform Geometry"].inputs[2].default_value[1] = 1.5708
+    trans_node = nodes.new('GeometryNodeTransform')
+    trans_node.inputs[1].default_value[0] = 1.6
+    trans_node.inputs[1].default_value[2] = 2.08
+    trans_node.inputs[2].default_value[1] = 1.5708
 
-    join_node = node_group.nodes.new("GeometryNodeJoinGeometry")
-    output_node = node_group.nodes.get('Group Output')
+    join_node = nodes.new("GeometryNodeJoinGeometry")
+    output_node = group_node(node_group, 'NodeGroupOutput')
     
     #linking_upperlane
     
-    node_group.links.new(cube_node.outputs['Mesh'], set_pos_node.inputs['Geometry'])
-    node_group.links.new(set_pos_node.outputs['Geometry'], scale_elm_node.inputs['Geometry'])
-    node_group.links.new(read_pos_node.outputs['Position'], equal_node.inputs['A'])
-    node_group.links.new(equal_node.outputs['Result'], scale_elm_node.inputs['Selection'])
-    node_group.links.new(scale_elm_node.outputs['Geometry'], join_node.inputs['Geometry'])
+    links.new(cube_node.outputs['Mesh'], set_pos_node.inputs['Geometry'])
+    links.new(set_pos_node.outputs['Geometry'], scale_elm_node.inputs['Geometry'])
+    links.new(read_pos_node.outputs['Position'], equal_node.inputs['A'])
+    links.new(equal_node.outputs['Result'], scale_elm_node.inputs['Selection'])
+    links.new(scale_elm_node.outputs['Geometry'], join_node.inputs['Geometry'])
     
     #linking_downtown
     
-    node_group.links.new(cube_node2.outputs['Mesh'], set_pos_node2.inputs['Geometry'])
-    node_group.links.new(set_pos_node2.outputs['Geometry'], scale_elm_node2.inputs['Geometry'])
-    node_group.links.new(scale_elm_node2.outputs['Geometry'], extrude_node.inputs['Mesh'])
-    node_group.links.new(read_pos_node.outputs['Position'], equal_node2.inputs['A'])
-    node_group.links.new(equal_node2.outputs['Result'], scale_elm_node2.inputs['Selection'])
-    node_group.links.new(extrude_node.outputs['Mesh'], join_node.inputs['Geometry'])
-    node_group.links.new(equal_node2.outputs['Result'], extrude_node.inputs['Selection'])
-    node_group.links.new(join_node.outputs['Geometry'], output_node.inputs['Geometry'])
+    links.new(cube_node2.outputs['Mesh'], set_pos_node2.inputs['Geometry'])
+    links.new(set_pos_node2.outputs['Geometry'], scale_elm_node2.inputs['Geometry'])
+    links.new(scale_elm_node2.outputs['Geometry'], extrude_node.inputs['Mesh'])
+    links.new(read_pos_node.outputs['Position'], equal_node2.inputs['A'])
+    links.new(equal_node2.outputs['Result'], scale_elm_node2.inputs['Selection'])
+    links.new(extrude_node.outputs['Mesh'], join_node.inputs['Geometry'])
+    links.new(equal_node2.outputs['Result'], extrude_node.inputs['Selection'])
+    links.new(join_node.outputs['Geometry'], output_node.inputs['Geometry'])
 
     #linking extra
-    node_group.links.new(cyl_node.outputs['Mesh'], set_pos_node3.inputs['Geometry'])
-    node_group.links.new(cyl_node.outputs['Top'], set_pos_node3.inputs['Selection'])
-    node_group.links.new(combine_node.outputs['Vector'], set_pos_node3.inputs['Position'])
-    node_group.links.new(set_pos_node3.outputs['Geometry'], trans_node.inputs['Geometry'])
-    node_group.links.new(trans_node.outputs['Geometry'], join_node.inputs['Geometry'])
+    links.new(cyl_node.outputs['Mesh'], set_pos_node3.inputs['Geometry'])
+    links.new(cyl_node.outputs['Top'], set_pos_node3.inputs['Selection'])
+    links.new(combine_node.outputs['Vector'], set_pos_node3.inputs['Position'])
+    links.new(set_pos_node3.outputs['Geometry'], trans_node.inputs['Geometry'])
+    links.new(trans_node.outputs['Geometry'], join_node.inputs['Geometry'])
     
     return node_group
 
 def add_ent_node(node_group):
+    nodes, links = node_group.nodes, node_group.links
     
-    cube_node = node_group.nodes.new('GeometryNodeMeshCube')
-    node_group.nodes["Cube"].inputs[0].default_value[0] = 1.75
-    node_group.nodes["Cube"].inputs[0].default_value[1] = 1.75
-    node_group.nodes["Cube"].inputs[0].default_value[2] = 1.75
+    cube_node = nodes.new('GeometryNodeMeshCube')
+    cube_node.inputs[0].default_value = (1.75, 1.75, 1.75)
     
-    cyl_node = node_group.nodes.new('GeometryNodeMeshCylinder')
-    node_group.nodes["Cylinder"].inputs[0].default_value = 4
-    node_group.nodes["Cylinder"].inputs[3].default_value = 0.34
-    node_group.nodes["Cylinder"].inputs[4].default_value = 2.41
+    cyl_node = nodes.new('GeometryNodeMeshCylinder')
+    cyl_node.inputs[0].default_value = 4
+    cyl_node.inputs[3].default_value = 0.34
+    cyl_node.inputs[4].default_value = 2.41
 
-    combine_node = node_group.nodes.new('ShaderNodeCombineXYZ')
-    set_pos_node = node_group.nodes.new('GeometryNodeSetPosition')
+    combine_node = nodes.new('ShaderNodeCombineXYZ')
+    set_pos_node = nodes.new('GeometryNodeSetPosition')
 
-    trans_node = node_group.nodes.new('GeometryNodeTransform')
-    node_group.nodes["Transform Geometry"].inputs[1].default_value[0] = 2.08
-    node_group.nodes["Transform Geometry"].inputs[2].default_value[1] = 1.5708
+    trans_node = nodes.new('GeometryNodeTransform')
+    trans_node.inputs[1].default_value[0] = 2.08
+    trans_node.inputs[2].default_value[1] = 1.5708
 
-    join_node = node_group.nodes.new("GeometryNodeJoinGeometry")  
-    output_node = node_group.nodes.get('Group Output')
+    join_node = nodes.new("GeometryNodeJoinGeometry")  
+    output_node = group_node(node_group, 'NodeGroupOutput')
     
     #linking
     
     #linking extra
-    node_group.links.new(cyl_node.outputs['Mesh'], set_pos_node.inputs['Geometry'])
-    node_group.links.new(cyl_node.outputs['Top'], set_pos_node.inputs['Selection'])
-    node_group.links.new(combine_node.outputs['Vector'], set_pos_node.inputs['Position'])
-    node_group.links.new(set_pos_node.outputs['Geometry'], trans_node.inputs['Geometry'])
-    node_group.links.new(trans_node.outputs['Geometry'], join_node.inputs['Geometry'])
-    node_group.links.new(cube_node.outputs['Mesh'], join_node.inputs['Geometry'])
-    node_group.links.new(join_node.outputs['Geometry'], output_node.inputs['Geometry'])
+    links.new(cyl_node.outputs['Mesh'], set_pos_node.inputs['Geometry'])
+    links.new(cyl_node.outputs['Top'], set_pos_node.inputs['Selection'])
+    links.new(combine_node.outputs['Vector'], set_pos_node.inputs['Position'])
+    links.new(set_pos_node.outputs['Geometry'], trans_node.inputs['Geometry'])
+    links.new(trans_node.outputs['Geometry'], join_node.inputs['Geometry'])
+    links.new(cube_node.outputs['Mesh'], join_node.inputs['Geometry'])
+    links.new(join_node.outputs['Geometry'], output_node.inputs['Geometry'])
     
     return node_group
 
 def add_item_node(node_group):
+    nodes, links = node_group.nodes, node_group.links
         
-    cyl_node = node_group.nodes.new('GeometryNodeMeshCylinder')
-    node_group.nodes["Cylinder"].inputs[0].default_value = 4
-    node_group.nodes["Cylinder"].inputs[3].default_value = 0.34
-    node_group.nodes["Cylinder"].inputs[4].default_value = 2.41
+    cyl_node = nodes.new('GeometryNodeMeshCylinder')
+    cyl_node.inputs[0].default_value = 4
+    cyl_node.inputs[3].default_value = 0.34
+    cyl_node.inputs[4].default_value = 2.41
 
-    combine_node = node_group.nodes.new('ShaderNodeCombineXYZ')
-    set_pos_node = node_group.nodes.new('GeometryNodeSetPosition')
+    combine_node = nodes.new('ShaderNodeCombineXYZ')
+    set_pos_node = nodes.new('GeometryNodeSetPosition')
 
-    trans_node = node_group.nodes.new('GeometryNodeTransform')
-    node_group.nodes["Transform Geometry"].inputs[1].default_value[0] = 2.03
-    node_group.nodes["Transform Geometry"].inputs[1].default_value[2] = 1.8
-    node_group.nodes["Transform Geometry"].inputs[2].default_value[1] = 1.5708
+    trans_node = nodes.new('GeometryNodeTransform')
+    trans_node.inputs[1].default_value[0] = 2.03
+    trans_node.inputs[1].default_value[2] = 1.8
+    trans_node.inputs[2].default_value[1] = 1.5708
 
-    cube_node = node_group.nodes.new('GeometryNodeMeshCube')
-    node_group.nodes["Cube"].inputs[0].default_value[0] = 3.2
-    node_group.nodes["Cube"].inputs[0].default_value[1] = 3.2
-    node_group.nodes["Cube"].inputs[0].default_value[2] = 0.39
+    cube_node = nodes.new('GeometryNodeMeshCube')
+    cube_node.inputs[0].default_value = (3.2, 3.2, 0.39)
 
-    set_pos_node2 = node_group.nodes.new('GeometryNodeSetPosition')
-    node_group.nodes["Set Position.001"].inputs[3].default_value[2] = 0.195
+    set_pos_node2 = nodes.new('GeometryNodeSetPosition')
+    set_pos_node2.inputs[3].default_value[2] = 0.195
 
-    cube_node2 = node_group.nodes.new('GeometryNodeMeshCube')
-    node_group.nodes["Cube.001"].inputs[0].default_value[0] = 1.64
-    node_group.nodes["Cube.001"].inputs[0].default_value[1] = 1.64
-    node_group.nodes["Cube.001"].inputs[0].default_value[2] = 2.9
+    cube_node2 = nodes.new('GeometryNodeMeshCube')
+    cube_node2.inputs[0].default_value = (1.64, 1.64, 2.9)
 
-    set_pos_node3 = node_group.nodes.new('GeometryNodeSetPosition')
-    node_group.nodes["Set Position.002"].inputs[3].default_value[2] = 1.81
+    set_pos_node3 = nodes.new('GeometryNodeSetPosition')
+    set_pos_node3.inputs[3].default_value[2] = 1.81
 
-    join_node = node_group.nodes.new("GeometryNodeJoinGeometry")  
-    output_node = node_group.nodes.get('Group Output')
+    join_node = nodes.new("GeometryNodeJoinGeometry")  
+    output_node = group_node(node_group, 'NodeGroupOutput')
     
     #linking
     
     #linking extra
-    node_group.links.new(cyl_node.outputs['Mesh'], set_pos_node.inputs['Geometry'])
-    node_group.links.new(cyl_node.outputs['Top'], set_pos_node.inputs['Selection'])
-    node_group.links.new(combine_node.outputs['Vector'], set_pos_node.inputs['Position'])
-    node_group.links.new(set_pos_node.outputs['Geometry'], trans_node.inputs['Geometry'])
-    node_group.links.new(trans_node.outputs['Geometry'], join_node.inputs['Geometry'])
+    links.new(cyl_node.outputs['Mesh'], set_pos_node.inputs['Geometry'])
+    links.new(cyl_node.outputs['Top'], set_pos_node.inputs['Selection'])
+    links.new(combine_node.outputs['Vector'], set_pos_node.inputs['Position'])
+    links.new(set_pos_node.outputs['Geometry'], trans_node.inputs['Geometry'])
+    links.new(trans_node.outputs['Geometry'], join_node.inputs['Geometry'])
 
-    node_group.links.new(cube_node.outputs['Mesh'], set_pos_node2.inputs['Geometry'])
-    node_group.links.new(set_pos_node2.outputs['Geometry'], join_node.inputs['Geometry'])
+    links.new(cube_node.outputs['Mesh'], set_pos_node2.inputs['Geometry'])
+    links.new(set_pos_node2.outputs['Geometry'], join_node.inputs['Geometry'])
 
-    node_group.links.new(cube_node2.outputs['Mesh'], set_pos_node3.inputs['Geometry'])
-    node_group.links.new(set_pos_node3.outputs['Geometry'], join_node.inputs['Geometry'])
+    links.new(cube_node2.outputs['Mesh'], set_pos_node3.inputs['Geometry'])
+    links.new(set_pos_node3.outputs['Geometry'], join_node.inputs['Geometry'])
 
-    node_group.links.new(join_node.outputs['Geometry'], output_node.inputs['Geometry'])
+    links.new(join_node.outputs['Geometry'], output_node.inputs['Geometry'])
     
     return node_group
 
 def add_convex_hull_node(node_group):
+    nodes, links = node_group.nodes, node_group.links
+
+    vet_neighbors_node = nodes.new('GeometryNodeInputMeshVertexNeighbors')
+    del_geometry_node = nodes.new('GeometryNodeDeleteGeometry')
+    join_geometry_node = nodes.new('GeometryNodeJoinGeometry')
+
+    convex_hull_node = nodes.new('GeometryNodeConvexHull')
+    input_node = group_node(node_group, 'NodeGroupInput')
+    output_node = group_node(node_group, 'NodeGroupOutput')
+
+    links.new(vet_neighbors_node.outputs['Vertex Count'], del_geometry_node.inputs['Selection'])
+    links.new(input_node.outputs['Geometry'], del_geometry_node.inputs['Geometry'])
+    links.new(del_geometry_node.outputs['Geometry'], convex_hull_node.inputs['Geometry'])
+    links.new(convex_hull_node.outputs['Convex Hull'], join_geometry_node.inputs['Geometry'])
+    links.new(join_geometry_node.outputs['Geometry'], output_node.inputs['Geometry'])
+    links.new(input_node.outputs['Geometry'], join_geometry_node.inputs['Geometry'])
+    return node_group
 
-    vet_neighbors_node = node_group.nodes.new('GeometryNodeInputMeshVertexNeighbors')
-    del_geometry_node = node_group.nodes.new('GeometryNodeDeleteGeometry')
-    join_geometry_node = node_group.nodes.new('GeometryNodeJoinGeometry')
+def group_node(node_group, bl_idname):
+    return next(node for node in node_group.nodes if node.bl_idname == bl_idname)
+
+def new_geometry_group(name):
+    """Empty modifier node group with a geometry input and output, like the editor's New button"""
+    node_group = bpy.data.node_groups.new(name, 'GeometryNodeTree')
+    node_group.interface.new_socket("Geometry", in_out='INPUT', socket_type='NodeSocketGeometry')
+    node_group.interface.new_socket("Geometry", in_out='OUTPUT', socket_type='NodeSocketGeometry')
+    node_group.is_modifier = True
+    node_group.nodes.new('NodeGroupInput').location = (-300, 0)
+    node_group.nodes.new('NodeGroupOutput').location = (300, 0)
+    return node_group
 
-    convex_hull_node = node_group.nodes.new('GeometryNodeConvexHull')
-    input_node = node_group.nodes.get('Group Input')
-    output_node = node_group.nodes.get('Group Output')
+NODE_BUILDERS = {
+    "convex_hull": add_convex_hull_node,
+    "player": add_player_node,
+    "ent": add_ent_node,
+    "item": add_item_node,
+}
 
-    node_group.links.new(vet_neighbors_node.outputs['Vertex Count'], del_geometry_node.inputs['Selection'])
-    node_group.links.new(input_node.outputs['Geometry'], del_geometry_node.inputs['Geometry'])
-    node_group.links.new(del_geometry_node.outputs['Geometry'], convex_hull_node.inputs['Geometry'])
-    node_group.links.new(convex_hull_node.outputs['Convex Hull'], join_geometry_node.inputs['Geometry'])
-    node_group.links.new(output_node.inputs['Geometry'], join_geometry_node.outputs['Geometry'])
-    node_group.links.new(input_node.outputs['Geometry'], join_geometry_node.inputs['Geometry'])
-    return node_group
+# The *GeometryGroup trees per builder key, as write_node_library saves them
+NODE_GROUPS = {
+    "convex_hull": "ConvexHullBrushGeometryGroup",
+    "player": "PlayerEntGenGeometryGroup",
+    "ent": "GenericEntGenGeometryGroup",
+    "item": "GenericItemGenGeometryGroup",
+}
 
-def add_geonode_to_object(obj, name, node):
-            # Check if the object already has a Geometry Node modifier
+# Searched in order next to the addon for prebuilt node groups
+# written by write_node_library(), the templates hold no node groups
+NODE_LIBRARY = "trenchcoat_nodes.blend"
+
+class NodeLibrary:
+    """Prebuilt node groups appended on demand from NODE_LIBRARY next to the addon, its group
+    names read once per session. Without the file, or a group missing from it, the group is
+    built in code."""
+    def __init__(self):
+        self.contents = {}
+
+    def find(self, name):
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)), NODE_LIBRARY)
+        if path not in self.contents:
+            names = set()
+            if os.path.isfile(path):
                 try:
-                    modifier = obj.modifiers.get(name)
-                except:
+                    with bpy.data.libraries.load(path, assets_only=False) as (data_from, data_to):
+                        names = set(data_from.node_groups)
+                except OSError:
                     pass
-                if modifier is None:
-                    modifier = obj.modifiers.new(name, 'NODES')
-                    try:
-                        modifier.node_group = bpy.data.node_groups[name+"GeometryGroup"]
-                    except:
-                        pass
-                    if modifier.node_group is None:
-                        bpy.ops.node.new_geometry_node_group_assign()        
-                        modifier.node_group.name = name+"GeometryGroup"
-                        group_name = modifier.node_group.name  
-                        if node == "convex_hull":
-                            add_convex_hull_node(modifier.node_group)
-                        elif node == "player":
-                            add_player_node(modifier.node_group)
-                        elif node == "ent":
-                            add_ent_node(modifier.node_group)
-                        elif node == "item":
-                            add_item_node(modifier.node_group)
-
-                        return group_name
+            self.contents[path] = names
+        return path if name in self.contents[path] else None
+
+    def load(self, name, node):
+        path = self.find(name)
+        if path is not None:
+            with bpy.data.libraries.load(path, link=False) as (data_from, data_to):
+                data_to.node_groups = [name]
+            if data_to.node_groups and data_to.node_groups[0] is not None:
+                return data_to.node_groups[0]
+        return NODE_BUILDERS[node](new_geometry_group(name))
+
+node_library = NodeLibrary()
+
+def write_node_library(path):
+    """Build every node group in code and save them, marked as assets, to path, for NODE_LIBRARY"""
+    groups = set()
+    for node, name in NODE_GROUPS.items():
+        group = NODE_BUILDERS[node](new_geometry_group(name))
+        group.asset_mark()
+        groups.add(group)
+    bpy.data.libraries.write(path, groups, fake_user=True)
+    for group in groups:
+        bpy.data.node_groups.remove(group)
+
+class DataRegistry:
+    """Shared datablocks by name: the empty "null" mesh every point entity dummy uses and the
+    *GeometryGroup node trees. Each is found or created once, then served from a dict under the
+    name asked for, even if Blender gave it another (null.001); an entry whose datablock was
+    removed is looked up again. Cleared on undo and load, when every datablock is reallocated."""
+    def __init__(self):
+        self.meshes = {}
+        self.node_groups = {}
+
+    def clear(self, *args):
+        self.meshes.clear()
+        self.node_groups.clear()
+
+    def cached(self, cache, key):
+        data = cache.get(key)
+        if data is None:
+            return None
+        try:
+            data.name
+        except ReferenceError:
+            del cache[key]
+            return None
+        return data
+
+    def mesh(self, name="null"):
+        """Empty placeholder mesh, created the first time it is asked for and again if the
+        stored one got vertices"""
+        mesh = self.cached(self.meshes, name)
+        if mesh is None or len(mesh.vertices):
+            mesh = bpy.data.meshes.get(name)
+            if mesh is None or len(mesh.vertices):
+                mesh = bpy.data.meshes.new(name)
+            self.meshes[name] = mesh
+        return mesh
+
+    def node_group(self, name):
+        """Geometry node group or None if it isn't in the file yet"""
+        group = self.cached(self.node_groups, name)
+        if group is None:
+            group = bpy.data.node_groups.get(name)
+            if group is not None:
+                self.node_groups[name] = group
+        return group
+
+data_registry = DataRegistry()
+
+@persistent
+def data_registry_reset(*args):
+    data_registry.clear()
+
+def add_geonode_group(name, node):
+    """The name+"GeometryGroup" node group, appended from the node library or built the first
+    time it is needed in the file"""
+    group_name = name+"GeometryGroup"
+    node_group = data_registry.node_group(group_name)
+    if node_group is None:
+        node_group = node_library.load(group_name, node)
+        data_registry.node_groups[group_name] = node_group
+    return node_group
+
+def add_geonode_to_object(obj, name, node):
+    """Give obj a modifier running the node group, suspended right away in performance mode.
+    Returns the group name."""
+    if obj.modifiers.get(name) is not None:
+        return None
+    modifier = obj.modifiers.new(name, 'NODES')
+    modifier.node_group = add_geonode_group(name, node)
+    if bpy.context.scene.tc_performance_mode:
+        suspend_modifier(obj, modifier, True)
+    return modifier.node_group.name
+
+# Trenchcoat geometry node modifiers, by modifier name, and their node builder key
+PERF_MODIFIERS = {"ConvexHullBrush": "convex_hull", "PlayerEntGen": "player", "GenericEntGen": "ent", "GenericItemGen": "item"}
+
+def entity_proxy(name, node):
+    """What an entity class' node group draws, baked once into a plain mesh all its dummies share.
+    Flagged tc_proxy so the dummies still count as point entities."""
+    mesh_name = name + "Proxy"
+    mesh = data_registry.cached(data_registry.meshes, mesh_name) or bpy.data.meshes.get(mesh_name)
+    if mesh is None:
+        scene = bpy.context.scene
+        temp = bpy.data.objects.new(mesh_name, data_registry.mesh("null"))
+        scene.collection.objects.link(temp)
+        temp.modifiers.new(name, 'NODES').node_group = add_geonode_group(name, node)
+        mesh = bpy.data.meshes.new_from_object(temp.evaluated_get(bpy.context.evaluated_depsgraph_get()))
+        bpy.data.objects.remove(temp)
+        mesh.name = mesh_name
+        mesh["tc_proxy"] = True
+    data_registry.meshes[mesh_name] = mesh
+    return mesh
+
+def suspend_modifier(obj, modifier, enabled):
+    """Performance mode for one Trenchcoat modifier: off in the viewport, entity dummies showing
+    their class proxy, or back to full evaluation on the "null" mesh"""
+    node = PERF_MODIFIERS[modifier.name]
+    modifier.show_viewport = not enabled
+    if node != "convex_hull":
+        if enabled and not len(obj.data.vertices):
+            obj.data = entity_proxy(modifier.name, node)
+        elif not enabled and obj.data.get("tc_proxy"):
+            obj.data = data_registry.mesh("null")
+
+def set_performance_mode(scene, enabled):
+    """Suspend or restore every Trenchcoat modifier in the scene, return how many changed.
+    Hint cages just switch off, the brush mesh is the hull already."""
+    changed = 0
+    for obj in scene.objects:
+        if obj.type != 'MESH':
+            continue
+        for modifier in obj.modifiers:
+            if modifier.type == 'NODES' and modifier.name in PERF_MODIFIERS and modifier.show_viewport == enabled:
+                suspend_modifier(obj, modifier, enabled)
+                changed += 1
+    return changed
+
+def update_performance_mode(self, context):
+    set_performance_mode(self, self.tc_performance_mode)
+
+class VIEW3D_OT_measure_fps(bpy.types.Operator):
+    """Redraw the 3D view a number of times and report the frame rate, to compare with performance mode on and off"""
+    bl_idname = "view3d.trenchcoat_measure_fps"
+    bl_label = "Measure Viewport FPS"
+
+    frames: IntProperty(name="Frames", default=60, min=1)
+
+    def execute(self, context):
+        context.view_layer.update()
+        start = time.perf_counter()
+        bpy.ops.wm.redraw_timer(type='DRAW_WIN_SWAP', iterations=self.frames)
+        elapsed = time.perf_counter() - start
+        mode = "on" if context.scene.tc_performance_mode else "off"
+        self.report({'INFO'}, f"{self.frames / elapsed:.1f} FPS ({elapsed / self.frames * 1000:.1f} ms per frame), "
+                              f"{len(context.scene.objects)} objects, performance mode {mode}")
+        return {'FINISHED'}
+
 
 class DuplicateObjectOperator(bpy.types.Operator):
     bl_idname = "object.duplicate_shared"
     bl_label = "Duplicate Object (Shared Mesh)"
-    bl_description = "Makes a symmetrical duplicate"
-    bl_options = {'UNDO'}
+    bl_description = "Makes a symmetrical linked duplicate, the mirror is kept in the object transform"
+    bl_options = {'REGISTER', 'UNDO'}
 
     def execute(self, context):
-        bpy.context.scene.tool_settings.use_transform_pivot_point_align = False
-        selectedobjects = []
-        for obj in bpy.context.selected_objects:
-            selectedobjects.append(obj)
+        selectedobjects = list(context.selected_objects)
+        axis = Vector([float(a == context.scene.mirror_axis) for a in "xyz"])
+        pivot = None
         if context.scene.invasive_mirror:
-            active_object = bpy.context.active_object
-            bpy.ops.object.select_all(action='DESELECT')
-            active_object.select_set(True)
-            bpy.ops.object.mode_set(mode='EDIT')
-            bpy.ops.mesh.select_all(action='SELECT')
-            previous_pp = bpy.context.scene.tool_settings.transform_pivot_point
-            bpy.context.scene.tool_settings.transform_pivot_point = 'BOUNDING_BOX_CENTER'
-            bpy.ops.view3d.snap_cursor_to_selected()
-            bpy.context.scene.tool_settings.transform_pivot_point = previous_pp
-            bpy.ops.mesh.select_all(action='DESELECT')
-            bpy.ops.object.mode_set(mode='OBJECT')
-            try:
-                selectedobjects.remove(active_object)
-            except:
+            active_object = context.active_object
+            if active_object not in selectedobjects:
                 self.report({'ERROR'}, "There was no active selection!")
                 return {'CANCELLED'}
-        bpy.ops.object.select_all(action='DESELECT')
-        
-        for obj in selectedobjects:
-            obj.select_set(True)
-            bpy.context.view_layer.objects.active = obj
-            
-            bpy.ops.object.transform_apply(location=False, rotation=True, scale=True)
-            if context.scene.invasive_mirror:
-                bpy.ops.object.origin_set(type='ORIGIN_CURSOR', center='MEDIAN')
-            bpy.ops.object.duplicate_move()
-            
-            axis_block = []
-            if context.scene.mirror_axis == "x":
-                axis_block = (True, False, False)
-            elif context.scene.mirror_axis == "y":
-                axis_block = (False, True, False)
-            elif context.scene.mirror_axis == "z":
-                axis_block = (False, False, True)
-            bpy.ops.transform.mirror(orient_type='GLOBAL', orient_matrix=((1, 0, 0), (0, 1, 0), (0, 0, 1)), orient_matrix_type='GLOBAL', constraint_axis=(axis_block))
-            bpy.ops.object.transform_apply(location=False, rotation=True, scale=True)
-            obj.select_set(False)
-            bpy.context.view_layer.objects.active = None
-            bpy.ops.object.select_all(action='DESELECT')
+            selectedobjects.remove(active_object)
+            # mirror around the center of the active object's bounding box
+            if active_object.type == 'MESH' and len(active_object.data.vertices):
+                matrix = np.array(active_object.matrix_world)
+                co = mesh_coords(active_object.data) @ matrix[:3, :3].T + matrix[:3, 3]
+                pivot = Vector((co.min(axis=0) + co.max(axis=0)) / 2)
+            else:
+                pivot = active_object.matrix_world.translation.copy()
+        elif context.scene.tool_settings.transform_pivot_point == 'CURSOR':
+            pivot = context.scene.cursor.location.copy()
+
         for obj in selectedobjects:
-            obj.select_set(True)    
+            center = pivot if pivot is not None else obj.matrix_world.translation.copy()
+            mirror = Matrix.Translation(center) @ Matrix.Scale(-1, 4, axis) @ Matrix.Translation(-center)
+            duplicate = obj.copy() # shares the mesh
+            for col in obj.users_collection:
+                col.objects.link(duplicate)
+            duplicate.matrix_world = mirror @ obj.matrix_world
+            duplicate.select_set(False)
         return {'FINISHED'}
 
 class SnapOriginToCenter(bpy.types.Operator):
@@ -831,6 +2456,73 @@ class OBJECT_OT_snap_ori(bpy.types.Operator):
                 bpy.ops.object.mode_set(mode='EDIT')
         return {'FINISHED'}
 
+def grid_misaligned(co, grid, tolerance=0.0001):
+    """Mask of coordinate rows that are off the grid by more than tolerance (in grid steps)"""
+    steps = co / grid
+    return (np.abs(steps - np.round(steps)) > tolerance).any(axis=1)
+
+def mesh_coords(mesh):
+    """Vertex coordinates of a mesh as an (n, 3) array"""
+    co = np.empty(len(mesh.vertices) * 3, dtype=np.float32)
+    mesh.vertices.foreach_get('co', co)
+    return co.reshape(-1, 3).astype(np.float64)
+
+def mesh_arrays(mesh, matrix):
+    """World coordinates, flat polygon corner indices and polygon sizes of a mesh.
+    Under a mirroring matrix the corners are reversed, so faces still wind outward"""
+    matrix = np.array(matrix)
+    co = mesh_coords(mesh) @ matrix[:3, :3].T + matrix[:3, 3]
+    corners = np.empty(len(mesh.loops), dtype=np.int64)
+    mesh.loops.foreach_get('vertex_index', corners)
+    face_sizes = np.empty(len(mesh.polygons), dtype=np.int64)
+    mesh.polygons.foreach_get('loop_total', face_sizes)
+    loop_start = np.empty(len(mesh.polygons), dtype=np.int64)
+    mesh.polygons.foreach_get('loop_start', loop_start)
+    starts = np.cumsum(face_sizes) - face_sizes
+    local = np.arange(int(face_sizes.sum())) - np.repeat(starts, face_sizes)
+    if np.linalg.det(matrix[:3, :3]) < 0:
+        local = np.repeat(face_sizes - 1, face_sizes) - local
+    order = np.repeat(loop_start, face_sizes) + local
+    return co, corners[order], face_sizes
+
+def snap_object_to_grid(obj, grid, only_selected=False):
+    """Snap the vertices of a mesh object to the world grid in one pass, without
+    operators or mode switches. only_selected leaves the vertices that aren't selected in
+    the mesh alone, in object mode too. Returns the number of vertices that were off the grid"""
+    mesh = obj.data
+    matrix = np.array(obj.matrix_world)
+    selected = None
+    if obj.mode == 'EDIT':
+        bm = bmesh.from_edit_mesh(mesh)
+        verts = [vert for vert in bm.verts if vert.select or not only_selected]
+        co = np.array([vert.co for vert in verts], dtype=np.float64).reshape(-1, 3)
+    else:
+        co = mesh_coords(mesh)
+        if only_selected:
+            selected = np.zeros(len(co), dtype=bool)
+            mesh.vertices.foreach_get('select', selected)
+    world = co @ matrix[:3, :3].T + matrix[:3, 3]
+    misaligned = grid_misaligned(world, grid)
+    if selected is not None:
+        misaligned &= selected
+    count = int(misaligned.sum())
+    if count:
+        snapped = np.round(world[misaligned] / grid) * grid
+        co[misaligned] = (snapped - matrix[:3, 3]) @ np.linalg.inv(matrix[:3, :3]).T
+        if obj.mode == 'EDIT':
+            for index in np.flatnonzero(misaligned):
+                verts[index].co = co[index]
+            bmesh.update_edit_mesh(mesh)
+        else:
+            mesh.vertices.foreach_set('co', co.astype(np.float32).ravel())
+            mesh.update()
+    return count
+
+def snap_origin_to_grid(obj, grid):
+    """Snap an object's world location to the grid"""
+    location = obj.matrix_world.translation
+    obj.matrix_world.translation = [round(co / grid) * grid for co in location]
+
 class OBJECT_OT_snap_selected_to_grid(bpy.types.Operator):
     """Snaps all vertices of the mesh object(s) to the grid"""
     bl_idname = "object.snap_selected_to_grid"
@@ -840,104 +2532,29 @@ class OBJECT_OT_snap_selected_to_grid(bpy.types.Operator):
     def execute(self, context):
         
         # Get selected objects
-        selected_objects = [obj for obj in bpy.context.selected_objects if obj.type == 'MESH' and obj.data and len(obj.data.vertices) > 0]
-        if bpy.context.active_object.type == 'MESH' and bpy.context.active_object.data and len(bpy.context.active_object.data.vertices) > 0:
-            selected_objects.append(bpy.context.active_object)
-        original_grid = bpy.context.space_data.overlay.grid_scale              
-        original_mode = bpy.context.object.mode
-        grid_scale = float(bpy.context.scene.grid_size)
+        selected_objects = [obj for obj in context.selected_objects if has_brush_geometry(obj)]
+        active = context.active_object
+        if active and active not in selected_objects and has_brush_geometry(active):
+            selected_objects.append(active)
+        grid_scale = float(context.scene.grid_size)
         
         if not selected_objects:
-            for obj in bpy.context.selected_objects:
-                if obj:
-                    bpy.context.space_data.overlay.grid_scale = grid_scale
-                    bpy.ops.object.mode_set(mode='OBJECT')
-                    bpy.ops.view3d.snap_selected_to_grid()
-                    bpy.context.space_data.overlay.grid_scale = original_grid
-                else:
-                    print("No objects selected")
+            for obj in context.selected_objects:
+                snap_origin_to_grid(obj, grid_scale)
+            if not context.selected_objects:
+                print("No objects selected")
             return {'FINISHED'}
         
-        # Results storage
-        results = {
-            'aligned_verts': 0,
-            'misaligned_verts': 0,
-            'misaligned_objects': []
-        }
-            
+        misaligned_objects = []
         for obj in selected_objects:
-            # Make sure we're working with the object's data
-            mesh = obj.data
-            
-            # Get the world matrix for object transformations
-            world_matrix = obj.matrix_world
-            
-            # Check if object is in edit mode
-            if obj.mode == 'EDIT':
-                # Get a bmesh from the edit mesh
-                bm = bmesh.from_edit_mesh(mesh)
-                verts = bm.verts
-            else:
-                # For object mode, use the mesh vertices directly
-                verts = mesh.vertices
-            
-            object_results = {
-                'name': obj.name,
-                'aligned_verts': 0,
-                'misaligned_verts': 0,
-                'misaligned_positions': []
-            }
-            
-            for vert in verts:
-                # Get the world position of the vertex
-                if obj.mode == 'EDIT':
-                    vert_world_pos = world_matrix @ vert.co
-                else:
-                    vert_world_pos = world_matrix @ vert.co
-                
-                # Check if each coordinate is aligned to the grid
-                aligned = True
-                for i in range(3):
-                    # Calculate how many grid steps this coordinate represents
-                    coord_steps = vert_world_pos[i] / grid_scale
-                    
-                    # Check if it's close to a whole number (within a small tolerance)
-                    if abs(coord_steps - round(coord_steps)) > 0.0001:
-                        aligned = False
-                        break
-                
-                if aligned:
-                    object_results['aligned_verts'] += 1
-                    results['aligned_verts'] += 1
-                else:
-                    object_results['misaligned_verts'] += 1
-                    #object_results['misaligned_positions'].append(vert_world_pos.copy())
-                    results['misaligned_verts'] += 1
-            
-            if object_results['misaligned_verts'] > 0:
-                results['misaligned_objects'].append(object_results)
-                           
-                bpy.ops.object.mode_set(mode='EDIT')
-                  
-                if context.scene.snap_alone == False:
-                    bpy.ops.mesh.select_all(action='SELECT')
-                
-                bpy.context.space_data.overlay.grid_scale = grid_scale
-                bpy.ops.view3d.snap_selected_to_grid()
-                                              
-                # Remove doubles
-                #bpy.ops.mesh.remove_doubles()
-                bpy.context.space_data.overlay.grid_scale = original_grid
-                
-                if context.scene.snap_alone == False:
-                    bpy.ops.mesh.select_all(action='DESELECT')
-                        
-                # Restore original active object and mode
-                bpy.ops.object.mode_set(mode=original_mode)
+            # "Only selected" keeps unselected vertices where they are, in object mode too
+            count = snap_object_to_grid(obj, grid_scale, context.scene.snap_alone)
+            if count:
+                misaligned_objects.append((obj.name, count))
                         
-        if results['misaligned_objects']:
-            for obj_result in results['misaligned_objects']:
-                print(f"  {obj_result['name']}: {obj_result['misaligned_verts']} misaligned vertices")
+        if misaligned_objects:
+            for name, count in misaligned_objects:
+                print(f"  {name}: {count} misaligned vertices")
             self.report({'INFO'}, "Misaligned vertices snapped to grid!")
         else:
             print("All vertices are aligned to the grid!")
@@ -1075,112 +2692,116 @@ class CalcGridstance(bpy.types.Operator):
         context.scene.gridsteps = total_grid_steps
         return {'FINISHED'}
 
+def loose_parts(vert_count, edges):
+    """Label of the connected part every vertex belongs to, edges as an (n, 2) array"""
+    labels = np.arange(vert_count)
+    if len(edges):
+        a, b = edges[:, 0], edges[:, 1]
+        while True:
+            low = np.minimum(labels[a], labels[b])
+            new = labels.copy()
+            np.minimum.at(new, a, low)
+            np.minimum.at(new, b, low)
+            new = new[new] # pointer jumping
+            if np.array_equal(new, labels):
+                break
+            labels = new
+    return labels
+
+def hull_mesh(points, mesh):
+    """Replace the mesh with the convex hull of points"""
+    bm = bmesh.new()
+    for co in points:
+        bm.verts.new(co)
+    hull = bmesh.ops.convex_hull(bm, input=bm.verts)
+    bmesh.ops.delete(bm, geom=[ele for ele in hull['geom_interior'] + hull['geom_unused'] if isinstance(ele, bmesh.types.BMVert)], context='VERTS')
+    bmesh.ops.join_triangles(bm, faces=bm.faces, angle_face_threshold=math.radians(1), angle_shape_threshold=math.radians(180))
+    bm.to_mesh(mesh)
+    bm.free()
+    mesh.update()
+
 class ConvexHullBrush(bpy.types.Operator):
     bl_idname = "object.convexhull_brush"
     bl_label = "Make Brush"
     bl_description = "Register as brush: Renames mesh to brush, attaches convex hull nodegroup (requires HintCage material), optionally merges brushes"
-    bl_options = {'UNDO'}
+    bl_options = {'REGISTER', 'UNDO'}
 
     def execute(self, context):
-        # Get the active object
-        obj = context.active_object
         grid_size = float(context.scene.grid_size)
         snap = context.scene.snap
-        original_grid = bpy.context.space_data.overlay.grid_scale
-        original_mode = bpy.context.object.mode
-
-        # Store originally selected objects
-        original_selected = list(context.selected_objects)
-
-        # Process each mesh object and track which ones were processed
-        processed_objects = []
-
-        for obj in original_selected:
-            if obj.type == 'MESH':
-                # Remove custom properties
-                for key in list(obj.keys()):
-                    if key not in ['_RNA_UI']:  # Keep Blender's internal properties
-                        del obj[key]
+        original_mode = context.mode
+        if original_mode != 'OBJECT':
+            bpy.ops.object.mode_set(mode='OBJECT')
+        depsgraph = context.evaluated_depsgraph_get()
 
-                bpy.ops.object.mode_set(mode='OBJECT')
-                # Select only this object 
-                bpy.ops.object.select_all(action='DESELECT')
-                obj.select_set(True)
-                context.view_layer.objects.active = obj
-                bpy.ops.object.convert(target='MESH')
-                bpy.ops.object.mode_set(mode='EDIT')
-                bpy.ops.mesh.separate(type='LOOSE')
-                bpy.ops.mesh.select_all(action='SELECT')
-                bpy.ops.mesh.convex_hull()
-                if snap:
-                    bpy.context.space_data.overlay.grid_scale = grid_size
-                    bpy.ops.view3d.snap_selected_to_grid()
-                    bpy.context.space_data.overlay.grid_scale = original_grid
-                bpy.ops.mesh.delete(type='EDGE_FACE')
-                bpy.ops.mesh.select_all(action='SELECT')
-                bpy.ops.mesh.convex_hull()
-                bpy.ops.mesh.select_mode(use_extend=False, use_expand=False, type='VERT')
-
-                if context.scene.hintcage:
-                    add_geonode_to_object(obj, "ConvexHullBrush", "convex_hull")
-                
-                # Store the processed object
-                processed_objects.append(obj)
-                
-                bpy.ops.object.mode_set(mode=original_mode)
-                if context.scene.material is not None:
-                    if context.scene.material.name not in obj.data.materials:
-                        obj.data.materials.append(context.scene.material)
-            else:
+        # Collect the loose parts of every selected mesh in world space
+        parts = []
+        for obj in context.selected_objects:
+            if obj.type != 'MESH':
                 self.report({'WARNING'}, f"Skipping non-mesh object: {obj.name}")
+                continue
+            evaluated = obj.evaluated_get(depsgraph)
+            mesh = evaluated.to_mesh()
+            matrix = np.array(obj.matrix_world)
+            co = mesh_coords(mesh) @ matrix[:3, :3].T + matrix[:3, 3]
+            edges = np.empty(len(mesh.edges) * 2, dtype=np.int64)
+            mesh.edges.foreach_get('vertices', edges)
+            evaluated.to_mesh_clear()
+            if snap:
+                co = np.round(co / grid_size) * grid_size
+            labels = loose_parts(len(co), edges.reshape(-1, 2))
+            for label in np.unique(labels):
+                part = co[labels == label]
+                if len(part) >= 4: # anything smaller has no volume
+                    parts.append((obj, part))
+
+        if not parts:
+            return {'CANCELLED'}
 
-        # Handle automerge AFTER processing all objects
-        if context.scene.automerge and processed_objects:
-            # Deselect all objects first
-            bpy.ops.object.mode_set(mode='OBJECT')
-            bpy.ops.object.select_all(action='DESELECT')
-            
-            # Select only the processed objects
-            for obj in processed_objects:
-                obj.select_set(True)
-            
-            # Set the first processed object as active
-            context.view_layer.objects.active = processed_objects[0]
-            
-            # Join all processed objects
-            bpy.ops.object.join()
-            bpy.ops.object.convert(target='MESH')
-            bpy.ops.object.mode_set(mode='EDIT')
-            bpy.ops.mesh.select_all(action='SELECT')
-            bpy.ops.mesh.convex_hull()
-            bpy.ops.object.mode_set(mode='OBJECT')
-            
-            # Get the merged object
-            merged_obj = context.active_object
-            
-            # Rename the merged object
-            merged_obj.name = "brush"
-            merged_obj.data.name = "brush"
-            
-            # Add geometry nodes to the merged object
+        # Merge everything into the first object, or give every part its own object
+        if context.scene.automerge:
+            target = parts[0][0]
+            for obj in {obj for obj, _ in parts} - {target}:
+                bpy.data.objects.remove(obj)
+            parts = [(target, np.concatenate([co for _, co in parts]))]
+        brushes = []
+        used = set()
+        for obj, co in parts:
+            if obj in used:
+                new_obj = obj.copy()
+                new_obj.data = bpy.data.meshes.new(obj.data.name)
+                for mat in obj.data.materials:
+                    new_obj.data.materials.append(mat)
+                for col in obj.users_collection:
+                    col.objects.link(new_obj)
+                obj = new_obj
+            elif obj.data.users > 1:
+                # linked duplicates (Symmetrize) keep their own geometry
+                obj.data = obj.data.copy()
+            used.add(obj)
+            inverse = np.linalg.inv(np.array(obj.matrix_world))
+            hull_mesh(co @ inverse[:3, :3].T + inverse[:3, 3], obj.data)
+            brushes.append(obj)
+
+        for i, obj in enumerate(brushes):
+            # Remove custom properties, modifiers are baked into the hull
+            for key in list(obj.keys()):
+                if key not in ['_RNA_UI']:  # Keep Blender's internal properties
+                    del obj[key]
+            obj.modifiers.clear()
+            name = "brush" if context.scene.automerge else f"brush.{i:03d}"
+            obj.name = name
+            obj.data.name = name
             if context.scene.hintcage:
-                add_geonode_to_object(merged_obj, "ConvexHullBrush", "convex_hull")
-            
-            # Apply material if needed
+                add_geonode_to_object(obj, "ConvexHullBrush", "convex_hull")
             if context.scene.material is not None:
-                if context.scene.material.name not in merged_obj.data.materials:
-                    merged_obj.data.materials.append(context.scene.material)
-
-        # If not automerging, just rename the processed objects
-        else:
-            for i, obj in enumerate(processed_objects):
-                obj.name = f"brush.{i:03d}"
-                obj.data.name = f"brush.{i:03d}"
-
-
-        for obj in (processed_objects if not context.scene.automerge else [context.active_object]):
+                if context.scene.material.name not in obj.data.materials:
+                    obj.data.materials.append(context.scene.material)
             obj.select_set(True)
+        context.view_layer.objects.active = brushes[0]
 
+        if original_mode == 'EDIT_MESH':
+            bpy.ops.object.mode_set(mode='EDIT')
         return {'FINISHED'}
 
 class ApplyMaterial(bpy.types.Operator):
@@ -1225,24 +2846,17 @@ class Solo_brush(bpy.types.Operator):
     bl_description = "Solo da brush so ye can see"
     bl_options = {'UNDO'}
 
-    def execute(self, context):
-        # Get selected objects (not necessarily the active one)
-        global global_list_of_things
-        list_of_things = global_list_of_things
-        print(global_list_of_things)
-        if list_of_things == []:
-            if bpy.context.object.mode == 'EDIT':
-                for obj in bpy.data.objects:
-                    if obj != context.edit_object:
-                        list_of_things.append(obj)
-                        obj.hide_viewport = True
-            else:
-                self.report({'WARNING'}, "Edit mode only")
-        else:
-            for obj in list_of_things:
-                obj.hide_viewport = False
-                global_list_of_things = []
+    @classmethod
+    def poll(cls, context):
+        return context.space_data is not None and context.space_data.type == 'VIEW_3D'
 
+    def execute(self, context):
+        # Local view hides everything but the edited object with a per-base flag set in one go,
+        # and it is saved with the 3D view, so the solo survives undo and reloading the file
+        if context.space_data.local_view is None and context.mode != 'EDIT_MESH':
+            self.report({'WARNING'}, "Edit mode only")
+            return {'CANCELLED'}
+        bpy.ops.view3d.localview(frame_selected=False)
         return {'FINISHED'}
 
 class Popfront(bpy.types.Operator):
@@ -1272,6 +2886,83 @@ class Popfront_Reset(bpy.types.Operator):
             obj.show_in_front = False
         return {'FINISHED'}
 
+# Point entity dummies: object name, node group, node builder, color, origin key
+SPAWN_CLASSES = {
+    'player': ("info_player_deathmatch", "PlayerEntGen", "player", (1.0, 0.0, 0.0, 1.0), "24"),
+    'entity': ("generic_entity", "GenericEntGen", "ent", (0.0, 0.720, 0.0, 1.0), ""),
+    'item': ("generic_entity", "GenericItemGen", "item", (0.700, 0.0, 1.0, 1.0), "24"),
+}
+
+def spawn_entities(context, kind, points, grid=None, collection=None):
+    """Spawn one kind of point entity dummy at every point, snapped to grid (the scene grid
+    size by default, 0 to keep the points as they are). All dummies share the "null" mesh and
+    the node group. The new objects end up selected with the last one active; returns them."""
+    name, group, node, color, origin = SPAWN_CLASSES[kind]
+    grid = float(context.scene.grid_size) if grid is None else grid
+    points = np.asarray(points, dtype=float).reshape(-1, 3)
+    if grid > 0:
+        points = np.round(points / grid) * grid
+    collection = collection or context.collection
+    mesh = data_registry.mesh("null")
+    for obj in context.selected_objects:
+        obj.select_set(False)
+    spawned = []
+    for point in points:
+        obj = bpy.data.objects.new(name, mesh)
+        obj.location = point
+        obj.color = color
+        obj["origin"] = origin
+        collection.objects.link(obj)
+        add_geonode_to_object(obj, group, node)
+        obj.select_set(True)
+        spawned.append(obj)
+    if spawned:
+        context.view_layer.objects.active = spawned[-1]
+    return spawned
+
+def selected_vertex_points(context):
+    """World positions of the selected vertices of the active mesh"""
+    obj = context.active_object
+    if obj is None or obj.type != 'MESH':
+        return np.zeros((0, 3))
+    if obj.mode == 'EDIT':
+        obj.update_from_editmode()
+    mesh = obj.data
+    selected = np.zeros(len(mesh.vertices), dtype=bool)
+    mesh.vertices.foreach_get("select", selected)
+    matrix = np.array(obj.matrix_world)
+    return mesh_coords(mesh)[selected] @ matrix[:3, :3].T + matrix[:3, 3]
+
+class OBJECT_OT_spawn_entities(bpy.types.Operator):
+    """Spawn point entity dummies in bulk, from the 3D cursor or at the selected vertices"""
+    bl_idname = "object.spawn_entities"
+    bl_label = "Spawn Entities"
+    bl_options = {'REGISTER', 'UNDO'}
+
+    kind: EnumProperty(name="Kind", items=[
+        ('player', "Player", "info_player_deathmatch"),
+        ('entity', "Entity", "Generic point entity"),
+        ('item', "Item", "Generic item entity"),
+    ], default='entity')
+    source: EnumProperty(name="Source", items=[
+        ('CURSOR', "3D Cursor", "A row of entities starting at the 3D cursor"),
+        ('VERTICES', "Selected Vertices", "One entity per selected vertex of the active mesh"),
+    ], default='CURSOR')
+    count: IntProperty(name="Count", default=1, min=1, soft_max=256)
+    spacing: FloatProperty(name="Spacing", default=4.0, min=0.0, description="Distance between entities in a row along X")
+
+    def execute(self, context):
+        if self.source == 'VERTICES':
+            points = selected_vertex_points(context)
+            if not len(points):
+                self.report({'ERROR'}, "No vertices selected")
+                return {'CANCELLED'}
+        else:
+            points = np.array(context.scene.cursor.location) + np.outer(np.arange(self.count), (self.spacing, 0, 0))
+        spawned = spawn_entities(context, self.kind, points)
+        self.report({'INFO'}, f"Spawned {len(spawned)} {SPAWN_CLASSES[self.kind][0]}")
+        return {'FINISHED'}
+
 class CreatePlayerCube(bpy.types.Operator):
     bl_idname = "object.create_player_cube"
     bl_label = "Spawn Player Pawn"
@@ -1279,39 +2970,8 @@ class CreatePlayerCube(bpy.types.Operator):
     bl_options = {'UNDO'}
 
     def execute(self, context):
-        # Create a new bmesh
-        
-        grid_size = float(context.scene.grid_size)
-        original_grid = bpy.context.space_data.overlay.grid_scale
-
-        for data in bpy.data.meshes:
-            if data.name == "null":
-                mesh_data = data
-                break
-            else:
-                mesh_data = bpy.data.meshes.new("null")
-                bm = bmesh.new()
-                bm.to_mesh(mesh_data)
-                bm.free()
-            
-        mesh_obj = bpy.data.objects.new("info_player_deathmatch", mesh_data)
-        bpy.context.collection.objects.link(mesh_obj)
-        bpy.ops.object.select_all(action='DESELECT')
-        bpy.context.view_layer.objects.active = mesh_obj
-        
-        mesh_obj.select_set(True)
-        add_geonode_to_object(mesh_obj, "PlayerEntGen", "player")
-        
-        # Set the object color to red
-        mesh_obj.color = (1.0, 0.0, 0.0, 1.0)
-        mesh_obj["origin"] = "24"
-        bpy.ops.view3d.snap_selected_to_cursor(use_offset=False)
-        
-        bpy.context.space_data.overlay.grid_scale = grid_size
-        bpy.ops.view3d.snap_selected_to_grid()
-        bpy.context.space_data.overlay.grid_scale = original_grid
-
-        return {'FINISHED'}
+        spawn_entities(context, 'player', [context.scene.cursor.location])
+        return {'FINISHED'}
 
 class CreateEntityCube(bpy.types.Operator):
     bl_idname = "object.create_entity_cube"
@@ -1320,38 +2980,7 @@ class CreateEntityCube(bpy.types.Operator):
     bl_options = {'UNDO'}
 
     def execute(self, context):
-        # Create a new bmesh
-        
-        grid_size = float(context.scene.grid_size)
-        original_grid = bpy.context.space_data.overlay.grid_scale
-
-        for data in bpy.data.meshes:
-            if data.name == "null":
-                mesh_data = data
-                break
-            else:
-                mesh_data = bpy.data.meshes.new("null")
-                bm = bmesh.new()
-                bm.to_mesh(mesh_data)
-                bm.free()
-            
-        mesh_obj = bpy.data.objects.new("generic_entity", mesh_data)
-        bpy.context.collection.objects.link(mesh_obj)
-        bpy.ops.object.select_all(action='DESELECT')
-        bpy.context.view_layer.objects.active = mesh_obj
-        
-        mesh_obj.select_set(True)
-        add_geonode_to_object(mesh_obj, "GenericEntGen", "ent")
-       
-        # Set the object color to red
-        mesh_obj.color = (0.0, 0.720, 0.0, 1.0)
-        mesh_obj["origin"] = ""
-        bpy.ops.view3d.snap_selected_to_cursor(use_offset=False)
-        
-        bpy.context.space_data.overlay.grid_scale = grid_size
-        bpy.ops.view3d.snap_selected_to_grid()
-        bpy.context.space_data.overlay.grid_scale = original_grid
-
+        spawn_entities(context, 'entity', [context.scene.cursor.location])
         return {'FINISHED'}
 
 class CreateItemCube(bpy.types.Operator):
@@ -1361,38 +2990,7 @@ class CreateItemCube(bpy.types.Operator):
     bl_options = {'UNDO'}
 
     def execute(self, context):
-        # Create a new bmesh
-        
-        grid_size = float(context.scene.grid_size)
-        original_grid = bpy.context.space_data.overlay.grid_scale
-
-        for data in bpy.data.meshes:
-            if data.name == "null":
-                mesh_data = data
-                break
-            else:
-                mesh_data = bpy.data.meshes.new("null")
-                bm = bmesh.new()
-                bm.to_mesh(mesh_data)
-                bm.free()
-            
-        mesh_obj = bpy.data.objects.new("generic_entity", mesh_data)
-        bpy.context.collection.objects.link(mesh_obj)
-        bpy.ops.object.select_all(action='DESELECT')
-        bpy.context.view_layer.objects.active = mesh_obj
-        
-        mesh_obj.select_set(True)
-        add_geonode_to_object(mesh_obj, "GenericItemGen", "item")
-       
-        # Set the object color to red
-        mesh_obj.color = (0.700, 0.0, 1.0, 1.0)
-        mesh_obj["origin"] = "24"
-        bpy.ops.view3d.snap_selected_to_cursor(use_offset=False)
-        
-        bpy.context.space_data.overlay.grid_scale = grid_size
-        bpy.ops.view3d.snap_selected_to_grid()
-        bpy.context.space_data.overlay.grid_scale = original_grid
-
+        spawn_entities(context, 'item', [context.scene.cursor.location])
         return {'FINISHED'}
 
 class CreateSkyBox(bpy.types.Operator):
@@ -1423,10 +3021,425 @@ class CreateSkyBox(bpy.types.Operator):
 
         return {'FINISHED'}
 
+TARGET_KEYS = ('target', 'target2')
+NAME_KEYS = ('targetname', 'targetname2')
+TEAM_KEYS = ('team',)
+LINK_KEYS = TARGET_KEYS + NAME_KEYS + TEAM_KEYS
+
+def has_link_value(owner, keys, value):
+    return any(key in owner and owner[key] == value for key in keys)
+
+def select_link_owners(owners):
+    """Select objects, and the objects of collections, return how many"""
+    count = 0
+    for owner in owners:
+        if isinstance(owner, bpy.types.Collection):
+            for obj in owner.objects:
+                if obj.type in {'MESH', 'EMPTY'}:
+                    obj.select_set(True)
+                    count += 1
+        else:
+            owner.select_set(True)
+            count += 1
+    return count
+
+class LinkIndex:
+    """Reverse index of the entity link properties: key -> value -> owners.
+
+    Owners are ('OBJECT' | 'COLLECTION', name) pairs, resolved when looked up, so the
+    index survives undo. Handlers and the property operator keep it current. Lookups
+    verify what they return: a stale entry (renamed or deleted owner) or finding nothing
+    triggers a rebuild. An owner the handlers missed next to ones that are indexed is
+    still left out until the next rebuild.
+    """
+    def __init__(self):
+        self.index = {key: {} for key in LINK_KEYS}
+        self.owned = {}
+        self.valid = False
+        self.version = 0
+        self.summary_cache = (None, [])
+
+    def invalidate(self):
+        self.valid = False
+        self.version += 1
+
+    def ensure(self):
+        if not self.valid:
+            self.index = {key: {} for key in LINK_KEYS}
+            self.owned = {}
+            for obj in bpy.data.objects:
+                self.update(obj)
+            for col in bpy.data.collections:
+                self.update(col)
+            self.valid = True
+            self.version += 1
+
+    def update(self, owner):
+        """Re-read the link properties of one object or collection"""
+        if isinstance(owner, bpy.types.Object):
+            ref = ('OBJECT', owner.name)
+        elif isinstance(owner, bpy.types.Collection):
+            ref = ('COLLECTION', owner.name)
+        else:
+            return
+        old = self.owned.pop(ref, {})
+        for key, value in old.items():
+            owners = self.index[key][value]
+            owners.discard(ref)
+            if not owners:
+                del self.index[key][value]
+        new = {key: owner[key] for key in LINK_KEYS if key in owner and isinstance(owner[key], (int, float, str))}
+        if new:
+            self.owned[ref] = new
+            for key, value in new.items():
+                self.index[key].setdefault(value, set()).add(ref)
+        if new != old:
+            self.version += 1
+
+    def resolve(self, ref):
+        kind, name = ref
+        return (bpy.data.objects if kind == 'OBJECT' else bpy.data.collections).get(name)
+
+    def lookup(self, keys, value, retry=True):
+        """Objects and collections with any of keys set to value"""
+        self.ensure()
+        found = []
+        for key in keys:
+            for ref in self.index[key].get(value, ()):
+                owner = self.resolve(ref)
+                if owner is None or owner.get(key) != value:
+                    if retry:
+                        self.invalidate()
+                        return self.lookup(keys, value, False)
+                    continue
+                if owner not in found:
+                    found.append(owner)
+        if not found and retry:
+            # the value may have been set without the handlers seeing it
+            self.invalidate()
+            return self.lookup(keys, value, False)
+        return found
+
+    def summary(self):
+        """(value, senders, receivers, team members) per link value, cached per index version"""
+        self.ensure()
+        if self.summary_cache[0] != self.version:
+            def count(keys, value):
+                return len({ref for key in keys for ref in self.index[key].get(value, ())})
+            values = {value for key in LINK_KEYS for value in self.index[key]}
+            rows = [(value, count(TARGET_KEYS, value), count(NAME_KEYS, value), count(TEAM_KEYS, value))
+                    for value in sorted(values, key=str)]
+            self.summary_cache = (self.version, rows)
+        return self.summary_cache[1]
+
+link_index = LinkIndex()
+
+@persistent
+def link_index_depsgraph(scene, depsgraph):
+    if not link_index.valid:
+        return
+    for update in depsgraph.updates:
+        if isinstance(update.id, (bpy.types.Object, bpy.types.Collection)):
+            link_index.update(update.id.original)
+
+@persistent
+def link_index_reset(*args):
+    link_index.invalidate()
+
+class OBJECT_OT_select_entity_links(bpy.types.Operator):
+    """Select every entity using this target, targetname or team value"""
+    bl_idname = "object.select_entity_links"
+    bl_label = "Select Entity Links"
+    bl_options = {'UNDO'}
+
+    value: StringProperty()
+
+    def execute(self, context):
+        # values may be numbers, the panel passes them as text
+        value = next((row[0] for row in link_index.summary() if str(row[0]) == self.value), self.value)
+        count = select_link_owners(link_index.lookup(LINK_KEYS, value))
+        self.report({'INFO'}, f"Selected {count} objects linked by '{self.value}'")
+        return {'FINISHED'}
+
+class LinkGraph:
+    """Whole-scene entity link graph, built in one pass over the objects as get_class resolves
+    them, so a brush_ent_group collection or worldspawn is one entity however many brushes it has.
+
+    check() returns a list of (issue, value, entities) with issue one of 'dangling'
+    (target nobody is named), 'unreferenced' (targetname nobody targets), 'self' and
+    'cycle'. The result is cached until the link index changes or a collection or the
+    scene is updated.
+    """
+    def __init__(self):
+        self.structure = 0
+        self.key = None
+        self.issues = []
+        self.entities = []
+
+    def build(self, context):
+        entities = []
+        seen = {}
+        senders = {}
+        receivers = {}
+        for obj in context.scene.objects:
+            owner, kind = get_class(obj, False, context)
+            if kind in ('excluded', 'None', 'brush') or owner in seen:
+                continue
+            seen[owner] = i = len(entities)
+            entities.append(owner)
+            for keys, found in ((TARGET_KEYS, senders), (NAME_KEYS, receivers)):
+                for key in keys:
+                    if key in owner:
+                        value = owner[key]
+                        if isinstance(value, (int, float, str)):
+                            found.setdefault(value, []).append(i)
+        return entities, senders, receivers
+
+    def check(self, context):
+        link_index.ensure() # keeps link_index.version moving while properties change
+        key = (link_index.version, self.structure, context.scene.name)
+        if key == self.key:
+            return self.issues
+        entities, senders, receivers = self.build(context)
+        issues = []
+        edges = [[] for _ in entities]
+        for value, sources in senders.items():
+            targets = receivers.get(value)
+            if targets is None:
+                issues.append(('dangling', value, sources))
+                continue
+            for source in sources:
+                if source in targets:
+                    issues.append(('self', value, [source]))
+                edges[source].extend(target for target in targets if target != source)
+        for value, targets in receivers.items():
+            if value not in senders:
+                issues.append(('unreferenced', value, targets))
+        for component in strong_components(edges):
+            if len(component) > 1:
+                values = {str(entities[i][k]) for i in component for k in TARGET_KEYS if k in entities[i]}
+                issues.append(('cycle', ", ".join(sorted(values)), component))
+        self.entities = [entity_ref(owner) for owner in entities]
+        self.issues = [(issue, value, [self.entities[i] for i in members]) for issue, value, members in issues]
+        self.key = key
+        return self.issues
+
+def entity_ref(owner):
+    if isinstance(owner, bpy.types.Scene):
+        return ('SCENE', owner.name)
+    if isinstance(owner, bpy.types.Collection):
+        return ('COLLECTION', owner.name)
+    return ('OBJECT', owner.name)
+
+def strong_components(edges):
+    """Tarjan's strongly connected components, iterative so long chains don't hit the recursion limit"""
+    index = [-1] * len(edges)
+    low = [0] * len(edges)
+    on_stack = [False] * len(edges)
+    stack = []
+    components = []
+    counter = 0
+    for root in range(len(edges)):
+        if index[root] >= 0 or not edges[root]:
+            continue
+        work = [(root, 0)]
+        while work:
+            node, child = work.pop()
+            if child == 0:
+                index[node] = low[node] = counter
+                counter += 1
+                stack.append(node)
+                on_stack[node] = True
+            recurse = False
+            for i in range(child, len(edges[node])):
+                nxt = edges[node][i]
+                if index[nxt] < 0:
+                    work.append((node, i + 1))
+                    work.append((nxt, 0))
+                    recurse = True
+                    break
+                if on_stack[nxt]:
+                    low[node] = min(low[node], index[nxt])
+            if recurse:
+                continue
+            if low[node] == index[node]:
+                component = []
+                while True:
+                    member = stack.pop()
+                    on_stack[member] = False
+                    component.append(member)
+                    if member == node:
+                        break
+                components.append(component)
+            if work:
+                parent = work[-1][0]
+                low[parent] = min(low[parent], low[node])
+    return components
+
+link_graph = LinkGraph()
+
+@persistent
+def link_graph_depsgraph(scene, depsgraph):
+    # object link properties are tracked by link_index, membership and worldspawn keys are not
+    if any(isinstance(update.id, (bpy.types.Collection, bpy.types.Scene)) for update in depsgraph.updates):
+        link_graph.structure += 1
+
+class OBJECT_OT_check_entity_links(bpy.types.Operator):
+    """Find targets nobody is named, targetnames nobody targets, self-references and target cycles"""
+    bl_idname = "object.check_entity_links"
+    bl_label = "Check Entity Links"
+
+    def execute(self, context):
+        start = time.perf_counter()
+        issues = link_graph.check(context)
+        context.scene.tc_show_link_issues = True
+        self.report({'INFO'}, f"{len(issues)} link issues in {len(link_graph.entities)} entities ({time.perf_counter() - start:.3f} s)")
+        return {'FINISHED'}
+
+class OBJECT_OT_select_link_issue(bpy.types.Operator):
+    """Select the entities of this link issue"""
+    bl_idname = "object.select_link_issue"
+    bl_label = "Select Link Issue"
+    bl_options = {'UNDO'}
+
+    index: IntProperty()
+
+    def execute(self, context):
+        if not 0 <= self.index < len(link_graph.issues):
+            return {'CANCELLED'}
+        for obj in context.selected_objects:
+            obj.select_set(False)
+        owners = [link_index.resolve(ref) for ref in link_graph.issues[self.index][2] if ref[0] != 'SCENE']
+        count = select_link_owners(owner for owner in owners if owner)
+        self.report({'INFO'}, f"Selected {count} objects")
+        return {'FINISHED'}
+
+DELETE = object() # marks a staged property deletion
+
+def infer_value(text):
+    """Property value typed from the textbox: int, float, bool or string"""
+    if text.isdigit():
+        return int(text)
+    elif text.replace('.', '', 1).isdigit() and text.count('.') < 2:
+        return float(text)
+    elif text.lower() in ('true', 'false'):
+        return text.lower() == 'true'
+    return text
+
+def parse_value(text):
+    """('ref', key) for (key), else ('value', typed value)"""
+    if text.startswith('(') and text.endswith(')'):
+        return ('ref', text[1:-1].strip())
+    return ('value', infer_value(text))
+
+def parse_prop_commands(text):
+    """Parse the property textbox into a list of (command, *args).
+
+    Whole-text commands (target->, get, ?, ??, !batch) give a single operation;
+    otherwise every line is a set, del or del all. Lines that don't parse are skipped,
+    like they always were."""
+    lower = text.lower()
+    for send, name in (('target', 'targetname'), ('target2', 'targetname2')):
+        for arrow in ('->', '<-'):
+            if text.startswith(send + arrow):
+                return [('link', send, name, arrow, text.split(arrow, 1)[1].strip())]
+    if lower.startswith('get '):
+        return [('get', text[4:].strip())]
+    if lower.startswith('? '):
+        return [('query', 'refs', text[2:].strip())]
+    if lower.startswith('?? '):
+        return [('query', 'same', text[3:].strip())]
+    if text.startswith('!') and (',' in text or ':' in text):
+        key, value = text[1:].split(',' if ',' in text else ':', 1)
+        return [('batch', key.strip(), parse_value(value.strip()))]
+    commands = []
+    for line in text.split('\n'):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        if line.lower() == 'del all':
+            commands.append(('del_all',))
+        elif line.lower().startswith('del '):
+            keys = [key.strip() for key in line[4:].split(',') if key.strip()]
+            if keys:
+                commands.append(('del', keys))
+        elif ',' in line or ':' in line:
+            key, value = line.split(',' if ',' in line else ':', 1)
+            if key.strip():
+                commands.append(('set', key.strip(), parse_value(value.strip())))
+    return commands
+
+def custom_keys(keys, owner):
+    return [key for key in keys if not key.startswith(('_', 'cycles_', 'rna_')) and key not in owner.bl_rna.properties]
+
+class PropertyTransaction:
+    """Custom property edits staged per owner (object, collection or scene), read back
+    through get/has so later commands see earlier ones, and applied all at once by commit.
+    A failing write rolls everything back."""
+    def __init__(self):
+        self.pending = {}
+
+    def has(self, owner, key):
+        value = self.pending.get(owner, {}).get(key)
+        if value is None:
+            return key in owner
+        return value is not DELETE
+
+    def get(self, owner, key):
+        value = self.pending.get(owner, {}).get(key)
+        if value is None:
+            return owner.get(key)
+        return None if value is DELETE else value
+
+    def keys(self, owner):
+        changes = self.pending.get(owner, {})
+        keys = list(owner.keys()) + [key for key in changes if key not in owner]
+        return [key for key in keys if changes.get(key) is not DELETE]
+
+    def set(self, owner, key, value):
+        self.pending.setdefault(owner, {})[key] = value
+
+    def delete(self, owner, key):
+        self.pending.setdefault(owner, {})[key] = DELETE
+
+    def commit(self):
+        applied = []
+        try:
+            for owner, changes in self.pending.items():
+                for key, value in changes.items():
+                    applied.append((owner, key, owner[key] if key in owner else DELETE))
+                    if value is not DELETE:
+                        owner[key] = value
+                    elif key in owner:
+                        del owner[key]
+        except Exception:
+            for owner, key, value in reversed(applied):
+                if value is not DELETE:
+                    owner[key] = value
+                elif key in owner:
+                    del owner[key]
+            raise
+        for owner in self.pending:
+            link_index.update(owner)
+        panel_model.invalidate()
+        return len(self.pending)
+
+def entity_targets(objects, context):
+    """Distinct (entity, objects) for objects, get_class called once per object"""
+    targets = {}
+    for obj in objects:
+        try:
+            owner = get_class(obj, False, context)[0]
+        except Exception:
+            continue
+        targets.setdefault(owner, []).append(obj)
+    return targets
+
 class OBJECT_OT_AddPropertyFromText(bpy.types.Operator):
     bl_idname = "object.add_property_from_text"
     bl_label = "Add/Update Property"
     bl_description = "Add or update property from text input (format: propname, value)"
+    bl_options = {'UNDO'}
     
     def execute(self, context):
         try:
@@ -1440,624 +3453,152 @@ class OBJECT_OT_AddPropertyFromText(bpy.types.Operator):
             self.report({'ERROR'}, "Text input is empty")
             return {'CANCELLED'}
         
-        # Check for target assignment syntax
-        if text_input.startswith('target->') or text_input.startswith('target<-'):
-            return self.handle_target_assignment(context, text_input, active_obj)
-        
-        if text_input.startswith('target2->') or text_input.startswith('target2<-'):
-            return self.handle_target_assignment2(context, text_input, active_obj)
-        
-        # Check if the entire input is just a copy command
-        if text_input.lower().startswith('get '):
-            prop_name = text_input[4:].strip()
+        commands = parse_prop_commands(text_input)
+        if commands and commands[0][0] == 'get':
+            prop_name = commands[0][1]
             if prop_name and prop_name in active_obj:
-                value = str(active_obj[prop_name])
-                context.scene.text_of_prop = value
+                context.scene.text_of_prop = str(active_obj[prop_name])
                 self.report({'INFO'}, f"Copied {prop_name} to textbox")
                 return {'FINISHED'}
-            else:
-                self.report({'ERROR'}, f"Property '{prop_name}' not found")
-                return {'CANCELLED'}
-            
-        if text_input.lower().startswith('? '):
-            # Single ? command - find references
-            search_value = text_input[2:].strip()
-            
-            if not search_value:
-                self.report({'ERROR'}, "No value specified")
-                return {'CANCELLED'}
-            
-            if not active_obj:
-                self.report({'ERROR'}, "No active object selected")
-                return {'CANCELLED'}
-            
-            selected_count = 0
-            
-            # Check what type of property the value belongs to on active object
-            if ('target' in active_obj and active_obj['target'] == search_value) or \
-            ('target2' in active_obj and active_obj['target2'] == search_value):
-                # Value is a target/target2 - find objects/collections that are targeted (targetname/targetname2)
-                for obj in bpy.data.objects:
-                    if ('targetname' in obj and obj['targetname'] == search_value) or \
-                    ('targetname2' in obj and obj['targetname2'] == search_value):
-                        obj.select_set(True)
-                        selected_count += 1
-                
-                # Also check collections
-                for coll in bpy.data.collections:
-                    if ('targetname' in coll and coll['targetname'] == search_value) or \
-                    ('targetname2' in coll and coll['targetname2'] == search_value):
-                        # Select all objects in this collection
-                        for obj in coll.objects:
-                            if obj.type in {'MESH', 'EMPTY'}:
-                                obj.select_set(True)
-                                selected_count += 1
-                
-                self.report({'INFO'}, f"Selected {selected_count} objects targeted by '{search_value}'")
-            
-            elif ('targetname' in active_obj and active_obj['targetname'] == search_value) or \
-                ('targetname2' in active_obj and active_obj['targetname2'] == search_value):
-                # Value is a targetname/targetname2 - find objects/collections that target them (target/target2)
-                for obj in bpy.data.objects:
-                    if ('target' in obj and obj['target'] == search_value) or \
-                    ('target2' in obj and obj['target2'] == search_value):
-                        obj.select_set(True)
-                        selected_count += 1
-                
-                # Also check collections
-                for coll in bpy.data.collections:
-                    if ('target' in coll and coll['target'] == search_value) or \
-                    ('target2' in coll and coll['target2'] == search_value):
-                        # Select all objects in this collection
-                        for obj in coll.objects:
-                            if obj.type in {'MESH', 'EMPTY'}:
-                                obj.select_set(True)
-                                selected_count += 1
-                
-                self.report({'INFO'}, f"Selected {selected_count} objects targeting '{search_value}'")
-            
-            else:
-                # Check if the value matches any property on active object's collections
-                found_in_collection = False
-                for coll in active_obj.users_collection:
-                    if ('target' in coll and coll['target'] == search_value) or \
-                    ('target2' in coll and coll['target2'] == search_value):
-                        # Find objects/collections with targetname/targetname2 matching this value
-                        for obj in bpy.data.objects:
-                            if ('targetname' in obj and obj['targetname'] == search_value) or \
-                            ('targetname2' in obj and obj['targetname2'] == search_value):
-                                obj.select_set(True)
-                                selected_count += 1
-                        
-                        for coll2 in bpy.data.collections:
-                            if ('targetname' in coll2 and coll2['targetname'] == search_value) or \
-                            ('targetname2' in coll2 and coll2['targetname2'] == search_value):
-                                # Select all objects in this collection
-                                for obj in coll2.objects:
-                                    if obj.type in {'MESH', 'EMPTY'}:
-                                        obj.select_set(True)
-                                        selected_count += 1
-                        
-                        found_in_collection = True
-                        self.report({'INFO'}, f"Selected {selected_count} objects targeted by '{search_value}' (from collection)")
-                        break
-                    
-                    elif ('targetname' in coll and coll['targetname'] == search_value) or \
-                        ('targetname2' in coll and coll['targetname2'] == search_value):
-                        # Find objects/collections with target/target2 matching this value
-                        for obj in bpy.data.objects:
-                            if ('target' in obj and obj['target'] == search_value) or \
-                            ('target2' in obj and obj['target2'] == search_value):
-                                obj.select_set(True)
-                                selected_count += 1
-                        
-                        for coll2 in bpy.data.collections:
-                            if ('target' in coll2 and coll2['target'] == search_value) or \
-                            ('target2' in coll2 and coll2['target2'] == search_value):
-                                # Select all objects in this collection
-                                for obj in coll2.objects:
-                                    if obj.type in {'MESH', 'EMPTY'}:
-                                        obj.select_set(True)
-                                        selected_count += 1
-                        
-                        found_in_collection = True
-                        self.report({'INFO'}, f"Selected {selected_count} objects targeting '{search_value}' (from collection)")
-                        break
-                
-                if not found_in_collection:
-                    self.report({'ERROR'}, f"Value '{search_value}' not found in target properties of the active object or its collections")
-                    return {'CANCELLED'}
-            
-            return {'FINISHED'}
-
-        elif text_input.lower().startswith('?? '):
+            self.report({'ERROR'}, f"Property '{prop_name}' not found")
+            return {'CANCELLED'}
+        if commands and commands[0][0] == 'query':
+            if commands[0][1] == 'refs':
+                # Single ? command - find references
+                return self.query_links(active_obj, commands[0][2], (
+                    (TARGET_KEYS, NAME_KEYS, "targeted by"),
+                    (NAME_KEYS, TARGET_KEYS, "targeting"),
+                ), "target properties")
             # Double ?? command - find objects with same property values
-            search_value = text_input[3:].strip()
-            
-            if not search_value:
-                self.report({'ERROR'}, "No value specified")
-                return {'CANCELLED'}
-            
-            if not active_obj:
-                self.report({'ERROR'}, "No active object selected")
-                return {'CANCELLED'}
-            
-            selected_count = 0
-            
-            # Check what type of property the value belongs to on active object
-            if 'team' in active_obj and active_obj['team'] == search_value:
-                # Value is a team - find all objects/collections with same team
-                for obj in bpy.data.objects:
-                    if 'team' in obj and obj['team'] == search_value:
-                        obj.select_set(True)
-                        selected_count += 1
-                
-                for coll in bpy.data.collections:
-                    if 'team' in coll and coll['team'] == search_value:
-                        # Select all objects in this collection
-                        for obj in coll.objects:
-                            if obj.type in {'MESH', 'EMPTY'}:
-                                obj.select_set(True)
-                                selected_count += 1
-                
-                self.report({'INFO'}, f"Selected {selected_count} objects with team '{search_value}'")
-            
-            elif ('target' in active_obj and active_obj['target'] == search_value) or \
-                ('target2' in active_obj and active_obj['target2'] == search_value):
-                # Value is a target/target2 - find all objects/collections with same target/target2
-                for obj in bpy.data.objects:
-                    if ('target' in obj and obj['target'] == search_value) or \
-                    ('target2' in obj and obj['target2'] == search_value):
-                        obj.select_set(True)
-                        selected_count += 1
-                
-                for coll in bpy.data.collections:
-                    if ('target' in coll and coll['target'] == search_value) or \
-                    ('target2' in coll and coll['target2'] == search_value):
-                        # Select all objects in this collection
-                        for obj in coll.objects:
-                            if obj.type in {'MESH', 'EMPTY'}:
-                                obj.select_set(True)
-                                selected_count += 1
-                
-                self.report({'INFO'}, f"Selected {selected_count} objects with target/target2 '{search_value}'")
-            
-            elif ('targetname' in active_obj and active_obj['targetname'] == search_value) or \
-                ('targetname2' in active_obj and active_obj['targetname2'] == search_value):
-                # Value is a targetname/targetname2 - find all objects/collections with same targetname/targetname2
-                for obj in bpy.data.objects:
-                    if ('targetname' in obj and obj['targetname'] == search_value) or \
-                    ('targetname2' in obj and obj['targetname2'] == search_value):
-                        obj.select_set(True)
-                        selected_count += 1
-                
-                for coll in bpy.data.collections:
-                    if ('targetname' in coll and coll['targetname'] == search_value) or \
-                    ('targetname2' in coll and coll['targetname2'] == search_value):
-                        # Select all objects in this collection
-                        for obj in coll.objects:
-                            if obj.type in {'MESH', 'EMPTY'}:
-                                obj.select_set(True)
-                                selected_count += 1
-                
-                self.report({'INFO'}, f"Selected {selected_count} objects with targetname/targetname2 '{search_value}'")
-            
+            return self.query_links(active_obj, commands[0][2], (
+                (TEAM_KEYS, TEAM_KEYS, "with team"),
+                (TARGET_KEYS, TARGET_KEYS, "with target/target2"),
+                (NAME_KEYS, NAME_KEYS, "with targetname/targetname2"),
+            ), "properties")
+
+        # Stage everything first so a bad command changes nothing
+        transaction = PropertyTransaction()
+        clear_input = False
+        messages = []
+        for command, *args in commands:
+            if command == 'link':
+                result = self.stage_link(context, transaction, *args)
+            elif command == 'batch':
+                result = self.stage_batch(context, transaction, active_obj, *args)
+            elif command == 'del_all':
+                custom_props = custom_keys(transaction.keys(active_obj), active_obj)
+                for prop_name in custom_props:
+                    transaction.delete(active_obj, prop_name)
+                result = (({'INFO'}, f"Deleted all {len(custom_props)} custom properties") if custom_props
+                          else ({'WARNING'}, "No custom properties to delete"))
+            elif command == 'del':
+                deleted = [key for key in args[0] if transaction.has(active_obj, key)]
+                for prop_name in deleted:
+                    transaction.delete(active_obj, prop_name)
+                result = (({'INFO'}, f"Deleted {len(deleted)} properties") if deleted
+                          else ({'WARNING'}, "No matching properties found to delete"))
             else:
-                # Check if the value matches any property on active object's collections
-                found_in_collection = False
-                for coll in active_obj.users_collection:
-                    if 'team' in coll and coll['team'] == search_value:
-                        # Find all objects/collections with same team
-                        for obj in bpy.data.objects:
-                            if 'team' in obj and obj['team'] == search_value:
-                                obj.select_set(True)
-                                selected_count += 1
-                        
-                        for coll2 in bpy.data.collections:
-                            if 'team' in coll2 and coll2['team'] == search_value:
-                                # Select all objects in this collection
-                                for obj in coll2.objects:
-                                    if obj.type in {'MESH', 'EMPTY'}:
-                                        obj.select_set(True)
-                                        selected_count += 1
-                        
-                        found_in_collection = True
-                        self.report({'INFO'}, f"Selected {selected_count} objects with team '{search_value}' (from collection)")
-                        break
-                    
-                    elif ('target' in coll and coll['target'] == search_value) or \
-                        ('target2' in coll and coll['target2'] == search_value):
-                        # Find all objects/collections with same target/target2
-                        for obj in bpy.data.objects:
-                            if ('target' in obj and obj['target'] == search_value) or \
-                            ('target2' in obj and obj['target2'] == search_value):
-                                obj.select_set(True)
-                                selected_count += 1
-                        
-                        for coll2 in bpy.data.collections:
-                            if ('target' in coll2 and coll2['target'] == search_value) or \
-                            ('target2' in coll2 and coll2['target2'] == search_value):
-                                # Select all objects in this collection
-                                for obj in coll2.objects:
-                                    if obj.type in {'MESH', 'EMPTY'}:
-                                        obj.select_set(True)
-                                        selected_count += 1
-                        
-                        found_in_collection = True
-                        self.report({'INFO'}, f"Selected {selected_count} objects with target/target2 '{search_value}' (from collection)")
-                        break
-                    
-                    elif ('targetname' in coll and coll['targetname'] == search_value) or \
-                        ('targetname2' in coll and coll['targetname2'] == search_value):
-                        # Find all objects/collections with same targetname/targetname2
-                        for obj in bpy.data.objects:
-                            if ('targetname' in obj and obj['targetname'] == search_value) or \
-                            ('targetname2' in obj and obj['targetname2'] == search_value):
-                                obj.select_set(True)
-                                selected_count += 1
-                        
-                        for coll2 in bpy.data.collections:
-                            if ('targetname' in coll2 and coll2['targetname'] == search_value) or \
-                            ('targetname2' in coll2 and coll2['targetname2'] == search_value):
-                                # Select all objects in this collection
-                                for obj in coll2.objects:
-                                    if obj.type in {'MESH', 'EMPTY'}:
-                                        obj.select_set(True)
-                                        selected_count += 1
-                        
-                        found_in_collection = True
-                        self.report({'INFO'}, f"Selected {selected_count} objects with targetname/targetname2 '{search_value}' (from collection)")
-                        break
-                
-                if not found_in_collection:
-                    self.report({'ERROR'}, f"Value '{search_value}' not found in properties of the active object or its collections")
-                    return {'CANCELLED'}
-            
-            return {'FINISHED'}
-                                
-        # Process each line for other commands
-        for line in text_input.split('\n'):
-            line = line.strip()
-            if not line or line.startswith('#'):  # Skip empty lines and comments
-                continue
-            
-            # Check for delete all command
-            if line.lower().strip() == 'del all':
-                # Get all custom property keys
-                custom_props = [key for key in active_obj.keys() 
-                               if not key.startswith(('_', 'cycles_', 'rna_')) and key not in active_obj.bl_rna.properties]
-                
-                if custom_props:
-                    # Delete all custom properties
-                    for prop_name in custom_props:
-                        del active_obj[prop_name]
-                    self.report({'INFO'}, f"Deleted all {len(custom_props)} custom properties")
-                else:
-                    self.report({'WARNING'}, "No custom properties to delete")
-                continue
-            
-            # Check for delete command - handle multiple properties separated by commas
-            if line.lower().startswith('del '):
-                prop_names_str = line[4:].strip()
-                if prop_names_str:
-                    # Split by comma and remove any empty strings
-                    prop_names = [name.strip() for name in prop_names_str.split(',') if name.strip()]
-                    
-                    deleted_count = 0
-                    for prop_name in prop_names:
-                        if prop_name in active_obj:
-                            del active_obj[prop_name]
-                            deleted_count += 1
-                    
-                    if deleted_count > 0:
-                        self.report({'INFO'}, f"Deleted {deleted_count} properties")
-                    else:
-                        self.report({'WARNING'}, "No matching properties found to delete")
-                continue
-            
-
-
-            if text_input.startswith('!') and (',' in text_input or ':' in text_input):
-                # Batch property assignment: !prop, value
-                parts = text_input[1:].split(',', 1) if ',' in text_input else text_input[1:].split(':', 1)
-                
-                if len(parts) != 2:
-                    self.report({'ERROR'}, "Invalid format. Use: !property, value")
-                    return {'CANCELLED'}
-                
-                prop_name = parts[0].strip()
-                prop_value_str = parts[1].strip()
-                
-                if not prop_name:
-                    self.report({'ERROR'}, "No property name specified")
-                    return {'CANCELLED'}
-                
-                selected_objects = context.selected_objects
-                if not selected_objects:
-                    self.report({'ERROR'}, "No objects selected")
-                    return {'CANCELLED'}
-                
-                processed_count = 0
-                
-                # Parse the property value (supporting references and math operations)
-                try:
-                    # Check if the value is a reference to another property
-                    if prop_value_str.startswith('(') and prop_value_str.endswith(')'):
-                        # Reference syntax: !team, (other_prop)
-                        ref_content = prop_value_str[1:-1].strip()
-                        
-                        # Get reference value from active object (or its class)
-                        ref_value = None
-                        active_class_obj, _ = get_class(context.active_object, False, context)
-                        
-                        if ref_content in active_class_obj:
-                            ref_value = active_class_obj[ref_content]
-                        else:
-                            # Try to find in collections or scene
-                            for coll in context.active_object.users_collection:
-                                if ref_content in coll:
-                                    ref_value = coll[ref_content]
-                                    break
-                            else:
-                                # Try scene
-                                if ref_content in context.scene:
-                                    ref_value = context.scene[ref_content]
-                        
-                        if ref_value is not None:
-                            final_value = ref_value
-                        else:
-                            self.report({'ERROR'}, f"Referenced property '{ref_content}' not found")
-                            return {'CANCELLED'}
-                            
-                    else:
-                        # Regular value assignment with type conversion
-                        if prop_value_str.isdigit():
-                            final_value = int(prop_value_str)
-                        elif prop_value_str.replace('.', '', 1).isdigit() and prop_value_str.count('.') < 2:
-                            final_value = float(prop_value_str)
-                        elif prop_value_str.lower() in ('true', 'false'):
-                            final_value = prop_value_str.lower() == 'true'
-                        else:
-                            final_value = prop_value_str
-                            
-                except Exception as e:
-                    self.report({'ERROR'}, f"Error parsing value: {str(e)}")
-                    return {'CANCELLED'}
-                
-                # Apply the property to all selected objects (using their appropriate class)
-                for obj in selected_objects:
-                    try:
-                        # Get the appropriate class (object, collection, or scene) for this object
-                        class_obj, _ = get_class(obj, False, context)
-                        
-                        # Set the property
-                        class_obj[prop_name] = final_value
-                        processed_count += 1
-                        
-                    except Exception as e:
-                        self.report({'WARNING'}, f"Could not set property on {obj.name}: {str(e)}")
-                
-                # Clear the input field
-                context.scene.text_of_prop = ""
-                
-                # Report results
-                self.report({'INFO'}, f"Set {prop_name} on {processed_count} objects/collections")
-                return {'FINISHED'}
-
-
-            # Parse property assignment
-            if ',' in line:
-                parts = line.split(',', 1)
-            elif ':' in line:
-                parts = line.split(':', 1)
-            else:
-                continue
-
-            if len(parts) != 2:
-                continue
-
-            prop_name = parts[0].strip()
-            prop_value_str = parts[1].strip()
-
-            if not prop_name:
-                continue
-
-            # Check if the value is a reference to another property (enclosed in parentheses)
-            if prop_value_str.startswith('(') and prop_value_str.endswith(')'):
-                # Extract the referenced property name
-                ref_prop_name = prop_value_str[1:-1].strip()
-                
-                # Get the value from the referenced property
-                try:
-                    if ref_prop_name in active_obj:
-                        # Copy value from another property on the same object
-                        active_obj[prop_name] = active_obj[ref_prop_name]
-                    else:
-                        # Try to find the referenced property in collections
-                        found = False
-                        for coll in active_obj.users_collection:
-                            if ref_prop_name in coll:
-                                active_obj[prop_name] = coll[ref_prop_name]
-                                found = True
-                                break
-                        
-                        if not found:
-                            self.report({'WARNING'}, f"Referenced property '{ref_prop_name}' not found")
-                except Exception as e:
-                    self.report({'ERROR'}, f"Error copying property value: {str(e)}")
-
-            else:
-                # Regular value assignment
-                try:
-                    if prop_value_str.isdigit():
-                        active_obj[prop_name] = int(prop_value_str)
-                    elif prop_value_str.replace('.', '', 1).isdigit() and prop_value_str.count('.') < 2:
-                        active_obj[prop_name] = float(prop_value_str)
-                    elif prop_value_str.lower() in ('true', 'false'):
-                        active_obj[prop_name] = prop_value_str.lower() == 'true'
-                    else:
-                        active_obj[prop_name] = prop_value_str
-                except Exception as e:
-                    self.report({'ERROR'}, f"Error setting property '{prop_name}': {str(e)}")
+                result = self.stage_set(transaction, active_obj, *args)
+            if result is None:
+                return {'CANCELLED'}
+            if result:
+                messages.append(result)
+            clear_input |= command in {'link', 'batch', 'set'}
 
-            # Clear the input field after processing other commands
+        try:
+            transaction.commit()
+        except Exception as e:
+            self.report({'ERROR'}, f"Error setting properties, nothing was changed: {str(e)}")
+            return {'CANCELLED'}
+        for level, message in messages:
+            self.report(level, message)
+        if clear_input:
             context.scene.text_of_prop = ""
-        
         return {'FINISHED'}
-    
-    def handle_target_assignment(self, context, text_input, active_obj):
-        """Handle the target-> and target<- syntax for multiple objects"""
-        selected_objects = context.selected_objects
-        
-        if len(selected_objects) < 2:
+
+    def resolve_ref(self, transaction, owners, key):
+        for owner in owners:
+            if transaction.has(owner, key):
+                return transaction.get(owner, key)
+        return None
+
+    def stage_set(self, transaction, active_obj, prop_name, value):
+        """key, value or key, (other key) on the active entity"""
+        kind, value = value
+        if kind == 'ref':
+            owners = [active_obj] + list(getattr(active_obj, 'users_collection', ()))
+            ref_name = value
+            value = self.resolve_ref(transaction, owners, ref_name)
+            if value is None:
+                return ({'WARNING'}, f"Referenced property '{ref_name}' not found")
+        transaction.set(active_obj, prop_name, value)
+        return ()
+
+    def stage_batch(self, context, transaction, active_obj, prop_name, value):
+        """!key, value on the entity of every selected object"""
+        if not prop_name:
+            self.report({'ERROR'}, "No property name specified")
+            return None
+        if not context.selected_objects:
+            self.report({'ERROR'}, "No objects selected")
+            return None
+        kind, value = value
+        if kind == 'ref':
+            # Reference syntax: !team, (other_prop) from the active entity, its collections or the scene
+            ref_name = value
+            owners = [active_obj] + list(context.active_object.users_collection) + [context.scene]
+            value = self.resolve_ref(transaction, owners, ref_name)
+            if value is None:
+                self.report({'ERROR'}, f"Referenced property '{ref_name}' not found")
+                return None
+        targets = entity_targets(context.selected_objects, context)
+        for owner in targets:
+            transaction.set(owner, prop_name, value)
+        return ({'INFO'}, f"Set {prop_name} on {len(targets)} objects/collections")
+
+    def stage_link(self, context, transaction, send_key, name_key, arrow, value):
+        """target-> value: the active entity targets the others, target<- value: the others target it.
+        A key that would make an entity target itself is cleared."""
+        if len(context.selected_objects) < 2:
             self.report({'ERROR'}, "Need at least 2 selected objects for target assignment")
-            return {'CANCELLED'}
-        
-        # Parse the target value
-        if '->' in text_input:
-            direction = '->'
-            value = text_input.split('->', 1)[1].strip()
-        elif '<-' in text_input:
-            direction = '<-'
-            value = text_input.split('<-', 1)[1].strip()
-        else:
-            self.report({'ERROR'}, "Invalid target syntax. Use 'target-> value' or 'target<- value'")
-            return {'CANCELLED'}
-        
+            return None
         if not value:
             self.report({'ERROR'}, "No value specified for target")
-            return {'CANCELLED'}
-        
-        processed_count = 0
+            return None
         cleared_self_refs = 0
-        
-        for obj in selected_objects:
-            try:
-                # Get the appropriate class (object, collection, or scene) for this object
-                target_class_obj, _ = get_class(obj, False, context)
-                
-                if direction == '->':
-                    # Active object gets "target", others get "targetname"
-                    if obj == context.active_object:
-                        # For active object: set target, clear targetname if it would self-reference
-                        target_class_obj["target"] = value
-                        if "targetname" in target_class_obj and target_class_obj["targetname"] == value:
-                            del target_class_obj["targetname"]
-                            cleared_self_refs += 1
-                    else:
-                        # For other objects: set targetname, clear target if it would self-reference
-                        target_class_obj["targetname"] = value
-                        if "target" in target_class_obj and target_class_obj["target"] == value:
-                            del target_class_obj["target"]
-                            cleared_self_refs += 1
-                
-                else:  # direction == '<-'
-                    # Active object gets "targetname", others get "target"
-                    if obj == context.active_object:
-                        # For active object: set targetname, clear target if it would self-reference
-                        target_class_obj["targetname"] = value
-                        if "target" in target_class_obj and target_class_obj["target"] == value:
-                            del target_class_obj["target"]
-                            cleared_self_refs += 1
-                    else:
-                        # For other objects: set target, clear targetname if it would self-reference
-                        target_class_obj["target"] = value
-                        if "targetname" in target_class_obj and target_class_obj["targetname"] == value:
-                            del target_class_obj["targetname"]
-                            cleared_self_refs += 1
-                
-                processed_count += 1
-                
-            except Exception as e:
-                self.report({'WARNING'}, f"Could not process object: {obj.name}")
-        
-        # Clear the input field
-        context.scene.text_of_prop = ""
-        
-        # Report results
+        targets = entity_targets(context.selected_objects, context)
+        for owner, objects in targets.items():
+            sends = (context.active_object in objects) == (arrow == '->')
+            own, other = (send_key, name_key) if sends else (name_key, send_key)
+            transaction.set(owner, own, value)
+            if transaction.get(owner, other) == value:
+                transaction.delete(owner, other)
+                cleared_self_refs += 1
         if cleared_self_refs > 0:
-            self.report({'INFO'}, f"Set target properties on {processed_count} objects, cleared {cleared_self_refs} self-references")
-        else:
-            self.report({'INFO'}, f"Set target properties on {processed_count} objects")
-        
-        return {'FINISHED'}
-
-    def handle_target_assignment2(self, context, text_input, active_obj):
-        """Handle the target-> and target<- syntax for multiple objects"""
-        selected_objects = context.selected_objects
-        
-        if len(selected_objects) < 2:
-            self.report({'ERROR'}, "Need at least 2 selected objects for target assignment")
+            return ({'INFO'}, f"Set target properties on {len(targets)} objects, cleared {cleared_self_refs} self-references")
+        return ({'INFO'}, f"Set target properties on {len(targets)} objects")
+
+    def query_links(self, active_obj, search_value, pairs, searched):
+        """Select the entities linked to search_value. pairs are (keys on the active entity,
+        keys to look up, report wording), tried on the active entity first, then on its collections"""
+        if not search_value:
+            self.report({'ERROR'}, "No value specified")
             return {'CANCELLED'}
         
-        # Parse the target value
-        if '->' in text_input:
-            direction = '->'
-            value = text_input.split('->', 1)[1].strip()
-        elif '<-' in text_input:
-            direction = '<-'
-            value = text_input.split('<-', 1)[1].strip()
-        else:
-            self.report({'ERROR'}, "Invalid target syntax. Use 'target2-> value' or 'target2<- value'")
+        if not active_obj:
+            self.report({'ERROR'}, "No active object selected")
             return {'CANCELLED'}
-        
-        if not value:
-            self.report({'ERROR'}, "No value specified for target")
-            return {'CANCELLED'}
-        
-        processed_count = 0
-        cleared_self_refs = 0
-        
-        for obj in selected_objects:
-            try:
-                # Get the appropriate class (object, collection, or scene) for this object
-                target_class_obj, _ = get_class(obj, False, context)
-                
-                if direction == '->':
-                    # Active object gets "target", others get "targetname"
-                    if obj == context.active_object:
-                        # For active object: set target, clear targetname if it would self-reference
-                        target_class_obj["target2"] = value
-                        if "targetname2" in target_class_obj and target_class_obj["targetname2"] == value:
-                            del target_class_obj["targetname2"]
-                            cleared_self_refs += 1
-                    else:
-                        # For other objects: set targetname, clear target if it would self-reference
-                        target_class_obj["targetname2"] = value
-                        if "target2" in target_class_obj and target_class_obj["target2"] == value:
-                            del target_class_obj["target2"]
-                            cleared_self_refs += 1
-                
-                else:  # direction == '<-'
-                    # Active object gets "targetname", others get "target"
-                    if obj == context.active_object:
-                        # For active object: set targetname, clear target if it would self-reference
-                        target_class_obj["targetname2"] = value
-                        if "target2" in target_class_obj and target_class_obj["target2"] == value:
-                            del target_class_obj["target2"]
-                            cleared_self_refs += 1
-                    else:
-                        # For other objects: set target, clear targetname if it would self-reference
-                        target_class_obj["target2"] = value
-                        if "targetname2" in target_class_obj and target_class_obj["targetname2"] == value:
-                            del target_class_obj["targetname2"]
-                            cleared_self_refs += 1
-                
-                processed_count += 1
-                
-            except Exception as e:
-                self.report({'WARNING'}, f"Could not process object: {obj.name}")
-        
-        # Clear the input field
-        context.scene.text_of_prop = ""
-        
-        # Report results
-        if cleared_self_refs > 0:
-            self.report({'INFO'}, f"Set target properties on {processed_count} objects, cleared {cleared_self_refs} self-references")
-        else:
-            self.report({'INFO'}, f"Set target properties on {processed_count} objects")
-        
-        return {'FINISHED'}
+
+        owners = [(active_obj, "")] + [(coll, " (from collection)") for coll in getattr(active_obj, 'users_collection', ())]
+        for owner, origin in owners:
+            for own_keys, find_keys, wording in pairs:
+                if has_link_value(owner, own_keys, search_value):
+                    selected_count = select_link_owners(link_index.lookup(find_keys, search_value))
+                    self.report({'INFO'}, f"Selected {selected_count} objects {wording} '{search_value}'{origin}")
+                    return {'FINISHED'}
+
+        self.report({'ERROR'}, f"Value '{search_value}' not found in {searched} of the active object or its collections")
+        return {'CANCELLED'}
 
 class MESH_OT_add_bounding_box_vertices(bpy.types.Operator):
     """Add vertices at the corners of the mesh's bounding box"""
@@ -2122,6 +3663,617 @@ class MESH_OT_add_bounding_box_vertices(bpy.types.Operator):
         bpy.ops.object.mode_set(mode=original_mode)
         return {'FINISHED'}
         
+class SpatialIndex:
+    """Uniform grid over the world bounding boxes of brushes and the origins of entities.
+
+    Built in bulk from foreach_get over the scene's matrices and bounding boxes, then kept
+    current from the depsgraph: moved, edited, new or deleted objects are re-indexed one by one
+    on the next query. Candidates come from the grid cells, the exact box test runs in numpy.
+    Objects spanning more than max_cells cells are kept in a separate list every query checks."""
+    BRUSH, ENTITY = 1, 2
+    brush_types = ('worldspawn', 'brush_ent', 'brush_ent_group')
+    entity_types = ('point_ent', 'model')
+    max_cells = 64
+
+    def __init__(self, cell=16.0):
+        self.cell = cell
+        self.invalidate()
+
+    def invalidate(self, *args):
+        self.valid = False
+        self.dirty = set()
+
+    def classify(self, obj, context):
+        kind = get_class(obj, False, context)[1]
+        if kind in self.brush_types and obj.type == 'MESH':
+            return self.BRUSH
+        if kind in self.entity_types:
+            return self.ENTITY
+        return 0
+
+    def world_boxes(self, objects, kinds):
+        """(n, 3) minimum and maximum corners, entities as points"""
+        n = len(objects)
+        matrices = np.empty(n * 16, dtype=np.float32)
+        boxes = np.empty(n * 24, dtype=np.float32)
+        objects.foreach_get("matrix_world", matrices)
+        objects.foreach_get("bound_box", boxes)
+        matrices = matrices.reshape(n, 4, 4).transpose(0, 2, 1) # column-major in memory
+        corners = np.einsum('nij,nkj->nki', matrices[:, :3, :3], boxes.reshape(n, 8, 3)) + matrices[:, None, :3, 3]
+        lo, hi = corners.min(axis=1), corners.max(axis=1)
+        points = kinds == self.ENTITY
+        lo[points] = hi[points] = matrices[points, :3, 3]
+        return lo.astype(np.float64), hi.astype(np.float64)
+
+    def build(self, context):
+        objects = context.scene.objects
+        kinds = np.array([self.classify(obj, context) for obj in objects], dtype=np.int8)
+        self.lo, self.hi = self.world_boxes(objects, kinds)
+        self.names = [obj.name for obj in objects]
+        self.kinds = kinds
+        self.rows = {name: row for row, name in enumerate(self.names)}
+        self.cells = {}
+        self.large = set()
+        self.cells_of = {}
+        self.insert(np.flatnonzero(kinds))
+        self.valid = True
+        self.dirty = set()
+
+    def cell_range(self, lo, hi):
+        return np.floor(lo / self.cell).astype(int), np.floor(hi / self.cell).astype(int)
+
+    def insert(self, rows):
+        rows = np.asarray(rows, dtype=np.int64)
+        a, b = self.cell_range(self.lo[rows], self.hi[rows])
+        spans = np.prod(b - a + 1, axis=1)
+        for row, a, b, span in zip(rows.tolist(), a.tolist(), b.tolist(), spans.tolist()):
+            if span > self.max_cells:
+                self.large.add(row)
+                self.cells_of[row] = None
+                continue
+            keys = [(x, y, z) for x in range(a[0], b[0] + 1) for y in range(a[1], b[1] + 1) for z in range(a[2], b[2] + 1)]
+            for key in keys:
+                self.cells.setdefault(key, set()).add(row)
+            self.cells_of[row] = keys
+
+    def remove(self, row):
+        keys = self.cells_of.pop(row, None)
+        self.large.discard(row)
+        for key in keys or ():
+            self.cells[key].discard(row)
+
+    def refresh(self, context):
+        """Bring the index up to date: a full build the first time, then only what changed"""
+        if not self.valid:
+            self.build(context)
+            return
+        if not self.dirty:
+            return
+        names, self.dirty = self.dirty, set()
+        added = [name for name in names if name not in self.rows]
+        if added:
+            # room for new objects in one go
+            start = len(self.names)
+            self.names.extend(added)
+            self.rows.update((name, start + i) for i, name in enumerate(added))
+            self.lo = np.vstack((self.lo, np.zeros((len(added), 3))))
+            self.hi = np.vstack((self.hi, np.zeros((len(added), 3))))
+            self.kinds = np.concatenate((self.kinds, np.zeros(len(added), dtype=np.int8)))
+        for name in names:
+            row = self.rows[name]
+            self.remove(row)
+            self.kinds[row] = 0
+            obj = context.scene.objects.get(name)
+            kind = self.classify(obj, context) if obj is not None else 0
+            if kind == 0:
+                continue
+            matrix = np.array(obj.matrix_world)
+            if kind == self.ENTITY:
+                self.lo[row] = self.hi[row] = matrix[:3, 3]
+            else:
+                corners = np.array(obj.bound_box) @ matrix[:3, :3].T + matrix[:3, 3]
+                self.lo[row], self.hi[row] = corners.min(axis=0), corners.max(axis=0)
+            self.kinds[row] = kind
+            self.insert([row])
+
+    def query_box(self, context, lo, hi, kind=0):
+        """Objects whose box (or origin) overlaps the world box lo..hi, optionally of one kind"""
+        self.refresh(context)
+        lo, hi = np.asarray(lo, dtype=np.float64), np.asarray(hi, dtype=np.float64)
+        a, b = self.cell_range(lo, hi)
+        if np.prod(b - a + 1) > len(self.cells):
+            candidates = np.flatnonzero(self.kinds)
+        else:
+            rows = set(self.large)
+            for x in range(a[0], b[0] + 1):
+                for y in range(a[1], b[1] + 1):
+                    for z in range(a[2], b[2] + 1):
+                        rows.update(self.cells.get((x, y, z), ()))
+            candidates = np.fromiter(rows, dtype=np.int64, count=len(rows))
+        hit = np.all((self.lo[candidates] <= hi) & (self.hi[candidates] >= lo), axis=1)
+        hit &= self.kinds[candidates] != 0
+        if kind:
+            hit &= self.kinds[candidates] == kind
+        objects = context.scene.objects
+        return [obj for obj in (objects.get(self.names[row]) for row in candidates[hit]) if obj is not None]
+
+    def query_point(self, context, point, radius, kind=0):
+        """Objects within radius of point"""
+        point = np.asarray(point, dtype=np.float64)
+        found = self.query_box(context, point - radius, point + radius, kind)
+        rows = np.array([self.rows[obj.name] for obj in found], dtype=np.int64)
+        if not len(rows):
+            return []
+        nearest = np.clip(point, self.lo[rows], self.hi[rows])
+        close = np.linalg.norm(nearest - point, axis=1) <= radius
+        return [obj for obj, keep in zip(found, close) if keep]
+
+    def bounds(self, context, obj):
+        self.refresh(context)
+        row = self.rows.get(obj.name)
+        if row is None or not self.kinds[row]:
+            matrix = np.array(obj.matrix_world)
+            corners = np.array(obj.bound_box) @ matrix[:3, :3].T + matrix[:3, 3]
+            return corners.min(axis=0), corners.max(axis=0)
+        return self.lo[row], self.hi[row]
+
+    def touching(self, context, obj, margin=0.001, kind=BRUSH):
+        """Brushes (by default) whose bounding box touches obj's, obj itself left out"""
+        lo, hi = self.bounds(context, obj)
+        return [other for other in self.query_box(context, lo - margin, hi + margin, kind) if other != obj]
+
+    def inside(self, context, obj, eps=0.001):
+        """Entities whose origin is inside the convex mesh obj"""
+        lo, hi = self.bounds(context, obj)
+        found = self.query_box(context, lo, hi, self.ENTITY)
+        if not found or obj.type != 'MESH' or not len(obj.data.polygons):
+            return found
+        co, corners, face_sizes = mesh_arrays(obj.data, obj.matrix_world)
+        normals, dists, _ = face_planes(co, corners, face_sizes)
+        # orient every plane away from the center, so mirrored or flipped brushes work too
+        flip = normals @ co.mean(axis=0) - dists > 0
+        normals[flip] *= -1
+        dists[flip] *= -1
+        points = np.array([other.matrix_world.translation for other in found])
+        inside = np.all(points @ normals.T - dists <= eps, axis=1)
+        return [other for other, keep in zip(found, inside) if keep and other != obj]
+
+spatial_index = SpatialIndex()
+
+@persistent
+def spatial_index_depsgraph(scene, depsgraph):
+    if not spatial_index.valid:
+        return
+    for update in depsgraph.updates:
+        if isinstance(update.id, bpy.types.Object):
+            spatial_index.dirty.add(update.id.original.name)
+        elif isinstance(update.id, bpy.types.Collection):
+            # objects removed or moved between collections: classes may have changed
+            spatial_index.invalidate()
+            return
+
+@persistent
+def spatial_index_reset(*args):
+    spatial_index.invalidate()
+
+def select_objects(context, objects, keep=()):
+    for obj in context.selected_objects:
+        obj.select_set(False)
+    for obj in list(keep) + list(objects):
+        if obj.visible_get():
+            obj.select_set(True)
+
+class OBJECT_OT_select_touching_brushes(bpy.types.Operator):
+    """Select the brushes whose bounding box touches the active object's"""
+    bl_idname = "object.select_brushes_touching_active"
+    bl_label = "Select Brushes Touching Active"
+    bl_options = {'REGISTER', 'UNDO'}
+
+    margin: FloatProperty(name="Margin", default=0.001, min=0.0, description="Gap still counted as touching")
+
+    def execute(self, context):
+        active = context.active_object
+        if active is None:
+            self.report({'ERROR'}, "No active object")
+            return {'CANCELLED'}
+        found = spatial_index.touching(context, active, self.margin)
+        select_objects(context, found, keep=[active])
+        self.report({'INFO'}, f"Selected {len(found)} brushes")
+        return {'FINISHED'}
+
+class OBJECT_OT_select_entities_inside(bpy.types.Operator):
+    """Select the entities whose origin is inside the active brush"""
+    bl_idname = "object.select_entities_inside_brush"
+    bl_label = "Select Entities Inside Brush"
+    bl_options = {'UNDO'}
+
+    def execute(self, context):
+        active = context.active_object
+        if active is None or active.type != 'MESH':
+            self.report({'ERROR'}, "Active object is not a brush")
+            return {'CANCELLED'}
+        found = spatial_index.inside(context, active)
+        select_objects(context, found, keep=[active])
+        self.report({'INFO'}, f"Selected {len(found)} entities")
+        return {'FINISHED'}
+
+class ProxyChunks:
+    """Proxy mode: unselected worldspawn brushes are merged into one display mesh per spatial
+    chunk, kept in an "_editor" collection so export skips them, while the brushes themselves
+    are hidden from the viewport but still exported. Hiding takes them out of the depsgraph, so
+    brushes with viewport modifiers are never chunked: they stay visible and export evaluated.
+
+    Selecting a chunk opens it: its brushes come back and the proxy goes. Once the selection has
+    been inside the chunk and left it, the chunk is rebuilt from its brushes, as is the chunk of
+    any new or edited brush that is no longer selected. Only those chunks are rebuilt."""
+    collection_name = "trenchcoat_editor"
+
+    def __init__(self):
+        self.loose = set() # visible brush names waiting to go back into a chunk
+        self.open_keys = {} # chunk key -> whether the selection has been inside it since
+
+    def reset(self):
+        self.loose.clear()
+        self.open_keys.clear()
+
+    def is_brush(self, obj, context):
+        """Worldspawn brush that can go into a chunk"""
+        return (has_brush_geometry(obj) and not any(mod.show_viewport for mod in obj.modifiers)
+                and get_class(obj, False, context)[1] == 'worldspawn')
+
+    def key(self, obj, size):
+        corners = np.array(obj.bound_box)
+        matrix = np.array(obj.matrix_world)
+        center = (corners.min(axis=0) + corners.max(axis=0)) / 2 @ matrix[:3, :3].T + matrix[:3, 3]
+        return tuple(int(i) for i in np.floor(center / size))
+
+    def collection(self, scene):
+        collection = bpy.data.collections.get(self.collection_name)
+        if collection is None:
+            collection = bpy.data.collections.new(self.collection_name)
+        if collection.name not in scene.collection.children:
+            scene.collection.children.link(collection)
+        return collection
+
+    def chunks(self):
+        collection = bpy.data.collections.get(self.collection_name)
+        return {obj.name: obj for obj in collection.objects if "tc_sources" in obj} if collection else {}
+
+    def chunk_name(self, key):
+        return "proxy_chunk_{}_{}_{}".format(*key)
+
+    def build(self, context, key, objects):
+        """(Re)build one chunk from objects, merged in world space with their materials"""
+        name = self.chunk_name(key)
+        chunk = bpy.data.objects.get(name)
+        if chunk is None:
+            chunk = bpy.data.objects.new(name, bpy.data.meshes.new(name))
+            self.collection(context.scene).objects.link(chunk)
+        mesh = chunk.data
+        cos, corners, sizes, indices, materials = [], [], [], [], []
+        offset = 0
+        for obj in objects:
+            co, obj_corners, face_sizes = mesh_arrays(obj.data, obj.matrix_world)
+            index = np.zeros(len(face_sizes), dtype=np.int64)
+            obj.data.polygons.foreach_get("material_index", index)
+            remap = []
+            for slot in obj.material_slots:
+                if slot.material not in materials:
+                    materials.append(slot.material)
+                remap.append(materials.index(slot.material))
+            indices.append(np.array(remap or [0])[np.minimum(index, max(len(remap) - 1, 0))])
+            cos.append(co)
+            corners.append(obj_corners + offset)
+            sizes.append(face_sizes)
+            offset += len(co)
+            obj.hide_viewport = True
+        co, corners, sizes = np.concatenate(cos), np.concatenate(corners), np.concatenate(sizes)
+        mesh.clear_geometry()
+        mesh.materials.clear()
+        for material in materials:
+            mesh.materials.append(material)
+        mesh.vertices.add(len(co))
+        mesh.vertices.foreach_set("co", co.astype(np.float32).ravel())
+        mesh.loops.add(len(corners))
+        mesh.loops.foreach_set("vertex_index", corners.astype(np.int32))
+        mesh.polygons.add(len(sizes))
+        mesh.polygons.foreach_set("loop_start", (np.cumsum(sizes) - sizes).astype(np.int32))
+        mesh.polygons.foreach_set("material_index", np.concatenate(indices).astype(np.int32))
+        mesh.update()
+        chunk["tc_sources"] = [obj.name for obj in objects]
+        chunk["tc_key"] = list(key)
+        return chunk
+
+    def add(self, context, key, objects):
+        """Put objects into the chunk at key, next to the brushes it holds already"""
+        chunk = bpy.data.objects.get(self.chunk_name(key))
+        sources = [bpy.data.objects.get(name) for name in chunk["tc_sources"]] if chunk else []
+        sources = [obj for obj in sources if obj is not None and obj not in objects]
+        self.build(context, key, sources + list(objects))
+
+    def open(self, chunk):
+        for name in chunk["tc_sources"]:
+            obj = bpy.data.objects.get(name)
+            if obj is not None:
+                obj.hide_viewport = False
+                self.loose.add(name)
+        self.open_keys[tuple(chunk["tc_key"])] = False
+        mesh = chunk.data
+        bpy.data.objects.remove(chunk)
+        bpy.data.meshes.remove(mesh)
+
+    def enable(self, context):
+        size = context.scene.tc_proxy_chunk
+        groups = {}
+        for obj in context.scene.objects:
+            if obj.hide_viewport or not self.is_brush(obj, context):
+                continue
+            if obj.select_get():
+                self.loose.add(obj.name)
+            else:
+                groups.setdefault(self.key(obj, size), []).append(obj)
+        for key, objects in groups.items():
+            self.add(context, key, objects)
+        return len(groups)
+
+    def disable(self, context):
+        for chunk in self.chunks().values():
+            self.open(chunk)
+        collection = bpy.data.collections.get(self.collection_name)
+        if collection is not None and not collection.all_objects:
+            bpy.data.collections.remove(collection)
+        self.reset()
+
+    def settle(self, context):
+        """Open selected chunks and put brushes the selection has left back into theirs"""
+        size = context.scene.tc_proxy_chunk
+        selected = context.selected_objects
+        for chunk in self.chunks().values():
+            if chunk.select_get():
+                self.open(chunk)
+        selected_keys = {self.key(obj, size) for obj in selected if obj.type == 'MESH'}
+        for key, touched in list(self.open_keys.items()):
+            if key in selected_keys:
+                self.open_keys[key] = True
+            elif touched:
+                del self.open_keys[key]
+        groups = {}
+        for name in list(self.loose):
+            obj = context.scene.objects.get(name)
+            if obj is None or obj.hide_viewport or not self.is_brush(obj, context):
+                self.loose.discard(name)
+                continue
+            if obj.select_get() or obj.mode == 'EDIT':
+                continue
+            key = self.key(obj, size)
+            if key not in self.open_keys:
+                groups.setdefault(key, []).append(obj)
+                self.loose.discard(name)
+        for key, objects in groups.items():
+            self.add(context, key, objects)
+
+proxy_chunks = ProxyChunks()
+
+def proxy_chunks_tick():
+    context = bpy.context
+    if context.scene is not None and context.scene.tc_proxy_mode and context.mode == 'OBJECT':
+        proxy_chunks.settle(context)
+    return None
+
+@persistent
+def proxy_chunks_depsgraph(scene, depsgraph):
+    if not scene.tc_proxy_mode:
+        return
+    for update in depsgraph.updates:
+        if isinstance(update.id, bpy.types.Object) and update.id.type == 'MESH' and "tc_sources" not in update.id:
+            proxy_chunks.loose.add(update.id.name)
+    # the data can't be changed from inside the depsgraph update
+    if not bpy.app.timers.is_registered(proxy_chunks_tick):
+        bpy.app.timers.register(proxy_chunks_tick, first_interval=0.2)
+
+@persistent
+def proxy_chunks_reset(*args):
+    proxy_chunks.reset()
+
+def update_proxy_mode(self, context):
+    if self.tc_proxy_mode:
+        proxy_chunks.enable(context)
+    else:
+        proxy_chunks.disable(context)
+
+LEAK_PATH = "leak_path"
+
+def draw_leak_path(context, points):
+    """Show points (map units) as a polyline in the editor collection, remove it for None"""
+    obj = bpy.data.objects.get(LEAK_PATH)
+    if points is None:
+        if obj is not None:
+            curve = obj.data
+            bpy.data.objects.remove(obj)
+            bpy.data.curves.remove(curve)
+        return None
+    if obj is None:
+        curve = bpy.data.curves.new(LEAK_PATH, 'CURVE')
+        curve.dimensions = '3D'
+        curve.bevel_depth = 0.2
+        obj = bpy.data.objects.new(LEAK_PATH, curve)
+        obj.show_in_front = True
+        proxy_chunks.collection(context.scene).objects.link(obj)
+    curve = obj.data
+    curve.splines.clear()
+    spline = curve.splines.new('POLY')
+    spline.points.add(len(points) - 1)
+    spline.points.foreach_set("co", np.column_stack((points / 10, np.ones(len(points)))).ravel())
+    return obj
+
+class OBJECT_OT_check_leaks(bpy.types.Operator):
+    """Flood fill the map from outside and draw the path the void takes to a point entity, without compiling"""
+    bl_idname = "object.check_leaks"
+    bl_label = "Check Leaks"
+    bl_options = {'REGISTER', 'UNDO'}
+
+    resolution: FloatProperty(name="Resolution", default=16.0, min=1.0,
+        description="Voxel size in map units, gaps narrower than this are not found")
+
+    def execute(self, context):
+        start = time.perf_counter()
+        try:
+            ir = MapExportJob(models=False).build_ir(context)
+        except MapExportError as error:
+            self.report({'ERROR'}, str(error))
+            return {'CANCELLED'}
+        leaks = find_leaks(ir, self.resolution)
+        # a spawn point in the void is what fails the compile, show that one first
+        leaks.sort(key=lambda leak: not leak[1].startswith("info_player"))
+        path = draw_leak_path(context, leaks[0][2] if leaks else None)
+        elapsed = time.perf_counter() - start
+        if not leaks:
+            self.report({'INFO'}, f"No leaks ({elapsed:.2f} s)")
+            return {'FINISHED'}
+        names = [ir.strings[ir.ent_name[ent]] for ent, classname, points in leaks]
+        shown = ", ".join(names[:10]) + (f" and {len(names) - 10} more" if len(names) > 10 else "")
+        self.report({'WARNING'}, f"Leak: {len(leaks)} entities reach the void, path to {names[0]} in '{path.name}' ({elapsed:.2f} s): {shown}")
+        return {'FINISHED'}
+
+class BrushValidator:
+    """Scene-wide brush check that runs in short slices from a timer so the UI stays responsive.
+    Results are cached per mesh hash, edited objects are re-queued from the depsgraph handler"""
+    budget = 0.02 # seconds of work per timer tick
+    brush_types = ('worldspawn', 'brush_ent', 'brush_ent_group')
+
+    def __init__(self):
+        self.cache = {}
+        self.results = {}
+        self.queue = []
+        self.queued = set()
+        self.active = False
+        self.published = 0.0
+
+    def reset(self):
+        self.__init__()
+        publish_brush_issues(self.results)
+
+    def add(self, names):
+        for name in names:
+            if name not in self.queued:
+                self.queued.add(name)
+                self.queue.append(name)
+        if not bpy.app.timers.is_registered(brush_validator_tick):
+            bpy.app.timers.register(brush_validator_tick, first_interval=0.1)
+
+    def check_all(self, context):
+        self.active = True
+        self.results.clear()
+        self.add(obj.name for obj in context.scene.objects if obj.type == 'MESH')
+
+    def check(self, obj, context, grid):
+        if get_class(obj, False, context)[1] not in self.brush_types:
+            return []
+        co, corners, face_sizes = mesh_arrays(obj.data, obj.matrix_world)
+        co *= 10
+        digest = hashlib.sha1(co.tobytes() + corners.tobytes() + face_sizes.tobytes())
+        key = (digest.hexdigest(), grid)
+        if key not in self.cache:
+            self.cache[key] = brush_issues(co, corners, face_sizes, grid * 10)
+        return self.cache[key]
+
+    def step(self):
+        """Work through the queue for one time slice, return False when done"""
+        context = bpy.context
+        if context.scene is None:
+            return True
+        grid = float(context.scene.grid_size)
+        start = time.perf_counter()
+        while self.queue and time.perf_counter() - start < self.budget:
+            name = self.queue.pop()
+            self.queued.discard(name)
+            obj = context.scene.objects.get(name)
+            issues = self.check(obj, context, grid) if obj and obj.type == 'MESH' else []
+            if issues:
+                self.results[name] = issues
+            else:
+                self.results.pop(name, None)
+        if not self.queue or start - self.published > 1.0:
+            self.published = start
+            publish_brush_issues(self.results)
+        return bool(self.queue)
+
+brush_validator = BrushValidator()
+
+def brush_validator_tick():
+    return 0.05 if brush_validator.step() else None
+
+def publish_brush_issues(results):
+    """Copy the results into the list shown in the panel"""
+    wm = bpy.context.window_manager
+    if wm is None:
+        return
+    wm.tc_brush_issues.clear()
+    for name, issues in results.items():
+        item = wm.tc_brush_issues.add()
+        item.name = name
+        item.issues = ", ".join(issues)
+    for window in wm.windows:
+        for area in window.screen.areas:
+            if area.type == 'VIEW_3D':
+                area.tag_redraw()
+
+@persistent
+def brush_validator_depsgraph(scene, depsgraph):
+    if not brush_validator.active:
+        return
+    names = [update.id.name for update in depsgraph.updates
+             if isinstance(update.id, bpy.types.Object) and (update.is_updated_geometry or update.is_updated_transform)]
+    if names:
+        brush_validator.add(names)
+
+@persistent
+def brush_validator_load(dummy):
+    brush_validator.reset()
+
+def select_brush_issue(self, context):
+    if 0 <= self.tc_brush_issue_index < len(self.tc_brush_issues):
+        obj = context.scene.objects.get(self.tc_brush_issues[self.tc_brush_issue_index].name)
+        if obj and context.mode == 'OBJECT':
+            for other in context.selected_objects:
+                other.select_set(False)
+            obj.select_set(True)
+            context.view_layer.objects.active = obj
+
+class TrenchcoatBrushIssue(bpy.types.PropertyGroup):
+    issues: StringProperty(name="Issues")
+
+class TRENCHCOAT_UL_brush_issues(bpy.types.UIList):
+    sort_by_issue: BoolProperty(name="Sort by Issue", default=False, description="Sort by issue instead of by name")
+
+    def draw_item(self, context, layout, data, item, icon, active_data, active_propname):
+        row = layout.row(align=True)
+        row.label(text=item.name, icon='MESH_CUBE')
+        row.label(text=item.issues)
+
+    def draw_filter(self, context, layout):
+        row = layout.row(align=True)
+        row.prop(self, "filter_name", text="")
+        row.prop(self, "sort_by_issue", text="", icon='SORTALPHA')
+
+    def filter_items(self, context, data, propname):
+        items = getattr(data, propname)
+        helper = bpy.types.UI_UL_list
+        flags = helper.filter_items_by_name(self.filter_name, self.bitflag_filter_item, items, "name")
+        key = (lambda item: (item[1].issues, item[1].name)) if self.sort_by_issue else (lambda item: item[1].name)
+        order = helper.sort_items_helper(list(enumerate(items)), key)
+        return flags, order
+
+class OBJECT_OT_check_brushes(bpy.types.Operator):
+    """Check every brush for non-convex, non-planar, degenerate, microscopic or off-grid geometry in the background"""
+    bl_idname = "object.check_brushes"
+    bl_label = "Check Brushes"
+
+    def execute(self, context):
+        brush_validator.check_all(context)
+        self.report({'INFO'}, f"Checking {len(brush_validator.queue)} meshes")
+        return {'FINISHED'}
+
 def cleanup_floating_verts(obj):
     mesh = obj.data
     bm = bmesh.from_edit_mesh(mesh)
@@ -2134,6 +4286,80 @@ def cleanup_floating_verts(obj):
     bmesh.update_edit_mesh(mesh)
     bm.free()
 
+ENTITY_LABELS = {
+    'worldspawn': "worldspawn brush",
+    'brush_ent_group': "group entity",
+    'brush_ent': "brush entity",
+    'point_ent': "point entity",
+    'model': "model",
+    'excluded': "excluded on export",
+}
+
+class PanelModel:
+    """What the sidebar shows about the selection. Rebuilt when the active object changes or
+    after a depsgraph update, rename (msgbus) or property command, never on a plain redraw.
+    Only names and strings are kept, no ID references, so it is safe across undo."""
+    def __init__(self):
+        self.valid = False
+        self.active = 0
+        self.draw_time = 0.0
+
+    def invalidate(self, *args):
+        self.valid = False
+
+    def get(self, context):
+        active = context.active_object
+        pointer = active.as_pointer() if active else 0
+        if not self.valid or pointer != self.active:
+            self.refresh(context, active)
+            self.active = pointer
+            self.valid = True
+        return self
+
+    def refresh(self, context, active):
+        selected = context.selected_objects
+        self.selected = len(selected)
+        self.all_mesh = bool(selected) and all(obj.type == 'MESH' for obj in selected)
+        self.inspector = []
+        self.props = []
+        if active is None:
+            return
+        try:
+            owner, kind = get_class(active, False, context)
+        except IndexError:
+            owner, kind = active, 'None'
+        if kind == 'worldspawn':
+            class_name = "worldspawn"
+        elif kind == 'model':
+            class_name = "misc_model"
+        elif kind == 'excluded':
+            class_name = "unused"
+        elif kind in ENTITY_LABELS:
+            class_name = owner.name.split('.')[0]
+        else:
+            class_name = "none"
+        self.inspector = [f"Selected: {owner.name}", f"Type: {ENTITY_LABELS.get(kind, 'none')}", f"Class: {class_name}"]
+        self.props = [f"{key}: {owner[key]}" for key in custom_keys(owner.keys(), owner)]
+
+panel_model = PanelModel()
+
+@persistent
+def panel_model_depsgraph(scene, depsgraph=None):
+    # moving objects around changes nothing the panel shows
+    if depsgraph is None or not all(isinstance(update.id, bpy.types.Object) and update.is_updated_transform
+                                    and not update.is_updated_geometry for update in depsgraph.updates):
+        panel_model.invalidate()
+
+def panel_model_subscribe():
+    bpy.msgbus.clear_by_owner(panel_model)
+    for key in ((bpy.types.Object, "name"), (bpy.types.Collection, "name"), (bpy.types.LayerObjects, "active")):
+        bpy.msgbus.subscribe_rna(key=key, owner=panel_model, args=(), notify=panel_model.invalidate)
+
+@persistent
+def panel_model_load(dummy):
+    panel_model.invalidate()
+    panel_model_subscribe()
+
 class OBJECT_PT_snap_all_to_grid_panel(bpy.types.Panel):
     """Creates a Panel in the Object properties window"""
     bl_label = "Trenchcoat"
@@ -2143,7 +4369,8 @@ class OBJECT_PT_snap_all_to_grid_panel(bpy.types.Panel):
     bl_category = 'Trenchcoat'
 
     def draw(self, context):
-
+        start = time.perf_counter()
+        model = panel_model.get(context)
         layout = self.layout
         obj = context.active_object
         snapset1 = context.scene.snapset1
@@ -2167,7 +4394,7 @@ class OBJECT_PT_snap_all_to_grid_panel(bpy.types.Panel):
                     row.prop(context.scene, "snap_alone", text = "", icon="TRACKER", toggle=True)
                 else:
                     row.prop(context.scene, "snap_alone", text = "", icon="TRACKER", toggle=True)               
-            elif obj.type == 'MESH' and obj.data and len(obj.data.vertices) > 0:
+            elif has_brush_geometry(obj):
                 row = box.row(align=True)
                 row.operator("object.snap_selected_to_grid", text = "Snap Vertices to Grid", icon="SNAP_GRID")  
             else:
@@ -2193,9 +4420,10 @@ class OBJECT_PT_snap_all_to_grid_panel(bpy.types.Panel):
                 row.operator("object.create_player_cube", text = "Player", icon="OUTLINER_OB_ARMATURE")
                 row.operator("object.create_item_cube", text = "Item", icon="GEOMETRY_SET")
                 row.operator("object.create_entity_cube", text = "Entity", icon="TRACKER")
+                row.operator("object.spawn_entities", text = "", icon="PARTICLE_POINT")
                 row = layout.row(align=True)
                 row.scale_x = 2.3
-                if len(context.selected_objects) > 0 and len([o for o in context.selected_objects if o.type == 'MESH']) == len(context.selected_objects):
+                if model.all_mesh:
                     row.operator("object.duplicate_shared", text = "Symmetrize", icon="MOD_MIRROR")
                     split = row.split(factor=1.0)
                     split.prop(context.scene, "mirror_axis", text = "")                    
@@ -2205,6 +4433,11 @@ class OBJECT_PT_snap_all_to_grid_panel(bpy.types.Panel):
             split = row.split(factor=0.72)
             split.operator("mesh.add_bounding_box_vertices", text = "Shape To Bounding Box", icon="FULLSCREEN_ENTER")
             split.operator("object.create_skybox", text = "Room", icon="MOD_SOLIDIFY")
+            if context.mode == 'OBJECT':
+                row = layout.row(align=True)
+                row.label(text="Select:")
+                row.operator("object.select_brushes_touching_active", text = "Touching", icon="SELECT_INTERSECT")
+                row.operator("object.select_entities_inside_brush", text = "Inside", icon="SELECT_SUBTRACT")
             box2 = layout.box()
             row = box2.row()
             row.label(text="Set Origin To:")
@@ -2212,7 +4445,7 @@ class OBJECT_PT_snap_all_to_grid_panel(bpy.types.Panel):
             if bpy.context.object.mode == 'EDIT':
                 row.operator("object.set_origin_to_selected", text = "Vertex")
             else:
-                if len(context.selected_objects) > 1 and len([o for o in context.selected_objects if o.type == 'MESH']) == len(context.selected_objects):
+                if model.selected > 1 and model.all_mesh:
                     row.operator("object.set_origin_to_active", text = "Active")                
             row.operator("object.set_origin_to_median", text = "Geometry")
             row.operator("object.set_origin_to_world", text = "World")                    
@@ -2253,11 +4486,20 @@ class OBJECT_PT_snap_all_to_grid_panel(bpy.types.Panel):
             split.operator("object.popfront", text = "In Front On/Off", icon="ZOOM_SELECTED")
         split.alert = False
         split.operator("object.popfront_reset", text = "", icon="ZOOM_PREVIOUS")
-        if global_list_of_things == []:
+        if context.space_data.local_view is None:
             split.operator("object.solo_brush", text=f"Solo", icon="HIDE_OFF")
         else:
             split.operator("object.solo_brush", text=f"Reset", icon="HIDE_ON")
 
+        row = layout.row(align=True)
+        split = row.split(factor=0.60)
+        split.prop(context.scene, "tc_performance_mode", text="Performance", icon="MOD_TIME", toggle=True)
+        split.operator("view3d.trenchcoat_measure_fps", text="FPS", icon="TIME")
+        row = layout.row(align=True)
+        split = row.split(factor=0.60)
+        split.prop(context.scene, "tc_proxy_mode", text="Proxy Chunks", icon="MESH_GRID", toggle=True)
+        split.prop(context.scene, "tc_proxy_chunk", text="")
+
         row = layout.row(align=True)
         split = row.split(factor=0.60)
         if snapset1:
@@ -2277,73 +4519,63 @@ class OBJECT_PT_snap_all_to_grid_panel(bpy.types.Panel):
         row.label(text="Output:")
         row = box.row(align=True)
         row.operator("export.map", text = "Export .map", icon="MOD_BUILD")
+        if compile_pipeline.state:
+            row = box.row(align=True)
+            row.label(text=compile_pipeline.summary(), icon="CONSOLE")
+            if compile_pipeline.running:
+                row.operator("wm.trenchcoat_cancel_compile", text="", icon="CANCEL")
+        row = box.row(align=True)
+        if brush_validator.queue:
+            row.operator("object.check_brushes", text = f"Checking... {len(brush_validator.queue)} left", icon="VIEWZOOM")
+        else:
+            row.operator("object.check_brushes", text = "Check Brushes", icon="VIEWZOOM")
+        row.operator("object.check_leaks", text = "Check Leaks", icon="MOD_FLUIDSIM")
+        row = box.row(align=True)
+        row.prop(context.scene, "tc_show_links", text="Entity Links", icon="LINKED", toggle=True)
+        row.operator("object.check_entity_links", text="Check Links", icon="VIEWZOOM")
+        if context.scene.tc_show_link_issues and link_graph.key is not None:
+            outdated = link_graph.key != (link_index.version, link_graph.structure, context.scene.name)
+            if not link_graph.issues:
+                box.label(text="No link issues" + (" (outdated)" if outdated else ""), icon="CHECKMARK")
+            elif outdated:
+                box.label(text="Link issues (outdated, check again)", icon="INFO")
+            for i, (issue, value, refs) in enumerate(link_graph.issues[:context.scene.tc_links_shown]):
+                row = box.row(align=True)
+                names = ", ".join(name for kind, name in refs[:3]) + (" ..." if len(refs) > 3 else "")
+                row.label(text=f"{issue} '{value}': {names}", icon="ERROR")
+                row.operator("object.select_link_issue", text="", icon="RESTRICT_SELECT_OFF").index = i
+        if context.scene.tc_show_links:
+            rows = link_index.summary()
+            if not rows:
+                box.label(text="No target, targetname or team keys")
+            for value, senders, receivers, members in rows[:context.scene.tc_links_shown]:
+                row = box.row(align=True)
+                text = f"{value}: {senders} -> {receivers}" + (f", team {members}" if members else "")
+                row.label(text=text, icon="ERROR" if senders and not receivers else "NONE")
+                row.operator("object.select_entity_links", text="", icon="RESTRICT_SELECT_OFF").value = str(value)
+            if len(rows) > context.scene.tc_links_shown:
+                box.prop(context.scene, "tc_links_shown", text=f"Showing of {len(rows)}")
+        if brush_validator.active:
+            box.template_list("TRENCHCOAT_UL_brush_issues", "", context.window_manager, "tc_brush_issues",
+                              context.window_manager, "tc_brush_issue_index", rows=3)
 
         layout = self.layout
         row = layout.row()
         row.label(text="Inspector:")
         if context.active_object:
-            obj, type = get_class(context.active_object, False, context)
-            row = layout.row(align=True)
-            if type != 'excluded':
-                if type == 'worldspawn':
-                    row = layout.row()
-                    row.label(text=f"Selected: {obj.name}")
-                    row = layout.row()
-                    row.label(text=f"Type: worldspawn brush")
-                    row = layout.row()
-                    row.label(text=f"Class: worldspawn")
-                elif type == "brush_ent_group":
-                    row = layout.row()
-                    row.label(text=f"Selected: {obj.name}")
-                    row = layout.row()
-                    row.label(text=f"Type: group entity")
-                    row = layout.row()
-                    collection_name = obj.name.split('.')[0]
-                    row.label(text=f"Class: {collection_name}")
-                elif type == "brush_ent":
-                    row = layout.row()
-                    row.label(text=f"Selected: {obj.name}")
-                    row = layout.row()
-                    row.label(text=f"Type: brush entity")
-                    row = layout.row()
-                    obj_name = obj.name.split('.')[0]
-                    row.label(text=f"Class: {obj_name}")
-                elif type == "point_ent":
-                    row = layout.row()
-                    row.label(text=f"Selected: {obj.name}")
-                    row = layout.row()
-                    row.label(text=f"Type: point entity")
-                    row = layout.row()
-                    obj_name = obj.name.split('.')[0]
-                    row.label(text=f"Class: {obj_name}")
-                else:
-                    row = layout.row()
-                    row.label(text=f"Selected: {obj.name}")
-                    row = layout.row()
-                    row.label(text=f"Type: none")
-                    row = layout.row()
-                    obj_name = obj.name.split('.')[0]
-                    row.label(text=f"Class: none")
-            else:
-                    row = layout.row()
-                    row.label(text=f"Selected: {obj.name}")
-                    row = layout.row()
-                    row.label(text=f"Type: excluded on export")
-                    row = layout.row()
-                    obj_name = obj.name.split('.')[0]
-                    row.label(text=f"Class: unused")
+            for text in model.inspector:
+                row = layout.row()
+                row.label(text=text)
             row = layout.row(align=True)
             row.prop(context.scene, "text_of_prop")
             row.operator("object.add_property_from_text", text = "", icon="CHECKMARK")
-            custom_props = {key: obj[key] for key in obj.keys() 
-                        if not key.startswith(('_', 'cycles_', 'rna_')) and key not in obj.bl_rna.properties}
-            if custom_props:
-                for key, value in custom_props.items():
-                    row = layout.row()
-                    row.label(text=f"{key}: {value}")                                
+            for text in model.props:
+                row = layout.row()
+                row.label(text=text)
         else:
             row = layout.row()
             row.label(text="No object selected")
+        panel_model.draw_time = time.perf_counter() - start
        
 classes = (
     OBJECT_PT_snap_all_to_grid_panel, #Panel
@@ -2371,7 +4603,19 @@ classes = (
     OBJECT_OT_AddPropertyFromText,
     DuplicateMaterial,
     DeleteMaterial,
-    CreateSkyBox
+    CreateSkyBox,
+    TrenchcoatBrushIssue,
+    TRENCHCOAT_UL_brush_issues,
+    OBJECT_OT_check_brushes,
+    OBJECT_OT_select_entity_links,
+    OBJECT_OT_check_entity_links,
+    OBJECT_OT_select_link_issue,
+    OBJECT_OT_spawn_entities,
+    VIEW3D_OT_measure_fps,
+    OBJECT_OT_select_touching_brushes,
+    OBJECT_OT_select_entities_inside,
+    OBJECT_OT_check_leaks,
+    WM_OT_cancel_compile
 
 )
 
@@ -2382,6 +4626,33 @@ def register():
     for cls in classes:
         bpy.utils.register_class(cls)
     bpy.types.TOPBAR_MT_file_export.append(menu_func_export)
+    bpy.types.WindowManager.tc_brush_issues = bpy.props.CollectionProperty(type=TrenchcoatBrushIssue)
+    bpy.types.WindowManager.tc_brush_issue_index = bpy.props.IntProperty(name="Brush Issue", default=-1, update=select_brush_issue)
+    bpy.app.handlers.depsgraph_update_post.append(brush_validator_depsgraph)
+    bpy.app.handlers.load_post.append(brush_validator_load)
+    bpy.types.Scene.tc_performance_mode = bpy.props.BoolProperty(name="Performance Mode", default=False, update=update_performance_mode, description="Suspend the hint cage and entity node modifiers in the viewport, entity dummies show a shared proxy mesh instead")
+    bpy.types.Scene.tc_proxy_mode = bpy.props.BoolProperty(name="Proxy Chunks", default=False, update=update_proxy_mode, description="Draw unselected worldspawn brushes as a few merged meshes, one per chunk. Select a chunk to get its brushes back")
+    bpy.types.Scene.tc_proxy_chunk = bpy.props.FloatProperty(name="Chunk Size", default=128.0, min=1.0, description="Edge length of a proxy chunk, in Blender units")
+    bpy.app.handlers.depsgraph_update_post.append(proxy_chunks_depsgraph)
+    bpy.app.handlers.depsgraph_update_post.append(spatial_index_depsgraph)
+    for handlers in (bpy.app.handlers.undo_post, bpy.app.handlers.redo_post, bpy.app.handlers.load_post):
+        handlers.append(spatial_index_reset)
+    for handlers in (bpy.app.handlers.undo_post, bpy.app.handlers.redo_post, bpy.app.handlers.load_post):
+        handlers.append(proxy_chunks_reset)
+    bpy.types.Scene.tc_show_links = bpy.props.BoolProperty(name="Entity Links", default=False, description="List target, targetname and team values with the number of entities sending and receiving them")
+    bpy.types.Scene.tc_links_shown = bpy.props.IntProperty(name="Links Shown", default=20, min=1, description="How many entity link values to list")
+    bpy.app.handlers.depsgraph_update_post.append(link_index_depsgraph)
+    bpy.app.handlers.depsgraph_update_post.append(link_graph_depsgraph)
+    bpy.app.handlers.depsgraph_update_post.append(panel_model_depsgraph)
+    for handlers in (bpy.app.handlers.undo_post, bpy.app.handlers.redo_post):
+        handlers.append(panel_model_depsgraph)
+    bpy.app.handlers.load_post.append(panel_model_load)
+    for handlers in (bpy.app.handlers.undo_post, bpy.app.handlers.redo_post, bpy.app.handlers.load_post):
+        handlers.append(data_registry_reset)
+    panel_model_subscribe()
+    bpy.types.Scene.tc_show_link_issues = bpy.props.BoolProperty(name="Link Issues", default=False)
+    for handlers in (bpy.app.handlers.undo_post, bpy.app.handlers.redo_post, bpy.app.handlers.load_post):
+        handlers.append(link_index_reset)
     bpy.types.Scene.text_of_prop = bpy.props.StringProperty(name="", default="", description="commands:\n[<key>, <value>] to set key and value pairs\n[<key>, (<key>)] to assign other key's value\n[!<key>, value] sets key and value on all selected entities\n[del <key>, <key2>, etc.] to delete keys\n[del all] to delete all keys\n[get <key>] to return key's value into the text box\n[target<- <name>] to set target and targetname on selected objects, target being self.\n[target-> <name>] to set target and targetname on selected objects, target being others\n[? <name>] select referenced entities\n[?? <name>] select similar purpose entities")
     bpy.types.Scene.snapset1 = bpy.props.BoolProperty(name="Snapset1", default=False, description="Snapping set 1")
     bpy.types.Scene.hintcage = bpy.props.BoolProperty(name="Hint Cage", default=False, description="Generate Convex Hint Cage On Brush")
@@ -2423,6 +4694,40 @@ def unregister():
     for cls in classes:
         bpy.utils.unregister_class(cls)
     bpy.types.TOPBAR_MT_file_export.remove(menu_func_export)
+    bpy.app.handlers.depsgraph_update_post.remove(brush_validator_depsgraph)
+    bpy.app.handlers.load_post.remove(brush_validator_load)
+    bpy.app.handlers.depsgraph_update_post.remove(link_index_depsgraph)
+    bpy.app.handlers.depsgraph_update_post.remove(link_graph_depsgraph)
+    bpy.app.handlers.depsgraph_update_post.remove(panel_model_depsgraph)
+    for handlers in (bpy.app.handlers.undo_post, bpy.app.handlers.redo_post):
+        handlers.remove(panel_model_depsgraph)
+    bpy.app.handlers.load_post.remove(panel_model_load)
+    for handlers in (bpy.app.handlers.undo_post, bpy.app.handlers.redo_post, bpy.app.handlers.load_post):
+        handlers.remove(data_registry_reset)
+    bpy.msgbus.clear_by_owner(panel_model)
+    del bpy.types.Scene.tc_show_link_issues
+    for handlers in (bpy.app.handlers.undo_post, bpy.app.handlers.redo_post, bpy.app.handlers.load_post):
+        handlers.remove(link_index_reset)
+    del bpy.types.Scene.tc_show_links
+    del bpy.types.Scene.tc_performance_mode
+    bpy.app.handlers.depsgraph_update_post.remove(proxy_chunks_depsgraph)
+    bpy.app.handlers.depsgraph_update_post.remove(spatial_index_depsgraph)
+    for handlers in (bpy.app.handlers.undo_post, bpy.app.handlers.redo_post, bpy.app.handlers.load_post):
+        handlers.remove(spatial_index_reset)
+    for handlers in (bpy.app.handlers.undo_post, bpy.app.handlers.redo_post, bpy.app.handlers.load_post):
+        handlers.remove(proxy_chunks_reset)
+    if bpy.app.timers.is_registered(proxy_chunks_tick):
+        bpy.app.timers.unregister(proxy_chunks_tick)
+    del bpy.types.Scene.tc_proxy_mode
+    del bpy.types.Scene.tc_proxy_chunk
+    del bpy.types.Scene.tc_links_shown
+    if bpy.app.timers.is_registered(brush_validator_tick):
+        bpy.app.timers.unregister(brush_validator_tick)
+    compile_pipeline.cancel()
+    if bpy.app.timers.is_registered(compile_pipeline_tick):
+        bpy.app.timers.unregister(compile_pipeline_tick)
+    del bpy.types.WindowManager.tc_brush_issues
+    del bpy.types.WindowManager.tc_brush_issue_index
     del bpy.types.Scene.snapset1
     del bpy.types.Scene.automerge
     del bpy.types.Scene.snap
@@ -0,0 +1,332 @@
+# Throughput benchmarks for the Trenchcoat addon (trenchcoat_2_5.py).
+#
+# Run headless from the repository folder:
+#     blender --background --factory-startup --python trenchcoat_bench.py -- [benchmark [count]]
+#
+# Every benchmark builds its own scene, so they can be run one at a time.
+# "write_node_library" instead saves the prebuilt node groups to trenchcoat_nodes.blend.
+
+import bpy, bmesh, os, sys, time, random, tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import trenchcoat_2_5 as trenchcoat
+
+def clear_scene():
+    for obj in list(bpy.data.objects):
+        bpy.data.objects.remove(obj)
+    for mesh in list(bpy.data.meshes):
+        bpy.data.meshes.remove(mesh)
+
+def blockout(count, name="blockout", spacing=3.0):
+    """count rough boxes on a square layout, slightly off the grid like hand-made blockout"""
+    side = int(count ** 0.5) + 1
+    objs = []
+    for i in range(count):
+        bm = bmesh.new()
+        bmesh.ops.create_cube(bm, size=2.0)
+        for vert in bm.verts:
+            vert.co.x += random.uniform(-0.05, 0.05)
+            vert.co.y += random.uniform(-0.05, 0.05)
+        mesh = bpy.data.meshes.new(name)
+        bm.to_mesh(mesh)
+        bm.free()
+        obj = bpy.data.objects.new(name, mesh)
+        obj.location = ((i % side) * spacing, (i // side) * spacing, 0)
+        bpy.context.scene.collection.objects.link(obj)
+        objs.append(obj)
+    return objs
+
+def select(objs):
+    for obj in bpy.context.view_layer.objects:
+        obj.select_set(False)
+    for obj in objs:
+        obj.select_set(True)
+    bpy.context.view_layer.objects.active = objs[0]
+
+def bench_make_brush(count=300):
+    clear_scene()
+    scene = bpy.context.scene
+    scene.automerge = False
+    scene.snap = True
+    objs = blockout(count)
+    select(objs)
+    start = time.perf_counter()
+    bpy.ops.object.convexhull_brush()
+    elapsed = time.perf_counter() - start
+    print(f"make_brush: {count} meshes in {elapsed:.3f} s, {count / elapsed:.0f} brushes/s")
+
+def bench_link_graph(count=10000):
+    clear_scene()
+    scene = bpy.context.scene
+    for i in range(count):
+        obj = bpy.data.objects.new(f"trigger_multiple.entity.{i}", None)
+        obj.empty_display_type = 'CUBE'
+        obj["targetname"] = f"t{i}"
+        obj["target"] = f"t{(i + 1) % count}" if i % 100 else f"missing{i}"
+        scene.collection.objects.link(obj)
+    start = time.perf_counter()
+    issues = trenchcoat.link_graph.check(bpy.context)
+    first = time.perf_counter() - start
+    start = time.perf_counter()
+    trenchcoat.link_graph.check(bpy.context)
+    cached = time.perf_counter() - start
+    print(f"link_graph: {count} entities, {len(issues)} issues in {first:.3f} s, cached {cached * 1000:.2f} ms")
+
+def bench_set_property(count=5000):
+    clear_scene()
+    scene = bpy.context.scene
+    objs = []
+    for i in range(count):
+        obj = bpy.data.objects.new(f"info_null.entity.{i}", None)
+        obj.empty_display_type = 'CUBE'
+        scene.collection.objects.link(obj)
+        objs.append(obj)
+    select(objs)
+    scene.text_of_prop = "!spawnflags, 4"
+    start = time.perf_counter()
+    bpy.ops.object.add_property_from_text()
+    elapsed = time.perf_counter() - start
+    print(f"set_property: {count} entities in {elapsed:.3f} s")
+
+def bench_panel(count=5000, redraws=1000):
+    """Sidebar cost per redraw: the view-model rebuild (after an edit) against the cached read
+    every other redraw gets. Panel.draw itself can't run without a window, so with the UI
+    open, panel_model.draw_time holds the last real draw."""
+    clear_scene()
+    objs = blockout(count)
+    select(objs)
+    context = bpy.context
+    model = trenchcoat.panel_model
+    start = time.perf_counter()
+    for _ in range(10):
+        model.invalidate()
+        model.get(context)
+    rebuild = (time.perf_counter() - start) / 10
+    start = time.perf_counter()
+    for _ in range(redraws):
+        model.get(context)
+    cached = (time.perf_counter() - start) / redraws
+    print(f"panel: {count} selected, rebuild {rebuild * 1000:.2f} ms, cached redraw {cached * 1e6:.1f} us")
+
+def bench_spawn(count=2000):
+    clear_scene()
+    context = bpy.context
+    points = [(random.uniform(-200, 200), random.uniform(-200, 200), 0) for _ in range(count)]
+    start = time.perf_counter()
+    trenchcoat.spawn_entities(context, 'entity', points[:1])
+    first = time.perf_counter() - start
+    start = time.perf_counter()
+    trenchcoat.spawn_entities(context, 'entity', points)
+    elapsed = time.perf_counter() - start
+    meshes = sum(mesh.name.startswith("null") for mesh in bpy.data.meshes)
+    print(f"spawn: first {first * 1000:.1f} ms, {count} in {elapsed:.3f} s, {meshes} placeholder mesh")
+
+def bench_node_groups(count=0):
+    """Cost of getting every node group into a fresh file, from a library when one is next to the
+    addon, built in code otherwise"""
+    clear_scene()
+    for group in list(bpy.data.node_groups):
+        bpy.data.node_groups.remove(group)
+    trenchcoat.data_registry.clear()
+    start = time.perf_counter()
+    for node, name in trenchcoat.NODE_GROUPS.items():
+        trenchcoat.node_library.load(name, node)
+    elapsed = time.perf_counter() - start
+    source = next((path for path in trenchcoat.node_library.contents if trenchcoat.node_library.contents[path]), "code")
+    print(f"node_groups: {len(trenchcoat.NODE_GROUPS)} groups in {elapsed * 1000:.1f} ms from {source}")
+
+def write_node_library(count=0):
+    """Write trenchcoat_nodes.blend next to the addon, the file NODE_LIBRARY names"""
+    path = os.path.join(os.path.dirname(os.path.abspath(trenchcoat.__file__)), trenchcoat.NODE_LIBRARY)
+    trenchcoat.write_node_library(path)
+    print(f"wrote {path}")
+
+def evaluate_all(context, repeats=3):
+    """Seconds for the depsgraph to re-evaluate every object, what an edit to shared data costs"""
+    start = time.perf_counter()
+    for _ in range(repeats):
+        for obj in context.scene.objects:
+            obj.update_tag()
+        context.view_layer.update()
+    return (time.perf_counter() - start) / repeats
+
+def bench_performance_mode(count=5000):
+    """Depsgraph evaluation with the node modifiers running and suspended. Viewport FPS needs a
+    window: run the FPS button (view3d.trenchcoat_measure_fps) with the toggle off and on."""
+    clear_scene()
+    context = bpy.context
+    for obj in blockout(count):
+        trenchcoat.add_geonode_to_object(obj, "ConvexHullBrush", "convex_hull")
+    trenchcoat.spawn_entities(context, 'player', [(i * 4, -8, 0) for i in range(count // 10)])
+    context.scene.tc_performance_mode = False
+    full = evaluate_all(context)
+    start = time.perf_counter()
+    context.scene.tc_performance_mode = True
+    toggle = time.perf_counter() - start
+    suspended = evaluate_all(context)
+    context.scene.tc_performance_mode = False
+    print(f"performance_mode: {count} brushes + {count // 10} entities, evaluation {full:.3f} s full, "
+          f"{suspended:.3f} s suspended, toggle {toggle:.3f} s")
+
+def bench_proxy_chunks(count=5000):
+    clear_scene()
+    context = bpy.context
+    scene = context.scene
+    brushes = blockout(count, name="brush")
+    select(brushes[:1])
+    full = evaluate_all(context)
+    start = time.perf_counter()
+    scene.tc_proxy_mode = True
+    enable = time.perf_counter() - start
+    chunks = trenchcoat.proxy_chunks.chunks()
+    merged = evaluate_all(context)
+    # put the one selected brush back: only its chunk is rebuilt
+    select(brushes[1:2])
+    start = time.perf_counter()
+    trenchcoat.proxy_chunks.settle(context)
+    rebuild = time.perf_counter() - start
+    scene.tc_proxy_mode = False
+    print(f"proxy_chunks: {count} brushes into {len(chunks)} chunks in {enable:.3f} s, "
+          f"evaluation {full:.3f} s -> {merged:.3f} s, one chunk rebuilt in {rebuild * 1000:.1f} ms")
+
+def bench_spatial_index(count=50000, queries=200):
+    clear_scene()
+    context = bpy.context
+    brushes = blockout(count, name="brush", spacing=2.5)
+    index = trenchcoat.spatial_index
+    index.invalidate()
+    start = time.perf_counter()
+    index.refresh(context)
+    build = time.perf_counter() - start
+    start = time.perf_counter()
+    for obj in random.sample(brushes, queries):
+        index.touching(context, obj)
+    touching = (time.perf_counter() - start) / queries
+    brushes[0].location.x += 1.0
+    index.dirty.add(brushes[0].name)
+    start = time.perf_counter()
+    index.refresh(context)
+    update = time.perf_counter() - start
+    print(f"spatial_index: {count} objects built in {build:.3f} s, touching query {touching * 1000:.2f} ms, "
+          f"one object re-indexed in {update * 1000:.2f} ms")
+
+def slab(name, lo, hi):
+    """Axis-aligned box brush from lo to hi, in Blender units"""
+    bm = bmesh.new()
+    bmesh.ops.create_cube(bm, size=1.0)
+    for vert in bm.verts:
+        vert.co = [l if co < 0 else h for co, l, h in zip(vert.co, lo, hi)]
+    mesh = bpy.data.meshes.new(name)
+    bm.to_mesh(mesh)
+    bm.free()
+    obj = bpy.data.objects.new(name, mesh)
+    bpy.context.scene.collection.objects.link(obj)
+    return obj
+
+def bench_leaks(count=3600):
+    """Arena of count blockout boxes in a room with a gap in one wall, a player spawn inside"""
+    clear_scene()
+    context = bpy.context
+    blockout(count, name="brush")
+    size = (int(count ** 0.5) + 1) * 3.0
+    slab("brush_floor", (-4, -4, -2), (size, size, -1))
+    slab("brush_ceiling", (-4, -4, 40), (size, size, 41))
+    slab("brush_west", (-5, -4, -1), (-4, size, 40))
+    slab("brush_east", (size, -4, -1), (size + 1, size, 40))
+    slab("brush_south", (-4, -5, -1), (size, -4, 40))
+    slab("brush_north", (-4, size, -1), (size, size + 1, 36))
+    trenchcoat.spawn_entities(context, 'player', [(-2, -2, 4)])
+    start = time.perf_counter()
+    bpy.ops.object.check_leaks(resolution=16.0)
+    elapsed = time.perf_counter() - start
+    path = bpy.data.objects.get(trenchcoat.LEAK_PATH)
+    points = len(path.data.splines[0].points) if path else 0
+    print(f"leaks: {count + 6} brushes checked in {elapsed:.3f} s, leak path of {points} points")
+
+def stub_compiler():
+    return f'"{sys.executable}" "{os.path.join(os.path.dirname(os.path.abspath(__file__)), "trenchcoat_stub_compiler.py")}"'
+
+def bench_compile(count=100, seconds=1.0):
+    """The compile pipeline with trenchcoat_stub_compiler.py standing in for the compilers:
+    vis and aas both wait for bsp only, so the run should take about 3 stage lengths, not 4"""
+    clear_scene()
+    blockout(count, name="brush")
+    folder = tempfile.mkdtemp()
+    path = os.path.join(folder, "bench.map")
+    with trenchcoat.FileSink(path) as sink:
+        trenchcoat.export_map(sink, models=False)
+    stub = stub_compiler()
+    stages = trenchcoat.parse_pipeline(f"""
+bsp: {stub} bsp "{{map}}" {seconds}
+vis <- bsp: {stub} vis "{{map}}" {seconds}
+light <- vis: {stub} light "{{map}}" {seconds}
+aas <- bsp: {stub} aas "{{bsp}}" {seconds}
+""")
+    pipeline = trenchcoat.compile_pipeline
+    start = time.perf_counter()
+    pipeline.start(stages, trenchcoat.pipeline_values(path), cwd=folder)
+    # no timers without a window, poll like the timer would
+    while pipeline.poll():
+        time.sleep(pipeline.interval)
+    elapsed = time.perf_counter() - start
+    lines = len(bpy.data.texts[pipeline.log_name].lines)
+    print(f"compile: {len(stages)} stages of {seconds:g} s in {elapsed:.2f} s, {lines} log lines, {pipeline.summary()}")
+
+def bench_build_cache(count=100, seconds=1.0):
+    """Export and compile three times through the operator with the build cache on: a first
+    build, the same map again (restored from the cache), and an item moved (entities only)"""
+    clear_scene()
+    blockout(count, name="brush")
+    item = trenchcoat.spawn_entities(bpy.context, 'item', [(0, -8, 0)])[0]
+    path = os.path.join(tempfile.mkdtemp(), "bench.map")
+    stub = stub_compiler()
+    text = bpy.data.texts.new("bench_pipeline")
+    text.write(f"""bsp: {stub} bsp "{{map}}" {seconds}
+light <- bsp: {stub} light "{{map}}" {seconds}
+aas <- light: {stub} aas "{{bsp}}" {seconds}
+ents: {stub} ents "{{map}}" {seconds / 10}
+""")
+    pipeline = trenchcoat.compile_pipeline
+    for run in ("first", "same", "item moved"):
+        if run == "item moved":
+            item.location.x += 8
+        start = time.perf_counter()
+        bpy.ops.export.map(filepath=path, option_models=False, option_compile=True, option_cache=True,
+                           option_pipeline=text.name)
+        while pipeline.poll():
+            time.sleep(pipeline.interval)
+        print(f"build_cache: {run} export and compile in {time.perf_counter() - start:.2f} s")
+
+BENCHMARKS = {
+    'make_brush': bench_make_brush,
+    'link_graph': bench_link_graph,
+    'set_property': bench_set_property,
+    'panel': bench_panel,
+    'spawn': bench_spawn,
+    'node_groups': bench_node_groups,
+    'performance_mode': bench_performance_mode,
+    'proxy_chunks': bench_proxy_chunks,
+    'spatial_index': bench_spatial_index,
+    'leaks': bench_leaks,
+    'compile': bench_compile,
+    'build_cache': bench_build_cache,
+}
+
+# Not run by default
+TOOLS = {
+    'write_node_library': write_node_library,
+}
+
+def main():
+    args = sys.argv[sys.argv.index('--') + 1:] if '--' in sys.argv else []
+    trenchcoat.register()
+    commands = {**BENCHMARKS, **TOOLS}
+    names = [args[0]] if args else list(BENCHMARKS)
+    for name in names:
+        if len(args) > 1:
+            commands[name](int(args[1]))
+        else:
+            commands[name]()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,29 @@
+# Stand-in for the map compilers, to try Trenchcoat's compile pipeline without them.
+#
+#     python trenchcoat_stub_compiler.py <stage> <file> [seconds] [exit code]
+#
+# Prints progress for the given seconds (1 by default), writes the stage's output next to
+# <file> (aas writes the .aas, every other stage the .bsp) and exits with the exit code.
+# A pipeline stage using it: bsp: python trenchcoat_stub_compiler.py bsp "{map}" 2
+
+import hashlib, os, sys, time
+
+def main():
+    stage, path = sys.argv[1], sys.argv[2]
+    seconds = float(sys.argv[3]) if len(sys.argv) > 3 else 1.0
+    code = int(sys.argv[4]) if len(sys.argv) > 4 else 0
+    steps = 10
+    for step in range(steps):
+        print(f"{stage}: {step * 100 // steps}%", flush=True)
+        time.sleep(seconds / steps)
+    base = os.path.splitext(path)[0]
+    with open(path, 'rb') as source:
+        digest = hashlib.sha1(source.read()).hexdigest()
+    output = base + (".aas" if stage == "aas" else ".bsp")
+    with open(output, 'a') as file:
+        file.write(f"{stage} {digest}\n")
+    print(f"{stage}: wrote {output}", flush=True)
+    sys.exit(code)
+
+if __name__ == "__main__":
+    main()